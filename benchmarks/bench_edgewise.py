@@ -0,0 +1,109 @@
+"""Benchmark the edgewise cost bound with and without the support kernel.
+
+Builds a random multichannel world graph and a template planted in it, then
+times `edgewise_local_costs` using the per-channel sparse slicing path and
+the single pass support kernel. Earlier filters usually leave each template
+node with a fraction of the world as candidates, so the timings are repeated
+for several candidate fractions. Run from the repository root, e.g.
+
+    python benchmarks/bench_edgewise.py --n-world-edges 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+import scipy.sparse as sparse
+
+from uclasm import Graph, MatchingProblem
+from uclasm.matching.local_cost_bound.edgewise import edgewise_local_costs
+
+
+def random_adjs(n_nodes, n_edges, n_channels, rng):
+    """Get adjacency matrices with edges spread uniformly over channels."""
+    adjs = []
+    for _ in range(n_channels):
+        srcs = rng.integers(n_nodes, size=n_edges // n_channels)
+        dsts = rng.integers(n_nodes, size=n_edges // n_channels)
+        is_loop = srcs == dsts
+        adj = sparse.csr_matrix((np.ones(np.sum(~is_loop)),
+                                 (srcs[~is_loop], dsts[~is_loop])),
+                                shape=(n_nodes, n_nodes))
+        adjs.append(adj)
+    return adjs
+
+
+def time_edgewise(smp, use_support_kernel, n_repeats):
+    """Get the best time of several full runs of the edgewise bound."""
+    best_time = np.inf
+    for _ in range(n_repeats):
+        smp._edge_least_costs_cache = {}
+        start_time = time.time()
+        local_costs = edgewise_local_costs(
+            smp, use_support_kernel=use_support_kernel)
+        best_time = min(best_time, time.time() - start_time)
+    return best_time, local_costs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n-world-nodes", type=int, default=100000)
+    parser.add_argument("--n-world-edges", type=int, default=1000000)
+    parser.add_argument("--n-tmplt-nodes", type=int, default=10)
+    parser.add_argument("--n-channels", type=int, default=3)
+    parser.add_argument("--cand-fracs", type=float, nargs="+",
+                        default=[1.0, 0.1, 0.01])
+    parser.add_argument("--n-repeats", type=int, default=3)
+    parser.add_argument("--n-jobs", type=int, default=1,
+                        help="threads for the edgewise bound, -1 for all")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    world_adjs = random_adjs(args.n_world_nodes, args.n_world_edges,
+                             args.n_channels, rng)
+
+    # Plant the template on the highest degree world nodes so it has edges
+    degrees = np.asarray(sum(world_adjs).sum(axis=1)).flatten()
+    tmplt_idxs = np.sort(np.argsort(degrees)[-args.n_tmplt_nodes:])
+    tmplt_adjs = [adj[tmplt_idxs, :][:, tmplt_idxs].tolil()
+                  for adj in world_adjs]
+    # Chain the template nodes together with edges in several channels
+    for idx in range(args.n_tmplt_nodes - 1):
+        tmplt_adjs[idx % args.n_channels][idx, idx + 1] = 1
+        tmplt_adjs[(idx + 1) % args.n_channels][idx + 1, idx] = 1
+    tmplt_adjs = [adj.tocsr() for adj in tmplt_adjs]
+
+    tmplt = Graph(tmplt_adjs)
+    world = Graph(world_adjs)
+    print("World: {} nodes, {} edges, {} channels".format(
+        world.n_nodes, sum(adj.nnz for adj in world.adjs), world.n_channels))
+    print("Template: {} nodes, {} neighbor pairs".format(
+        tmplt.n_nodes, len(tmplt.nbr_idx_pairs)))
+
+    start_time = time.time()
+    world.sym_edge_counts
+    tmplt.sym_edge_counts
+    print("Building sym_edge_counts: {:.3f}s".format(time.time() - start_time))
+
+    print("{:>10} {:>10} {:>10} {:>8}".format(
+        "cand frac", "slicing", "kernel", "speedup"))
+    for cand_frac in args.cand_fracs:
+        smp = MatchingProblem(tmplt, world, n_jobs=args.n_jobs)
+        # Rule out all but a random fraction of the candidates
+        is_cand = rng.random(smp.shape) < cand_frac
+        is_cand[np.arange(tmplt.n_nodes), tmplt_idxs] = True
+        smp.global_costs[~is_cand] = 1
+
+        # Compile the kernel before timing it
+        time_edgewise(smp, True, 1)
+
+        slicing_time, slicing_costs = time_edgewise(smp, False,
+                                                    args.n_repeats)
+        kernel_time, kernel_costs = time_edgewise(smp, True, args.n_repeats)
+        assert np.array_equal(slicing_costs, kernel_costs)
+        print("{:>10} {:>9.3f}s {:>9.3f}s {:>7.1f}x".format(
+            cand_frac, slicing_time, kernel_time, slicing_time / kernel_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,8 @@
 """Tests for the cost bounds."""
+import itertools
+import subprocess
+import sys
+
 import pytest
 import uclasm
 from uclasm import Graph, MatchingProblem
@@ -7,6 +11,18 @@ from uclasm.matching import *
 import numpy as np
 from scipy.sparse import csr_matrix
 import pandas as pd
+from uclasm.matching.local_cost_bound.edgewise import edgewise_local_costs, \
+    vectorized_edge_attr_fn, as_vectorized_edge_attr_fn, add_time_costs, \
+    time_constraint_costs, add_geo_costs
+from uclasm.matching.local_cost_bound.geo import has_partner_within, \
+    haversine_distances
+from uclasm.matching.cost_cache import cost_fn_version
+from uclasm.matching.global_cost_bound.from_local_bounds import \
+    decomposed_clap_costs
+from uclasm.matching.global_cost_bound import sparse_clap_costs, \
+    relaxed_clap_costs
+from uclasm.matching.search.search_utils import iterate_to_convergence
+from laptools import clap
 
 
 @pytest.fixture
@@ -108,3 +124,400 @@ class TestEdgewiseCostBound:
             for j in range(3):
                 assert(final_cost[i][j] == smp_noisy_bidirectional.local_costs[i][j])
         assert(np.sum(smp_noisy_bidirectional.candidates()) == 9)
+
+    def test_edgewise_cost_incremental(self, smp_noisy):
+        local_cost_bound.edgewise(smp_noisy)
+        global_cost_bound.from_local_bounds(smp_noisy)
+        assert len(smp_noisy._edge_least_costs_cache) == 2
+        old_cand_counts = smp_noisy.candidate_counts()
+        smp_noisy.prevent_match(0, 0)
+        global_cost_bound.from_local_bounds(smp_noisy)
+        changed_cands = smp_noisy.candidate_counts() != old_cand_counts
+        incremental_costs = edgewise_local_costs(smp_noisy,
+                                                 changed_cands=changed_cands)
+        smp_noisy._edge_least_costs_cache = {}
+        full_costs = edgewise_local_costs(smp_noisy)
+        assert np.array_equal(incremental_costs, full_costs)
+
+    def test_edgewise_cost_support_kernel(self, smp_noisy):
+        kernel_costs = edgewise_local_costs(smp_noisy)
+        smp_noisy._edge_least_costs_cache = {}
+        slicing_costs = edgewise_local_costs(smp_noisy,
+                                             use_support_kernel=False)
+        assert np.array_equal(kernel_costs, slicing_costs)
+
+    def test_edgewise_cost_parallel(self, smp_noisy):
+        serial_costs = edgewise_local_costs(smp_noisy)
+        smp_noisy._edge_least_costs_cache = {}
+        smp_noisy.n_jobs = 2
+        parallel_costs = edgewise_local_costs(smp_noisy)
+        assert np.array_equal(serial_costs, parallel_costs)
+
+
+def weight_diff(tmplt_edge, world_edge, tmplt_attrs, world_attrs,
+                importance_value=None):
+    """Edge attribute cost for the persistent cache tests."""
+    return abs(tmplt_attrs['weight'] - world_attrs['weight'])
+
+
+@pytest.fixture
+def weighted_graph():
+    """Create a graph with weighted edges."""
+    adj = csr_matrix([[0, 1, 0],
+                      [0, 0, 1],
+                      [0, 0, 0]])
+    nodelist = pd.DataFrame(['a', 'b', 'c'], columns=[Graph.node_col])
+    edgelist = pd.DataFrame([['a', 'b', 'c1', 1],
+                             ['b', 'c', 'c1', 2]],
+                            columns=[Graph.source_col, Graph.target_col,
+                                     Graph.channel_col, 'weight'])
+    return Graph([adj], ['c1'], nodelist, edgelist)
+
+
+class TestEdgewiseCostCache:
+    """Tests related to the persistent edgewise cost cache"""
+    def test_reuse(self, weighted_graph, tmp_path):
+        kwargs = dict(edge_attr_fn=weight_diff,
+                      missing_edge_cost_fn=lambda edge: 1,
+                      global_cost_threshold=2, cache_path=str(tmp_path))
+        smp = MatchingProblem(weighted_graph, weighted_graph, **kwargs)
+        costs = edgewise_local_costs(smp)
+        assert len(smp.cost_cache.entries()) == 1
+
+        calls = []
+        def counting_diff(*args, **kwargs):
+            calls.append(args)
+            return weight_diff(*args, **kwargs)
+        # Claim to be the same version as the function which filled the cache
+        smp = MatchingProblem(weighted_graph, weighted_graph,
+                              **dict(kwargs, edge_attr_fn=counting_diff,
+                                     edge_attr_fn_version=cost_fn_version(
+                                         weight_diff)))
+        assert np.array_equal(edgewise_local_costs(smp), costs)
+        assert len(calls) == 0
+
+    def test_key_changes(self, weighted_graph, tmp_path):
+        kwargs = dict(edge_attr_fn=weight_diff,
+                      missing_edge_cost_fn=lambda edge: 1,
+                      global_cost_threshold=2, cache_path=str(tmp_path))
+        smp = MatchingProblem(weighted_graph, weighted_graph,
+                              edge_attr_fn_version="v1", **kwargs)
+        edgewise_local_costs(smp)
+        smp = MatchingProblem(weighted_graph, weighted_graph,
+                              edge_attr_fn_version="v2", **kwargs)
+        edgewise_local_costs(smp)
+        world = weighted_graph.copy()
+        world.edgelist['weight'] = [2, 3]
+        smp = MatchingProblem(weighted_graph, world,
+                              edge_attr_fn_version="v2", **kwargs)
+        edgewise_local_costs(smp)
+        assert len(smp.cost_cache.entries()) == 3
+
+    def test_version_is_stable_across_processes(self):
+        # Nested code objects have a repr which differs between processes
+        code = "\n".join([
+            "from uclasm.matching.cost_cache import cost_fn_version",
+            "def fn(weights):",
+            "    return sum(abs(w) for w in map(lambda w: w - 1, weights))",
+            "print(cost_fn_version(fn))"])
+        versions = [subprocess.run([sys.executable, "-c", code],
+                                   check=True, capture_output=True,
+                                   text=True).stdout
+                    for _ in range(2)]
+        assert versions[0] == versions[1]
+
+    def test_sparse_costs_fail(self, weighted_graph):
+        with pytest.raises(ValueError):
+            MatchingProblem(weighted_graph, weighted_graph,
+                            edge_attr_fn=weight_diff, sparse_costs=True)
+
+    def test_eviction(self, tmp_path):
+        cache = EdgewiseCostCache(str(tmp_path), max_bytes=1000)
+        cache.put("old", np.zeros((10, 10)))
+        cache.put("new", np.ones((10, 10)))
+        assert "old" not in cache
+        assert np.array_equal(cache.get("new"), np.ones((10, 10)))
+        assert cache.get("old") is None
+
+
+@vectorized_edge_attr_fn
+def vectorized_weight_diff(tmplt_edge, world_edges, tmplt_attrs, world_attrs,
+                           importance_value=None):
+    """Batch version of `weight_diff`."""
+    return np.abs(tmplt_attrs['weight'] - world_attrs['weight'])
+
+
+class TestVectorizedEdgeAttrFn:
+    """Tests related to the batch edge attribute function protocol"""
+    @pytest.mark.parametrize("cache_by_unique_attrs", [True, False])
+    def test_matches_scalar(self, weighted_graph, cache_by_unique_attrs):
+        costs = []
+        for edge_attr_fn in [weight_diff, vectorized_weight_diff]:
+            smp = MatchingProblem(weighted_graph, weighted_graph,
+                                  edge_attr_fn=edge_attr_fn,
+                                  missing_edge_cost_fn=lambda edge: 1,
+                                  global_cost_threshold=2)
+            costs.append(edgewise_local_costs(
+                smp, cache_by_unique_attrs=cache_by_unique_attrs))
+        assert np.array_equal(costs[0], costs[1])
+
+    def test_scalar_fallback(self):
+        batch_fn = as_vectorized_edge_attr_fn(weight_diff)
+        costs = batch_fn(None, None, {'weight': 2},
+                         {'weight': np.array([0, 2, 5])})
+        assert np.array_equal(costs, [2, 0, 3])
+        assert as_vectorized_edge_attr_fn(vectorized_weight_diff) \
+            is vectorized_weight_diff
+
+
+class TestDecomposedClapCosts:
+    """Tests related to solving each component of the candidates separately"""
+    def test_matches_whole(self):
+        inf = np.inf
+        costs = np.array([[1, 2, inf, inf],
+                          [3, 1, inf, inf],
+                          [inf, inf, 0, 4]])
+        cache = {}
+        bounds = decomposed_clap_costs(costs, cache=cache)
+        assert np.array_equal(bounds, clap.costs(costs))
+        assert len(cache) == 2
+
+    def test_reuses_unchanged_components(self, monkeypatch):
+        inf = np.inf
+        costs = np.array([[1, 2, inf, inf],
+                          [3, 1, inf, inf],
+                          [inf, inf, 0, 4]])
+        cache = {}
+        decomposed_clap_costs(costs, cache=cache)
+        n_solved = []
+        clap_costs = clap.costs
+        monkeypatch.setattr(clap, "costs",
+                            lambda costs: n_solved.append(1) or clap_costs(costs))
+        costs[2, 3] = 5
+        bounds = decomposed_clap_costs(costs, cache=cache)
+        assert len(n_solved) == 1
+        assert np.array_equal(bounds, clap_costs(costs))
+
+    def test_splits_candidates(self):
+        # Every cost is finite, as on the dense path, but the candidates
+        # split into two components
+        costs = np.array([[1., 2., 5., 6.],
+                          [3., 1., 7., 5.],
+                          [6., 8., 0., 4.]])
+        is_cand = np.array([[True, True, False, False],
+                            [True, True, False, False],
+                            [False, False, True, True]])
+        cache = {}
+        bounds = decomposed_clap_costs(costs, is_cand=is_cand, cache=cache)
+        assert len(cache) == 2
+        expected = clap.costs(np.where(is_cand, costs, np.inf))
+        assert np.array_equal(bounds[is_cand], expected[is_cand])
+        assert np.all(np.isinf(bounds[~is_cand]))
+
+    def test_infeasible_component(self):
+        inf = np.inf
+        costs = np.array([[1, inf, inf],
+                          [2, inf, inf],
+                          [inf, 0, 1]])
+        assert np.all(np.isinf(decomposed_clap_costs(costs)))
+
+
+def brute_force_clap_costs(costs):
+    """Get the smallest assignment cost with each row forced to each column,
+    by trying every assignment."""
+    n_rows, n_cols = costs.shape
+    constrained_costs = np.full(costs.shape, np.inf)
+    for cols in itertools.permutations(range(n_cols), n_rows):
+        cost = costs[np.arange(n_rows), cols].sum()
+        for row_idx, col_idx in enumerate(cols):
+            constrained_costs[row_idx, col_idx] = min(
+                constrained_costs[row_idx, col_idx], cost)
+    return constrained_costs
+
+class TestSparseClapCosts:
+    """Tests related to constrained assignments over sparse candidates"""
+    def test_matches_dense(self):
+        inf = np.inf
+        costs = np.array([[0, 2, inf, 1],
+                          [3, inf, 0, inf],
+                          [inf, 1, 0, 4]])
+        rows, cols = np.nonzero(np.isfinite(costs))
+        sparse_costs = csr_matrix((costs[rows, cols], (rows, cols)),
+                                  shape=costs.shape)
+        bounds = sparse_clap_costs(sparse_costs)
+        assert bounds.nnz == len(rows)
+        assert np.array_equal(bounds.toarray()[rows, cols],
+                              brute_force_clap_costs(costs)[rows, cols])
+
+    @pytest.mark.parametrize("seed", range(4))
+    def test_sparse_costs_backend(self, seed):
+        rng = np.random.default_rng(seed)
+        tmplt = Graph([csr_matrix(rng.random((3, 3)) < 0.5, dtype=float)])
+        world = Graph([csr_matrix(rng.random((5, 5)) < 0.4, dtype=float)])
+        smp = MatchingProblem(tmplt, world, global_cost_threshold=10,
+                              sparse_costs=True)
+        local_cost_bound.nodewise(smp)
+        local_cost_bound.edgewise(smp)
+        costs = smp.local_costs.toarray() / 2 + smp.fixed_costs.toarray()
+        global_cost_bound.from_local_bounds(smp)
+        expected = brute_force_clap_costs(costs)
+        expected[expected > 10] = np.inf
+        assert np.array_equal(smp.global_costs.toarray(), expected)
+
+    @pytest.mark.parametrize("sparse_costs", [False, True])
+    def test_same_candidates(self, smp_noisy, sparse_costs):
+        sparse_smp = MatchingProblem(smp_noisy.tmplt, smp_noisy.world,
+                                     global_cost_threshold=1,
+                                     local_cost_threshold=1,
+                                     sparse_costs=sparse_costs,
+                                     sparse_lap=True)
+        iterate_to_convergence(smp_noisy)
+        iterate_to_convergence(sparse_smp)
+        sparse_cands = sparse_smp.candidates()
+        if sparse_costs:
+            sparse_cands = sparse_cands.toarray()
+        assert np.array_equal(sparse_cands, smp_noisy.candidates())
+
+
+class TestTieredBounds:
+    """Tests related to bounding costs with cheap relaxations first"""
+    def test_relaxed_below_exact(self):
+        inf = np.inf
+        costs = np.array([[0, 2, inf, 1],
+                          [3, inf, 0, inf],
+                          [inf, 1, 0, 4]])
+        relaxed = relaxed_clap_costs(costs)
+        exact = brute_force_clap_costs(costs)
+        assert np.all(relaxed <= exact)
+        assert relaxed[0, 0] == exact[0, 0] == 1
+
+    def test_relaxed_infeasible(self):
+        inf = np.inf
+        costs = np.array([[0, inf, inf],
+                          [1, inf, inf]])
+        assert np.all(np.isinf(relaxed_clap_costs(costs)))
+
+    def test_same_candidates(self, smp_noisy):
+        tiered_smp = MatchingProblem(smp_noisy.tmplt, smp_noisy.world,
+                                     global_cost_threshold=1,
+                                     local_cost_threshold=1,
+                                     tiered_bounds=True)
+        iterate_to_convergence(smp_noisy)
+        iterate_to_convergence(tiered_smp)
+        assert np.array_equal(tiered_smp.candidates(), smp_noisy.candidates())
+
+
+class TestNeighborhoodCostBound:
+    """Tests related to the neighborhood cost bound"""
+    def test_neighbors_need_distinct_candidates(self):
+        # Both neighbors of u can only map to w, so one of them misses its
+        # edge from v
+        tmplt_nodes = pd.DataFrame(['u', 'a', 'b'], columns=[Graph.node_col])
+        tmplt = Graph([csr_matrix([[0, 1, 1],
+                                   [0, 0, 0],
+                                   [0, 0, 0]])], ['c1'], tmplt_nodes)
+        world_nodes = pd.DataFrame(['v', 'w', 'x'], columns=[Graph.node_col])
+        world = Graph([csr_matrix([[0, 1, 0],
+                                   [0, 0, 0],
+                                   [0, 1, 0]])], ['c1'], world_nodes)
+        smp = MatchingProblem(tmplt, world, global_cost_threshold=1)
+        local_cost_bound.edgewise(smp)
+        assert smp.local_costs[0, 0] == 0
+        local_cost_bound.neighborhood(smp)
+        assert smp.local_costs[0, 0] == 1
+
+    def test_iterate_to_convergence(self, smp_noisy):
+        stats = iterate_to_convergence(smp_noisy, neighborhood=True)
+        assert stats["neighborhood"].n_runs == 1
+        # Only the identity is within the threshold
+        assert np.sum(smp_noisy.candidates()) == 3
+
+
+@pytest.fixture
+def smp_timed():
+    """Create a matching problem between two nodes and timed world nodes."""
+    tmplt_nodes = pd.DataFrame(['a', 'b'], columns=[Graph.node_col])
+    tmplt = Graph([csr_matrix((2, 2))], ['c1'], tmplt_nodes)
+    world_nodes = pd.DataFrame({
+        Graph.node_col: ['w', 'x', 'y', 'z'],
+        'start': pd.to_datetime(['2020-01-01 00:00', '2020-01-01 03:00',
+                                 None, '2020-01-01 12:00'])})
+    world = Graph([csr_matrix((4, 4))], ['c1'], world_nodes)
+    return MatchingProblem(tmplt, world)
+
+class TestTimeConstraints:
+    """Tests related to the costs of time constraints"""
+    def test_time_constraint_costs(self):
+        times1 = np.array([0, 5, 10])
+        times2 = np.array([2, 4, 20])
+        is_valid1, is_valid2 = time_constraint_costs(times1, times2, 1, 3)
+        assert np.array_equal(is_valid1, [True, False, False])
+        assert np.array_equal(is_valid2, [True, False, False])
+        is_valid1, is_valid2 = time_constraint_costs(times1, times2, 1)
+        assert np.array_equal(is_valid1, [True, True, True])
+        assert np.array_equal(is_valid2, [True, True, True])
+
+    def test_hours(self, smp_timed):
+        smp_timed.tmplt.time_constraints = [
+            {"node1": "a", "node2": "b", "importance": 2, "minValue": 1,
+             "maxValue": 4, "unit": "h"}]
+        local_costs = np.zeros(smp_timed.shape)
+        add_time_costs(smp_timed, smp_timed.candidates(), local_costs)
+        # Missing start times cost the inverse importance
+        assert np.array_equal(local_costs, [[0, 0.5, 0.5, 0.5],
+                                            [0.5, 0, 0.5, 0.5]])
+
+    def test_days_by_default(self, smp_timed):
+        smp_timed.tmplt.time_constraints = [
+            {"node1": "a", "node2": "b", "importance": 1, "maxValue": 1}]
+        local_costs = np.zeros(smp_timed.shape)
+        add_time_costs(smp_timed, smp_timed.candidates(), local_costs)
+        assert np.array_equal(local_costs, [[0, 0, 1, 0],
+                                            [0, 0, 1, 0]])
+
+
+@pytest.fixture
+def smp_located():
+    """Create a matching problem between two nodes and located world nodes."""
+    tmplt_nodes = pd.DataFrame(['a', 'b'], columns=[Graph.node_col])
+    tmplt = Graph([csr_matrix((2, 2))], ['c1'], tmplt_nodes)
+    # Along the equator, about 111km apart per degree
+    world_nodes = pd.DataFrame({
+        Graph.node_col: ['w', 'x', 'y', 'z'],
+        'latitude': ['0.0', '0.0', '%NA%', '0.0'],
+        'longitude': ['0.0', '1.0', '0.0', '3.0']})
+    world = Graph([csr_matrix((4, 4))], ['c1'], world_nodes)
+    return MatchingProblem(tmplt, world)
+
+class TestGeoConstraints:
+    """Tests related to the costs of geo constraints"""
+    @pytest.mark.parametrize("min_dist, max_dist",
+                             [(None, 2e6), (1e6, None), (1e6, 3e6),
+                              (None, None)])
+    def test_has_partner_within(self, min_dist, max_dist):
+        rng = np.random.default_rng(0)
+        coords = np.stack([rng.uniform(-60, 60, 50),
+                           rng.uniform(-180, 180, 50)], axis=1)
+        other_coords = np.stack([rng.uniform(-60, 60, 40),
+                                 rng.uniform(-180, 180, 40)], axis=1)
+        dists = np.array([haversine_distances(other_coords, coord)
+                          for coord in coords])
+        is_within = np.ones(dists.shape, dtype=bool)
+        if min_dist is not None:
+            is_within &= dists >= min_dist
+        if max_dist is not None:
+            is_within &= dists <= max_dist
+        assert np.array_equal(
+            has_partner_within(coords, other_coords, min_dist, max_dist,
+                               geodesic=False),
+            is_within.any(axis=1))
+
+    def test_add_geo_costs(self, smp_located):
+        smp_located.tmplt.geo_constraints = [
+            {"node1": "a", "node2": "b", "importance": 2, "minValue": 1.5e5,
+             "maxValue": 2.5e5}]
+        local_costs = np.zeros(smp_located.shape)
+        add_geo_costs(smp_located, smp_located.candidates(), local_costs)
+        # Only x and z are between 150km and 250km apart
+        assert np.array_equal(local_costs, [[0.5, 0, 0.5, 0],
+                                            [0.5, 0, 0.5, 0]])
@@ -2,6 +2,8 @@
 import pytest
 import uclasm
 from uclasm.counting import count_alldiffs, count_isomorphisms, find_isomorphisms
+from uclasm.counting import iter_isomorphisms
+from uclasm.matching.search import SearchBudget
 from uclasm.matching.search.search_utils import iterate_to_convergence
 from uclasm import Graph, MatchingProblem
 
@@ -178,3 +180,58 @@ class TestIsomorphisms:
         assert np.sum(smp_overlapping_cands.candidates()) == 7
         count = count_isomorphisms(smp_overlapping_cands, verbose=True)
         assert count == 6
+
+    def test_find_isomorphisms_star(self, smp_star):
+        iterate_to_convergence(smp_star)
+        iso_list = find_isomorphisms(smp_star, verbose=False)
+        assert len(iso_list) == 4
+        assert len({tuple(sorted(iso.items())) for iso in iso_list}) == 4
+
+    def test_count_isomorphisms_resume(self, smp_node_cover):
+        iterate_to_convergence(smp_node_cover)
+        count = count_isomorphisms(smp_node_cover, verbose=False,
+                                   budget=SearchBudget(max_states=1))
+        assert not count.complete
+        n_resumes = 0
+        while not count.complete:
+            count = count_isomorphisms(smp_node_cover, verbose=False,
+                                       budget=SearchBudget(max_states=1),
+                                       resume=count)
+            n_resumes += 1
+        assert n_resumes > 1
+        assert count == 4
+        assert smp_node_cover.trail is None
+
+    def test_iter_isomorphisms_stops_early(self, smp_star):
+        iterate_to_convergence(smp_star, reduce_world=False)
+        candidates = smp_star.candidates()
+        isomorphisms = iter_isomorphisms(smp_star, verbose=False)
+        first = next(isomorphisms)
+        isomorphisms.close()
+        assert first in find_isomorphisms(smp_star, verbose=False)
+        assert np.array_equal(smp_star.candidates(), candidates)
+        assert smp_star.trail is None
+
+class TestTrail:
+    def test_backtrack_restores_costs(self, smp_star):
+        iterate_to_convergence(smp_star, reduce_world=False)
+        costs = [smp_star.fixed_costs.copy(), smp_star.local_costs.copy(),
+                 smp_star.global_costs.copy()]
+        candidates = smp_star.candidates()
+        mark = smp_star.checkpoint()
+        smp_star.add_match(0, 0)
+        iterate_to_convergence(smp_star, reduce_world=False)
+        assert smp_star.trail.n_entries > 0
+        assert not np.array_equal(smp_star.candidates(), candidates)
+        smp_star.backtrack(mark)
+        assert smp_star.trail is None
+        assert smp_star.matching == tuple()
+        for old_costs, new_costs in zip(costs, [smp_star.fixed_costs,
+                                                smp_star.local_costs,
+                                                smp_star.global_costs]):
+            assert np.array_equal(old_costs, new_costs)
+
+    def test_no_reduce_world_while_recording(self, smp_star):
+        smp_star.checkpoint()
+        with pytest.raises(ValueError):
+            smp_star.reduce_world()
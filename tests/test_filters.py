@@ -76,3 +76,29 @@ class TestFilters:
     def test_run_filters_noisy(self, smp_noisy):
         filters.run_filters(smp_noisy)
         assert np.sum(smp_noisy.candidates()) == 5
+
+    def test_run_filters_stats(self, smp):
+        stats = filters.run_filters(smp, verbose=False)
+        assert stats["stats_filter"].n_runs == 1
+        assert sum(filter_stats.n_eliminated
+                   for filter_stats in stats.filters.values()) == 6
+
+class TestPropagation:
+    """Tests related to scheduling bounds until convergence"""
+    def test_iterate_to_convergence_stats(self, smp):
+        stats = search.search_utils.iterate_to_convergence(smp)
+        assert np.sum(smp.candidates()) == 3
+        # The world never changes, so the nodewise bound runs only once
+        assert stats["nodewise"].n_runs == 1
+        assert stats["nodewise"].n_eliminated + \
+            stats["edgewise"].n_eliminated == 6
+
+    def test_patience(self, smp):
+        stats = PropagationStats(patience=1)
+        stats.record("edgewise", 0.0, 0)
+        search.search_utils.iterate_to_convergence(smp, stats=stats,
+                                                   nodewise=False)
+        # The edgewise bound has already gone a run without pruning
+        assert stats["edgewise"].n_runs == 1
+        assert stats["edgewise"].n_skipped == 1
+        assert np.sum(smp.candidates()) == 9
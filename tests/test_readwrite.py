@@ -3,6 +3,10 @@ import os
 import pytest
 import uclasm
 import numpy as np
+import pandas as pd
+from uclasm import Graph
+from scipy.sparse import csr_matrix
+from uclasm.readwrite import _codes_from_map
 
 @pytest.fixture
 def datadir():
@@ -20,6 +24,56 @@ class TestLoadEdgelist:
                                      file_target_col="Target",
                                      file_channel_col="eType")
 
+    def test_load_edgelist_chunked(self, datadir):
+        filepath = os.path.join(datadir, "world.csv")
+        world = uclasm.load_edgelist(filepath)
+        chunked_world = uclasm.load_edgelist(filepath, chunksize=2)
+        assert chunked_world.channels == world.channels
+        # Nodes may be numbered differently
+        perm = [world.node_idxs[node] for node in chunked_world.nodes]
+        for adj, chunked_adj in zip(world.adjs, chunked_world.adjs):
+            assert (adj[perm, :][:, perm] != chunked_adj).nnz == 0
+        edgelist = world.edgelist.compute()
+        assert (chunked_world.edgelist.astype(str).values ==
+                edgelist.values).all()
+
+    def test_chunk_cost_independent_of_known_nodes(self):
+        class CountingDict(dict):
+            """Dict counting the entries it is asked for."""
+            n_reads = 0
+
+            def get(self, key, default=None):
+                self.n_reads += 1
+                return super().get(key, default)
+
+            def __iter__(self):
+                self.n_reads += len(self)
+                return super().__iter__()
+
+            def items(self):
+                self.n_reads += len(self)
+                return super().items()
+
+        val_to_idx = CountingDict((str(i), i) for i in range(10000))
+        chunk = pd.Series(["5", "7", "5", "new", "7", "new", "other"])
+        codes = _codes_from_map(chunk, val_to_idx)
+        assert codes.tolist() == [5, 7, 5, 10000, 7, 10000, 10001]
+        assert val_to_idx["other"] == 10001
+        # One lookup per distinct value of the chunk
+        assert val_to_idx.n_reads == 4
+
+    def test_chunk_missing_values(self):
+        val_to_idx = {"a": 0}
+        codes = _codes_from_map(pd.Series(["a", np.nan, "b", np.nan]),
+                                val_to_idx)
+        assert codes.tolist() == [0, 2, 1, 2]
+        codes = _codes_from_map(pd.Series([np.nan, "b"]), val_to_idx)
+        assert codes.tolist() == [2, 1]
+
+    def test_chunk_missing_from_nodelist(self):
+        with pytest.raises(ValueError):
+            _codes_from_map(pd.Series(["a", "b"]), {"a": 0}, grow=False)
+
 class TestLoadIgraph:
     """Tests related to loading igraph files """
     def test_load_igraph(self, datadir):
@@ -45,3 +99,71 @@ class TestLoadIgraph:
         assert test_graphs[0].adjs[1].A.tolist() == adj0_1
         assert test_graphs[1].adjs[0].A.tolist() == adj1_0
         assert test_graphs[1].adjs[1].A.tolist() == adj1_1
+
+class TestSaveGraph:
+    """Tests related to storing graphs in binary files """
+    def test_save_load_graph(self, datadir, tmp_path):
+        world = uclasm.load_edgelist(os.path.join(datadir, "world.csv"))
+        edgelist = world.edgelist.compute()
+        edgelist["duration"] = pd.to_timedelta(np.arange(len(edgelist)),
+                                               unit="h")
+        world.edgelist = edgelist
+        seen = pd.to_datetime(["2020-01-01 03:00"] * world.n_nodes)
+        world.nodelist["seen"] = seen.where(np.arange(world.n_nodes) > 0)
+        uclasm.save_graph(world, str(tmp_path))
+        for mmap in [True, False]:
+            loaded = uclasm.load_graph(str(tmp_path), mmap=mmap)
+            assert loaded.channels == world.channels
+            for adj, loaded_adj in zip(world.adjs, loaded.adjs):
+                assert (adj != loaded_adj).nnz == 0
+            assert loaded.nodelist["seen"].dtype == seen.dtype
+            assert loaded.nodelist["seen"].equals(world.nodelist["seen"])
+            assert (loaded.nodelist[Graph.node_col] ==
+                    world.nodelist[Graph.node_col]).all()
+            assert (loaded.edgelist["duration"].dtype ==
+                    edgelist["duration"].dtype)
+            assert (loaded.edgelist.values == edgelist.values).all()
+            assert np.array_equal(loaded.edge_src_idxs, world.edge_src_idxs)
+
+    def test_save_load_column_dtypes(self, tmp_path):
+        nodelist = pd.DataFrame({
+            Graph.node_col: ['a', 'b', 'c'],
+            'kind': pd.Categorical(['x', None, 'y']),
+            'rank': pd.Categorical([2, 1, 2], ordered=True),
+            'count': pd.array([1, None, 3], dtype="Int64"),
+            'flag': pd.array([True, None, False], dtype="boolean"),
+        })
+        graph = Graph([csr_matrix(np.eye(3, k=1))], ['c1'], nodelist)
+        uclasm.save_graph(graph, str(tmp_path))
+        loaded = uclasm.load_graph(str(tmp_path))
+        for col in nodelist.columns:
+            assert loaded.nodelist[col].dtype == nodelist[col].dtype
+            assert loaded.nodelist[col].equals(nodelist[col])
+
+    def test_save_load_chunked_edgelist(self, datadir, tmp_path):
+        world = uclasm.load_edgelist(os.path.join(datadir, "world.csv"),
+                                     chunksize=2)
+        uclasm.save_graph(world, str(tmp_path))
+        loaded = uclasm.load_graph(str(tmp_path))
+        assert (loaded.edgelist.dtypes == world.edgelist.dtypes).all()
+        assert loaded.edgelist.equals(world.edgelist)
+
+    @pytest.mark.parametrize("values", [[1, 2, 3], [1, 'b', 2.5]])
+    def test_save_unsupported_column(self, values, tmp_path):
+        nodelist = pd.DataFrame({Graph.node_col: ['a', 'b', 'c'],
+                                 'attr': pd.Series(values, dtype=object)})
+        graph = Graph([csr_matrix(np.eye(3, k=1))], ['c1'], nodelist)
+        with pytest.raises(ValueError):
+            uclasm.save_graph(graph, str(tmp_path))
+
+    def test_load_graph_version(self, datadir, tmp_path):
+        world = uclasm.load_edgelist(os.path.join(datadir, "world.csv"))
+        uclasm.save_graph(world, str(tmp_path))
+        manifest_path = os.path.join(str(tmp_path), "manifest.json")
+        with open(manifest_path) as f:
+            manifest = f.read()
+        with open(manifest_path, "w") as f:
+            f.write(manifest.replace('"format_version": 1',
+                                     '"format_version": 999'))
+        with pytest.raises(ValueError):
+            uclasm.load_graph(str(tmp_path))
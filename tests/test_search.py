@@ -50,6 +50,34 @@ def smp_noisy():
     smp = MatchingProblem(tmplt, world, global_cost_threshold=1)
     return smp
 
+@pytest.fixture
+def smp_noisy_bounded(smp_noisy):
+    """Create the noisy problem with a high threshold and its costs bounded."""
+    smp_noisy.global_cost_threshold = 5000
+    local_cost_bound.nodewise(smp_noisy)
+    local_cost_bound.edgewise(smp_noisy)
+    global_cost_bound.from_local_bounds(smp_noisy)
+    return smp_noisy
+
+def random_smp(seed, n_tmplt_nodes=4, n_world_nodes=6):
+    """Create a random subgraph matching problem with its costs bounded."""
+    rng = np.random.default_rng(seed)
+
+    def random_graph(n_nodes, density, prefix):
+        adjs = [csr_matrix(rng.random((n_nodes, n_nodes)) < density,
+                           dtype=float) for _ in range(2)]
+        nodelist = pd.DataFrame([prefix + str(i) for i in range(n_nodes)],
+                                columns=[Graph.node_col])
+        return Graph(adjs, ['c1', 'c2'], nodelist)
+
+    tmplt = random_graph(n_tmplt_nodes, 0.5, 't')
+    world = random_graph(n_world_nodes, 0.4, 'w')
+    smp = MatchingProblem(tmplt, world, global_cost_threshold=50)
+    local_cost_bound.nodewise(smp)
+    local_cost_bound.edgewise(smp)
+    global_cost_bound.from_local_bounds(smp)
+    return smp
+
 class TestGreedySearch:
     """Tests related to the greedy search """
     def test_greedy_search(self, smp):
@@ -153,3 +181,453 @@ class TestGreedySearchRecursive:
         assert solutions[0].cost == 1
         for i in range(3):
             assert dict(solutions[0].matching)[i] == i
+
+    def test_parallel_matches_serial(self, smp_noisy_bounded):
+        serial = search.greedy_best_k_matching_recursive(
+            smp_noisy_bounded, k=-1, verbose=True)
+        parallel = search.greedy_best_k_matching_recursive(
+            smp_noisy_bounded, k=-1, verbose=True, n_processes=2)
+        assert sorted((s.cost, s.matching) for s in parallel) == \
+            sorted((s.cost, s.matching) for s in serial)
+
+class TestGreedySearchSparse:
+    """Tests related to the greedy search with sparse costs """
+    def test_greedy_search_noisy(self, smp_noisy):
+        smp = MatchingProblem(smp_noisy.tmplt, smp_noisy.world,
+                              global_cost_threshold=1, sparse_costs=True)
+        local_cost_bound.nodewise(smp)
+        local_cost_bound.edgewise(smp)
+        global_cost_bound.from_local_bounds(smp)
+        solutions = search.greedy_best_k_matching(smp)
+        assert len(solutions) == 1
+        assert solutions[0].cost == 1
+        for i in range(3):
+            assert dict(solutions[0].matching)[i] == i
+
+    def test_sparse_matches_dense(self, smp_noisy):
+        smp = MatchingProblem(smp_noisy.tmplt, smp_noisy.world,
+                              global_cost_threshold=1, sparse_costs=True)
+        for problem in [smp, smp_noisy]:
+            local_cost_bound.nodewise(problem)
+            local_cost_bound.edgewise(problem)
+            global_cost_bound.from_local_bounds(problem)
+        assert np.array_equal(smp.candidates().toarray(),
+                              smp_noisy.candidates())
+
+class TestSharedCostCopies:
+    """Tests related to copies which share cost matrices with the original """
+    @pytest.mark.parametrize("sparse_costs", [False, True])
+    def test_copies_stay_independent(self, smp_noisy, sparse_costs):
+        smp = MatchingProblem(smp_noisy.tmplt, smp_noisy.world,
+                              global_cost_threshold=1,
+                              match_fixed_costs=True,
+                              sparse_costs=sparse_costs)
+        global_cost_bound.from_local_bounds(smp)
+        child = smp.copy(copy_graphs=False, share_costs=True)
+        assert child.global_costs is not smp.global_costs
+        parent_costs = smp.global_costs.copy()
+        child.add_match(0, 0)
+        local_cost_bound.edgewise(child)
+        global_cost_bound.from_local_bounds(child)
+        assert np.array_equal(child.candidates(0), [True, False, False])
+        assert np.array_equal(smp.candidates(0), [True, True, True])
+        if sparse_costs:
+            assert np.array_equal(smp.global_costs.data, parent_costs.data)
+        else:
+            assert np.array_equal(smp.global_costs, parent_costs)
+
+    def test_shared_costs_are_read_only(self, smp_noisy):
+        child = smp_noisy.copy(copy_graphs=False, share_costs=True)
+        with pytest.raises(ValueError):
+            child.local_costs[0, 0] = 1
+        child.own_costs("local_costs")
+        child.local_costs[0, 0] = 1
+        assert smp_noisy.local_costs[0, 0] == 0
+        smp_noisy.local_costs = 2
+        assert child.local_costs[0, 1] == 0
+
+
+@pytest.fixture
+def smp_attrs():
+    """Create a subgraph matching problem with node attributes."""
+    adj = csr_matrix(np.zeros((4, 4)))
+    tmplt_nodelist = pd.DataFrame([['a', 'red', 1.0],
+                                   ['b', '', 2.0],
+                                   ['c', 'blue', np.nan]],
+                                  columns=[Graph.node_col, 'color', 'size'])
+    world_nodelist = pd.DataFrame([['w', 'red', 1.0],
+                                   ['x', 'blue', 2.0],
+                                   ['y', 'red', 2.0],
+                                   ['z', 'green', np.nan]],
+                                  columns=[Graph.node_col, 'color', 'size'])
+    tmplt = Graph([adj[:3, :3]], ['c1'], tmplt_nodelist)
+    world = Graph([adj], ['c1'], world_nodelist)
+    smp = MatchingProblem(tmplt, world)
+    smp.fixed_costs[0, 3] = np.inf
+    return smp
+
+@pytest.fixture
+def smp_no_attrs():
+    """Create a subgraph matching problem whose nodes only have IDs."""
+    adj = csr_matrix(np.zeros((3, 3)))
+    tmplt_nodelist = pd.DataFrame(['a', 'b'], columns=[Graph.node_col])
+    world_nodelist = pd.DataFrame(['a', 'b', 'c'], columns=[Graph.node_col])
+    tmplt = Graph([adj[:2, :2]], ['c1'], tmplt_nodelist)
+    world = Graph([adj], ['c1'], world_nodelist)
+    return MatchingProblem(tmplt, world)
+
+def reference_node_attr_costs(smp, node_attr_fn):
+    """Compare every pair of nodes one at a time."""
+    costs = np.array(smp.fixed_costs, dtype=float)
+    for tmplt_idx, tmplt_row in smp.tmplt.nodelist.iterrows():
+        for world_idx, world_row in smp.world.nodelist.iterrows():
+            if np.isfinite(costs[tmplt_idx, world_idx]):
+                costs[tmplt_idx, world_idx] += node_attr_fn(
+                    dict(tmplt_row), dict(world_row))
+    return costs
+
+def size_diff(tmplt_attrs, world_attrs):
+    if np.isnan(world_attrs["size"]):
+        return 5.0
+    return abs(tmplt_attrs["size"] - world_attrs["size"])
+
+class TestNodeAttrCosts:
+    """Tests related to fixed costs from node attributes"""
+    def test_scalar_fn(self, smp_attrs):
+        expected = reference_node_attr_costs(smp_attrs, size_diff)
+        search.search_utils.add_node_attr_costs(smp_attrs, size_diff)
+        assert np.array_equal(smp_attrs.fixed_costs, expected, equal_nan=True)
+
+    def test_vectorized_fn(self, smp_attrs):
+        expected = reference_node_attr_costs(smp_attrs, size_diff)
+        n_calls = []
+
+        @search.search_utils.vectorized_node_attr_fn
+        def batch_size_diff(tmplt_attrs, world_attrs):
+            n_calls.append(len(world_attrs["size"]))
+            diffs = np.abs(tmplt_attrs["size"] - world_attrs["size"])
+            return np.where(np.isnan(world_attrs["size"]), 5.0, diffs)
+
+        search.search_utils.add_node_attr_costs(smp_attrs, batch_size_diff)
+        assert np.array_equal(smp_attrs.fixed_costs, expected, equal_nan=True)
+        # One call per template node, without the infinite pair
+        assert n_calls == [3, 4, 4]
+
+    def test_scalar_fn_reads_node_col(self, smp_no_attrs):
+        def id_diff(tmplt_attrs, world_attrs):
+            return float(tmplt_attrs[Graph.node_col]
+                         != world_attrs[Graph.node_col])
+
+        search.search_utils.add_node_attr_costs(smp_no_attrs, id_diff)
+        assert np.array_equal(smp_no_attrs.fixed_costs,
+                              [[0, 1, 1], [1, 0, 1]])
+
+    def test_scalar_fn_without_attrs(self, smp_no_attrs):
+        search.search_utils.add_node_attr_costs(smp_no_attrs,
+                                                lambda t, w: 1.0)
+        assert np.array_equal(smp_no_attrs.fixed_costs, np.ones((2, 3)))
+
+    def test_scalar_fn_ignoring_node_col(self, smp_attrs, smp_no_attrs):
+        expected = reference_node_attr_costs(smp_attrs, size_diff)
+        calls = []
+
+        @search.search_utils.ignores_node_col
+        def counted_size_diff(tmplt_attrs, world_attrs):
+            calls.append((tmplt_attrs, world_attrs))
+            return size_diff(tmplt_attrs, world_attrs)
+
+        search.search_utils.add_node_attr_costs(smp_attrs, counted_size_diff)
+        assert np.array_equal(smp_attrs.fixed_costs, expected, equal_nan=True)
+        assert all(Graph.node_col not in attrs
+                   for call in calls for attrs in call)
+        # The world nodes all have distinct attributes
+        assert len(calls) == 11
+
+        calls.clear()
+        search.search_utils.add_node_attr_costs(
+            smp_no_attrs, search.search_utils.ignores_node_col(
+                lambda t, w: calls.append(w) or 1.0))
+        assert np.array_equal(smp_no_attrs.fixed_costs, np.ones((2, 3)))
+        # All of the world nodes share the empty attributes
+        assert calls == [{}, {}]
+
+    def test_identity(self, smp_attrs):
+        search.search_utils.add_node_attr_costs_identity(smp_attrs)
+        assert np.array_equal(smp_attrs.fixed_costs,
+                              [[0, 2, 1, np.inf],
+                               [1, 0, 0, 1],
+                               [2, 1, 2, 2]])
+
+    def test_identity_sparse(self, smp_attrs):
+        smp = MatchingProblem(smp_attrs.tmplt, smp_attrs.world,
+                              sparse_costs=True)
+        search.search_utils.add_node_attr_costs_identity(smp)
+        search.search_utils.add_node_attr_costs_identity(smp_attrs)
+        assert np.array_equal(smp.fixed_costs.toarray(),
+                              np.where(np.isinf(smp_attrs.fixed_costs), 2,
+                                       smp_attrs.fixed_costs))
+
+
+def make_state(matching, cost):
+    state = search.search_utils.State()
+    state.matching = matching
+    state.cost = cost
+    return state
+
+class TestFrontiers:
+    """Tests related to the frontiers of the best-first search"""
+    def test_bounded_frontier_forgets_worst(self):
+        frontier = search.BoundedFrontier(max_states=2)
+        for cost in [3, 1, 2]:
+            frontier.push(make_state(((0, cost),), cost))
+        assert len(frontier) == 2
+        assert frontier.forgotten_cost == 3
+        assert not frontier.has_seen(((0, 3),))
+        assert frontier.pop().cost == 1
+        assert frontier.is_exact(kth_cost=3)
+        assert not frontier.is_exact(kth_cost=4)
+
+    def test_bounded_frontier_forgets_costly_before_shallow(self):
+        frontier = search.BoundedFrontier(max_states=1)
+        shallow = make_state(((0, 0),), 0)
+        frontier.push(shallow)
+        frontier.push(make_state(((0, 0), (1, 1), (2, 2)), 5))
+        assert frontier.forgotten_cost == 5
+        assert frontier.pop() is shallow
+        # Among equally costly states, the shallowest is forgotten
+        frontier.push(make_state(((0, 0),), 5))
+        deep = make_state(((0, 0), (1, 1)), 5)
+        frontier.push(deep)
+        assert frontier.pop() is deep
+
+    def test_beam_width(self):
+        frontier = search.BoundedFrontier(beam_width=1)
+        frontier.push(make_state(((0, 0),), 2))
+        frontier.push(make_state(((0, 1),), 1))
+        frontier.push(make_state(((0, 0), (1, 0)), 5))
+        assert len(frontier) == 2
+        assert frontier.forgotten_cost == 2
+
+    def test_spilling_frontier_keeps_order(self, tmpdir):
+        frontier = search.SpillingFrontier(max_states=2,
+                                           spill_dir=str(tmpdir))
+        costs = [5, 3, 8, 1, 7, 2]
+        for cost in costs:
+            frontier.push(make_state(((0, cost),), cost))
+        assert len(frontier) == len(costs)
+        assert [frontier.pop().cost for _ in costs] == sorted(costs)
+        assert frontier.n_forgotten == 0
+        assert len(tmpdir.listdir()) == 0
+
+    def test_seen_matchings(self):
+        # Only the bounded frontier forgets the matchings it expanded
+        for frontier, expected in [
+                (search.Frontier(), [((0, 0),), ((0, 1),), ((0, 2),)]),
+                (search.BoundedFrontier(), [((0, 1),), ((0, 2),)])]:
+            frontier.push(make_state(((0, 0),), 1))
+            frontier.push(make_state(((0, 1),), 2))
+            frontier.pop()
+            frontier.mark_seen([((0, 2),)])
+            assert sorted(frontier.seen_matchings()) == expected
+
+    def test_search_with_spilling_frontier(self, smp_noisy_bounded):
+        smp = smp_noisy_bounded.copy()
+        expected = search.greedy_best_k_matching(smp_noisy_bounded, k=6)
+        solutions = search.greedy_best_k_matching(
+            smp, k=6, frontier=search.SpillingFrontier(max_states=2))
+        assert solutions.exact
+        assert sorted(s.cost for s in solutions) == \
+            sorted(s.cost for s in expected)
+
+    def test_search_with_beam_is_approximate(self, smp_noisy_bounded):
+        solutions = search.greedy_best_k_matching(
+            smp_noisy_bounded, k=6,
+            frontier=search.BoundedFrontier(beam_width=1))
+        assert not solutions.exact
+        assert solutions[0].cost >= 1
+
+class TestStreaming:
+    """Tests related to the generator versions of the searches"""
+    @pytest.mark.parametrize("k", [1, 6, -1])
+    def test_iter_matches_list(self, smp_noisy_bounded, k):
+        smp = smp_noisy_bounded.copy()
+        expected = search.greedy_best_k_matching(smp_noisy_bounded, k=k)
+        solutions = list(search.iter_best_k_matching(smp, k=k))
+        assert sorted((s.cost, s.matching) for s in solutions) == \
+            sorted((s.cost, s.matching) for s in expected)
+
+    @pytest.mark.parametrize("seed", range(8))
+    def test_iter_matches_list_random(self, seed):
+        expected = search.greedy_best_k_matching(random_smp(seed), k=5)
+        solutions = list(search.iter_best_k_matching(random_smp(seed), k=5))
+        assert sorted((s.cost, s.matching) for s in solutions) == \
+            sorted((s.cost, s.matching) for s in expected)
+        # A solution is only yielded once none left to find can beat it
+        costs = [s.cost for s in solutions]
+        assert costs == sorted(costs)
+
+    @pytest.mark.parametrize("seed", range(8))
+    def test_state_costs_never_decrease(self, seed):
+        class CheckedFrontier(search.Frontier):
+            """Frontier checking that states cost no less than their
+            parent."""
+            parent = None
+
+            def pop(self):
+                self.parent = super().pop()
+                return self.parent
+
+            def push(self, state):
+                if self.parent is not None:
+                    assert state.cost >= self.parent.cost
+                super().push(state)
+
+        search.greedy_best_k_matching(random_smp(seed), k=5,
+                                      frontier=CheckedFrontier())
+
+    @pytest.mark.parametrize("k", [1, 6, -1])
+    def test_iter_recursive_matches_list(self, smp_noisy_bounded, k):
+        expected = search.greedy_best_k_matching_recursive(
+            smp_noisy_bounded, k=k)
+        solutions = list(search.iter_best_k_matching_recursive(
+            smp_noisy_bounded, k=k))
+        assert sorted((s.cost, s.matching) for s in solutions) == \
+            sorted((s.cost, s.matching) for s in expected)
+
+    def test_iter_mapping(self, smp_noisy):
+        local_cost_bound.nodewise(smp_noisy)
+        local_cost_bound.edgewise(smp_noisy)
+        global_cost_bound.from_local_bounds(smp_noisy)
+        solutions = list(search.iter_best_k_matching_recursive(
+            smp_noisy, mapping=True))
+        assert solutions == [{"a": "a", "b": "b", "c": "c"}]
+
+    def test_iter_stops_early(self, smp_noisy_bounded):
+        solutions = search.iter_best_k_matching(smp_noisy_bounded, k=6)
+        first = next(solutions)
+        solutions.close()
+        assert first.cost == 1
+
+class TestBudgets:
+    """Tests related to stopping searches on a budget and resuming them"""
+    @pytest.mark.parametrize("search_fn", ["greedy_best_k_matching",
+                                           "greedy_best_k_matching_recursive"])
+    def test_resume_matches_uninterrupted(self, smp_noisy_bounded, search_fn):
+        search_fn = getattr(search, search_fn)
+        smp = smp_noisy_bounded.copy()
+        expected = search_fn(smp_noisy_bounded, k=6)
+        solutions = search_fn(smp, k=6,
+                              budget=search.SearchBudget(max_states=1))
+        assert not solutions.complete
+        assert not solutions.exact
+        assert len(solutions.frontier) > 0
+        n_resumes = 0
+        while not solutions.complete:
+            solutions = search_fn(smp, k=6, resume=solutions,
+                                  budget=search.SearchBudget(max_states=1))
+            n_resumes += 1
+        assert n_resumes > 1
+        assert solutions.exact
+        assert sorted((s.cost, s.matching) for s in solutions) == \
+            sorted((s.cost, s.matching) for s in expected)
+
+    @pytest.mark.parametrize("seed", range(4))
+    def test_lower_bound_bounds_later_solutions(self, seed):
+        smp = random_smp(seed)
+        solutions = search.greedy_best_k_matching(
+            smp, k=5, budget=search.SearchBudget(max_states=1))
+        while not solutions.complete:
+            lower_bound = solutions.lower_bound
+            known = {s.matching for s in solutions}
+            solutions = search.greedy_best_k_matching(
+                smp, k=5, resume=solutions,
+                budget=search.SearchBudget(max_states=1))
+            assert all(s.cost >= lower_bound for s in solutions
+                       if s.matching not in known)
+
+    def test_exhausted_budgets(self, smp_noisy_bounded):
+        for budget in [search.SearchBudget(max_seconds=0),
+                       search.SearchBudget(max_memory=1)]:
+            solutions = search.greedy_best_k_matching(smp_noisy_bounded,
+                                                      budget=budget)
+            assert len(solutions) == 0
+            assert not solutions.complete
+            assert solutions.lower_bound == \
+                smp_noisy_bounded.global_costs.min()
+        assert budget.exhausted_by == "memory"
+
+    def test_resume_with_frontier_fails(self, smp_noisy_bounded):
+        solutions = search.greedy_best_k_matching(
+            smp_noisy_bounded, k=6, budget=search.SearchBudget(max_states=1))
+        with pytest.raises(ValueError):
+            search.greedy_best_k_matching(smp_noisy_bounded, k=6,
+                                          resume=solutions,
+                                          frontier=search.Frontier())
+
+    def test_parallel_budget_fails(self, smp_noisy):
+        with pytest.raises(ValueError):
+            search.greedy_best_k_matching_recursive(
+                smp_noisy, n_processes=2,
+                budget=search.SearchBudget(max_states=1))
+
+class TestCheckpoints:
+    """Tests related to saving checkpoints of searches and resuming them"""
+    @pytest.mark.parametrize("search_fn", ["greedy_best_k_matching",
+                                           "greedy_best_k_matching_recursive"])
+    def test_resume_from_checkpoint(self, smp_noisy_bounded, search_fn,
+                                    tmpdir):
+        search_fn = getattr(search, search_fn)
+        initial_smp = smp_noisy_bounded.copy()
+        expected = search_fn(smp_noisy_bounded.copy(), k=6)
+        path = str(tmpdir.join("ckpt"))
+        checkpointer = search.Checkpointer(path, interval_states=1)
+        solutions = search_fn(initial_smp.copy(), k=6,
+                              budget=search.SearchBudget(max_states=2),
+                              checkpoint=checkpointer)
+        assert not solutions.complete
+        assert checkpointer.n_saved > 1
+        n_resumes = 0
+        while not solutions.complete:
+            # Each resume starts from a fresh problem, as after a restart
+            smp = initial_smp.copy()
+            resume = search.load_checkpoint(path, smp)
+            assert len(resume.frontier) > 0
+            solutions = search_fn(smp, k=6, resume=resume,
+                                  budget=search.SearchBudget(max_states=2),
+                                  checkpoint=checkpointer)
+            n_resumes += 1
+        assert n_resumes > 1
+        assert sorted((s.cost, s.matching) for s in solutions) == \
+            sorted((s.cost, s.matching) for s in expected)
+        # Only the latest checkpoint is kept
+        assert len(tmpdir.join("ckpt").listdir()) == 2
+
+    def test_checkpoint_of_other_problem_fails(self, smp_noisy_bounded,
+                                               tmpdir):
+        path = str(tmpdir)
+        search.greedy_best_k_matching(
+            smp_noisy_bounded, budget=search.SearchBudget(max_states=1),
+            checkpoint=search.Checkpointer(path))
+        sparse_smp = MatchingProblem(smp_noisy_bounded.tmplt,
+                                     smp_noisy_bounded.world,
+                                     sparse_costs=True)
+        with pytest.raises(ValueError):
+            search.load_checkpoint(path, sparse_smp)
+
+    def test_checkpoint_of_same_shape_problem_fails(self, smp_noisy_bounded,
+                                                    tmpdir):
+        path = str(tmpdir)
+        search.greedy_best_k_matching(
+            smp_noisy_bounded, budget=search.SearchBudget(max_states=1),
+            checkpoint=search.Checkpointer(path))
+        tmplt = smp_noisy_bounded.tmplt
+        other_tmplt = Graph(tmplt.adjs, tmplt.channels,
+                            pd.DataFrame(['x', 'y', 'z'],
+                                         columns=[Graph.node_col]))
+        other_smp = MatchingProblem(other_tmplt, smp_noisy_bounded.world)
+        assert other_smp.shape == smp_noisy_bounded.shape
+        with pytest.raises(ValueError):
+            search.load_checkpoint(path, other_smp)
+        # The same problem built again is accepted
+        search.load_checkpoint(path, MatchingProblem(tmplt,
+                                                     smp_noisy_bounded.world))
@@ -0,0 +1,60 @@
+"""Tests for sharing graphs between processes."""
+import pytest
+import uclasm
+from uclasm import Graph, MatchingProblem
+from uclasm.shared_graph import publish_graph, attach_graph
+from uclasm.matching import *
+import numpy as np
+from scipy.sparse import csr_matrix
+import pandas as pd
+
+
+@pytest.fixture
+def graph():
+    """Create a graph with some nodes and edges."""
+    adj0 = csr_matrix([[0, 0, 0],
+                       [1, 0, 0],
+                       [0, 0, 0]])
+    adj1 = csr_matrix([[0, 0, 0],
+                       [0, 0, 0],
+                       [0, 1, 0]])
+    nodelist = pd.DataFrame(['a', 'b', 'c'], columns=[Graph.node_col])
+    edgelist = pd.DataFrame([['b', 'a', 'c1'],
+                             ['c', 'b', 'c2']], columns=[Graph.source_col,
+                                                   Graph.target_col,
+                                                   Graph.channel_col])
+    return Graph([adj0, adj1], ['c1', 'c2'], nodelist, edgelist)
+
+
+class TestSharedGraph:
+    """Tests related to publishing and attaching graphs."""
+    def test_attach_graph(self, graph, tmp_path):
+        path = str(tmp_path / "graph.bin")
+        with publish_graph(graph, path) as shared_graph:
+            attached = attach_graph(shared_graph.path)
+            assert attached.channels == graph.channels
+            assert list(attached.nodes) == list(graph.nodes)
+            for adj, attached_adj in zip(graph.adjs, attached.adjs):
+                assert (adj != attached_adj).nnz == 0
+            assert (attached.is_nbr != graph.is_nbr).nnz == 0
+            assert np.array_equal(attached.in_out_degrees,
+                                  graph.in_out_degrees)
+            assert np.array_equal(attached.edge_src_idxs, graph.edge_src_idxs)
+            assert not attached.adjs[0].data.flags.writeable
+
+    def test_attach_graph_int_nodes(self, graph, tmp_path):
+        graph = Graph(graph.adjs, graph.channels,
+                      pd.DataFrame([10, 20, 30], columns=[Graph.node_col]))
+        with publish_graph(graph, str(tmp_path / "graph.bin")) as shared:
+            attached = attach_graph(shared.path)
+            assert attached.nodes.dtype == graph.nodes.dtype
+            assert attached.nodes.equals(graph.nodes)
+            assert attached.node_idxs[20] == 1
+
+    def test_match_attached_graph(self, graph, tmp_path):
+        with publish_graph(graph, str(tmp_path / "graph.bin")) as shared:
+            smp = MatchingProblem(graph, shared.graph)
+            local_cost_bound.nodewise(smp)
+            local_cost_bound.edgewise(smp)
+            global_cost_bound.from_local_bounds(smp)
+            assert np.sum(smp.candidates()) == 3
@@ -3,6 +3,7 @@ import pytest
 import uclasm
 from uclasm import Graph
 from uclasm.matching.matching_utils import GlobalCostsArray
+from uclasm.matching.sparse_costs import SparseCostMatrix
 import numpy as np
 from scipy.sparse import csr_matrix
 import pandas as pd
@@ -89,6 +90,56 @@ class TestGraph:
         for edge_idx, edge in graph.edgelist.iterrows():
             assert dst_idxs[edge_idx] == graph.node_idxs[edge[graph.target_col]]
 
+    def test_node_subgraph_edge_idxs(self, graph):
+        """Check that subgraph edge indices point at the subgraph's nodes."""
+        subgraph, edge_is_cand = graph.node_subgraph([2, 1],
+                                                     get_edge_is_cand=True)
+        assert list(edge_is_cand) == [False, True]
+        assert list(subgraph.nodes) == ['c', 'b']
+        assert list(subgraph.edge_src_idxs) == [0]
+        assert list(subgraph.edge_dst_idxs) == [1]
+
+    def test_idxs_of_values(self):
+        """Check index lookups of plain and categorical values."""
+        index = pd.Index(['a', 'b', 'c'])
+        values = ['c', 'a', 'c']
+        expected = [2, 0, 2]
+        assert list(uclasm.utils.idxs_of_values(values, index)) == expected
+        categorical = pd.Series(values, dtype="category")
+        assert list(uclasm.utils.idxs_of_values(categorical, index)) == expected
+        with pytest.raises(KeyError):
+            uclasm.utils.idxs_of_values(['a', 'd'], index)
+        assert uclasm.utils.idxs_of_values(values, index).dtype == np.int32
+        assert list(uclasm.utils.idxs_of_values(['a', 'd'], index,
+                                                missing=-1)) == [0, -1]
+
+    def test_node_idxs(self, graph):
+        """Check that node_idxs behaves like a dict of the nodes."""
+        for idx, node in enumerate(graph.nodes):
+            assert graph.node_idxs[node] == idx
+        assert len(graph.node_idxs) == graph.n_nodes
+        with pytest.raises(KeyError):
+            graph.node_idxs['missing']
+
+    def test_apply_index_map_to_cols(self):
+        """Check that values missing from the map are replaced with NaN."""
+        df = pd.DataFrame({'src': ['a', 'b', 'c'], 'dst': ['b', 'b', 'a']})
+        uclasm.utils.apply_index_map_to_cols(df, ['src', 'dst'], ['a', 'b'])
+        assert list(df['dst']) == [1, 1, 0]
+        assert list(df['src'][:2]) == [0, 1]
+        assert np.isnan(df['src'][2])
+
+    def test_sym_edge_counts(self, graph):
+        """Check the edge counts between each pair of neighbors."""
+        indptr, indices, counts = graph.sym_edge_counts
+        assert np.array_equal(indptr, [0, 1, 3, 4])
+        assert np.array_equal(indices, [1, 0, 2, 1])
+        # Columns are c1 forward, c2 forward, c1 backward, c2 backward
+        assert np.array_equal(counts, [[0, 0, 1, 0],
+                                       [1, 0, 0, 0],
+                                       [0, 0, 0, 1],
+                                       [0, 1, 0, 0]])
+
 class TestGlobalCostArray:
     """Tests related to the global costs array"""
     def test_global_costs_array(self):
@@ -131,3 +182,32 @@ class TestGlobalCostArray:
         assert isinstance(sliced_array, GlobalCostsArray)
         assert sliced_array.global_cost_threshold == 3
         assert sliced_array.shape == sliced_array.candidates.shape
+
+class TestSparseCostMatrix:
+    """Tests related to the SparseCostMatrix class"""
+    def test_from_dense(self):
+        dense = np.array([[0, np.inf, 1],
+                          [np.inf, np.inf, np.inf],
+                          [2, 3, np.inf]])
+        costs = SparseCostMatrix.from_dense(dense)
+        assert costs.nnz == 4
+        assert np.array_equal(costs.count_rows(), [2, 0, 2])
+        assert np.array_equal(costs.toarray(), dense)
+        assert costs[0, 1] == np.inf
+        assert costs[2, 1] == 3
+        assert np.array_equal(costs[2], dense[2])
+
+    def test_monotone(self):
+        costs = SparseCostMatrix.from_dense(np.ones((2, 2)), monotone=True)
+        costs[0, [0, 1]] = [0, 2]
+        assert np.array_equal(costs[0], [1, 2])
+        costs.set_data(0)
+        assert np.array_equal(costs[0], [1, 2])
+
+    def test_select(self):
+        costs = SparseCostMatrix.from_dense(np.arange(6).reshape(2, 3))
+        keep = costs.data != 5
+        col_is_kept = np.array([True, False, True])
+        selected = costs.select(keep, col_is_kept)
+        assert selected.shape == (2, 2)
+        assert np.array_equal(selected.toarray(), [[0, 2], [3, np.inf]])
@@ -2,6 +2,7 @@
 __version__ = '0.1.4'
 
 from .graph import *
+from .shared_graph import *
 from .convert import *
 from .readwrite import *
 from .utils import *
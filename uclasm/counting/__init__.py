@@ -1,2 +1,3 @@
-from .isomorphisms import count_isomorphisms, find_isomorphisms
+from .isomorphisms import count_isomorphisms, find_isomorphisms, iter_isomorphisms
+from .isomorphisms import IsomorphismCount
 from .alldiffs import count_alldiffs
@@ -36,9 +36,32 @@ def pick_minimum_domain_vertex(candidates):
 
     return t_vert
 
+class IsomorphismCount(int):
+    """
+    The number of isomorphisms counted, along with whether the count is
+    complete. Behaves as the count itself.
+
+    Attributes
+    ----------
+    complete : bool
+        Whether every isomorphism was counted. False if the budget ran out,
+        in which case the count is a lower bound and counting can be resumed
+        from it.
+    branches : list
+        Branches of the search left to count when the budget ran out. Each
+        is a tuple of the matching to enforce, the matches to prevent and
+        the template nodes of the unspecified cover left to assign.
+    """
+    def __new__(cls, count, branches=()):
+        self = super().__new__(cls, count)
+        self.branches = list(branches)
+        self.complete = len(self.branches) == 0
+        return self
+
 def recursive_isomorphism_counter(smp, matching, *,
         unspec_cover, verbose, init_changed_cands, tmplt_equivalence=False,
-        world_equivalence=False):
+        world_equivalence=False, budget=None, open_branches=None,
+        prevented=()):
     """
     Recursive routine for solving subgraph isomorphism.
 
@@ -60,14 +83,25 @@ def recursive_isomorphism_counter(smp, matching, *,
         Flag indicating whether to use template equivalence
     world_equivalence : bool
         Flag indicating whether to use world equivalence
+    budget : SearchBudget, optional
+        Limits on the resources used. Once one is reached, the branches left
+        to count are added to `open_branches` instead
+    open_branches : list, optional
+        Branches left to count, required with a budget
+    prevented : tuple
+        Matches prevented by template equivalence above this branch
     Returns
     -------
     int
         The number of isomorphisms
     """
 
-    iterate_to_convergence(smp)
+    # Propagate in place. Changes are undone by the caller when it
+    # backtracks, and reducing the world could not be undone.
+    iterate_to_convergence(smp, reduce_world=False)
     candidates = smp.candidates()
+    if budget is not None:
+        budget.expand()
 
     # If the node cover is empty, the unspec nodes are disconnected. Thus, we
     # can skip straight to counting solutions to the alldiff constraint problem
@@ -83,25 +117,36 @@ def recursive_isomorphism_counter(smp, matching, *,
     n_isomorphisms = 0
     unspec_cover_cands = candidates[unspec_cover,:]
     node_idx = pick_minimum_domain_vertex(unspec_cover_cands)
-    cand_idxs = np.argwhere(candidates[node_idx]).flat
+    cand_idxs = np.argwhere(candidates[node_idx]).flatten()
+    # Remove matched node from the unspecified list
+    new_unspec_cover = unspec_cover[:node_idx] + unspec_cover[node_idx+1:]
+    prevented = list(prevented)
 
     for i, cand_idx in enumerate(cand_idxs):
-        smp_copy = smp.copy()
-        # candidates_copy[node_idx] = one_hot(cand_idx, world.n_nodes)
-        smp_copy.add_match(node_idx, cand_idx)
+        if budget is not None and budget.is_exhausted():
+            # Leave the remaining candidates to be counted when resuming
+            open_branches.extend(
+                (tuple(smp.matching) + ((node_idx, idx),), tuple(prevented),
+                 new_unspec_cover)
+                for idx in cand_idxs[i:])
+            break
+        # Record changes made below this branch so they can be undone
+        mark = smp.checkpoint()
+        smp.add_match(node_idx, cand_idx)
 
         matching.append((node_idx, cand_idx))
-        # Remove matched node from the unspecified list
-        new_unspec_cover = unspec_cover[:node_idx] + unspec_cover[node_idx+1:]
 
         # recurse to make assignment for the next node in the unspecified cover
         n_isomorphisms += recursive_isomorphism_counter(
-            smp_copy, matching, unspec_cover=new_unspec_cover,
+            smp, matching, unspec_cover=new_unspec_cover,
             verbose=verbose,
-            init_changed_cands=one_hot(node_idx, smp.tmplt.n_nodes))
+            init_changed_cands=one_hot(node_idx, smp.tmplt.n_nodes),
+            budget=budget, open_branches=open_branches,
+            prevented=tuple(prevented))
 
         # Unmatch template vertex
         matching.pop()
+        smp.backtrack(mark)
 
         # TODO: more useful progress summary
         if verbose:
@@ -113,12 +158,14 @@ def recursive_isomorphism_counter(smp, matching, *,
         if tmplt_equivalence:
             for eq_t_vert in smp.tmplt.eq_classes[node_idx]:
                 smp.prevent_match(eq_t_vert, cand_idx)
+                prevented.append((eq_t_vert, cand_idx))
 
     return n_isomorphisms
 
 
 def count_isomorphisms(smp, *, verbose=True,
-                       tmplt_equivalence=False, world_equivalence=False):
+                       tmplt_equivalence=False, world_equivalence=False,
+                       budget=None, resume=None):
     """
     Counts the number of ways to assign template nodes to world nodes such that
     edges between template nodes also appear between the corresponding world
@@ -138,11 +185,24 @@ def count_isomorphisms(smp, *, verbose=True,
         Flag indicating whether to use template equivalence
     world_equivalence : bool
         Flag indicating whether to use world equivalence
+    budget : SearchBudget, optional
+        Limits on the time, branches and memory used. Once one is reached,
+        counting stops and the count so far is returned
+    resume : IsomorphismCount, optional
+        A count on the same problem which ran out of budget, from which to
+        continue counting
     Returns
     -------
-    int
-        The number of isomorphisms
+    IsomorphismCount
+        The number of isomorphisms, or a lower bound on it if the budget ran
+        out before every branch was counted
     """
+    if budget is not None:
+        budget.start()
+    if resume is not None:
+        return count_branches(
+            smp, resume.branches, n_isomorphisms=int(resume),
+            verbose=verbose, budget=budget)
 
     matching = []
     candidates = smp.candidates()
@@ -159,59 +219,133 @@ def count_isomorphisms(smp, *, verbose=True,
     unspec_cover_idxs = [smp.tmplt.node_idxs[node] for node in unspec_cover_nodes]
 
     # Send zeros to init_changed_cands since we already just ran the filters
-    return recursive_isomorphism_counter(
+    open_branches = []
+    n_isomorphisms = recursive_isomorphism_counter(
         smp, matching, verbose=verbose, unspec_cover=unspec_cover_idxs,
-        init_changed_cands=np.zeros(smp.tmplt.nodes.shape, dtype=np.bool))
+        init_changed_cands=np.zeros(smp.tmplt.nodes.shape, dtype=np.bool),
+        budget=budget, open_branches=open_branches)
+    return IsomorphismCount(n_isomorphisms, open_branches)
+
+def count_branches(smp, branches, *, n_isomorphisms=0, verbose=True,
+                   budget=None):
+    """
+    Count the isomorphisms in branches left by a count which ran out of
+    budget. Each branch is imposed on the matching problem in turn and undone
+    once counted.
+
+    Parameters
+    ----------
+    smp : MatchingProblem
+        The subgraph matching problem the branches were left on
+    branches : list
+        Branches as in `IsomorphismCount.branches`
+    n_isomorphisms : int
+        Number of isomorphisms already counted
+    verbose : bool
+        Flag for verbose output
+    budget : SearchBudget, optional
+        Limits on the resources used, already started
+    Returns
+    -------
+    IsomorphismCount
+        The number of isomorphisms, including those already counted
+    """
+    branches = list(branches)
+    open_branches = []
+    while len(branches) > 0:
+        if budget is not None and budget.is_exhausted():
+            break
+        branch_matching, prevented, unspec_cover = branches.pop(0)
+        mark = smp.checkpoint()
+        for tmplt_idx, world_idx in prevented:
+            smp.prevent_match(tmplt_idx, world_idx)
+        smp.enforce_matching(branch_matching)
+        n_isomorphisms += recursive_isomorphism_counter(
+            smp, list(branch_matching), verbose=verbose,
+            unspec_cover=unspec_cover,
+            init_changed_cands=np.zeros(smp.tmplt.nodes.shape, dtype=np.bool),
+            budget=budget, open_branches=open_branches, prevented=prevented)
+        smp.backtrack(mark)
+    return IsomorphismCount(n_isomorphisms, open_branches + branches)
+
+def recursive_isomorphism_iterator(smp, *, unspec_node_idxs, verbose):
+    """
+    Recursive generator of the isomorphisms extending the current candidates.
+
+    Each assignment is undone before the next one is tried, even if the
+    caller stops iterating early, so that `smp` is left as it was found.
+
+    Parameters
+    ----------
+    smp : MatchingProblem
+        A subgraph matching problem
+    unspec_node_idxs : np.array
+        Indices of the template nodes left to assign, in order
+    verbose : bool
+        Flag for verbose output
+    Yields
+    ------
+    dict
+        Each isomorphism, mapping template nodes to world nodes
+    """
+    # Propagate in place. Changes are undone by the caller when it
+    # backtracks, and reducing the world could not be undone.
+    iterate_to_convergence(smp, reduce_world=False)
+    candidates = smp.candidates()
 
-def recursive_isomorphism_finder(smp, *,
-                                 unspec_node_idxs, verbose, init_changed_cands,
-                                 found_isomorphisms):
     if len(unspec_node_idxs) == 0:
-        # All nodes have been assigned, add the isomorphism to the list
+        # The last assignment may have left some template node without
+        # any candidates
+        if not np.all(candidates.any(axis=1)):
+            return
+        # All nodes have been assigned, yield the isomorphism
         new_isomorphism = {}
-        candidates = smp.candidates()
         for tmplt_idx, tmplt_node in enumerate(smp.tmplt.nodes):
+            world_node = smp.world.nodes[candidates[tmplt_idx]]
+            if isinstance(world_node, pd.Series):
+                world_node = world_node.iloc[0]
             if verbose:
-                world_node = smp.world.nodes[candidates[tmplt_idx]]
-                if isinstance(world_node, pd.Series):
-                    world_node = world_node.iloc[0]
                 print(str(tmplt_node)+":", world_node)
-                new_isomorphism[tmplt_node] = world_node
-        found_isomorphisms.append(new_isomorphism)
-        return found_isomorphisms
-
-    iterate_to_convergence(smp)
-    candidates = smp.candidates()
+            new_isomorphism[tmplt_node] = world_node
+        yield new_isomorphism
+        return
 
     node_idx = unspec_node_idxs[0]
     cand_idxs = np.argwhere(candidates[node_idx]).flat
 
     for i, cand_idx in enumerate(cand_idxs):
-        smp_copy = smp.copy()
+        mark = smp.checkpoint()
         smp.add_match(node_idx, cand_idx)
+        try:
+            # recurse to make assignment for the next node
+            yield from recursive_isomorphism_iterator(
+                smp, unspec_node_idxs=unspec_node_idxs[1:], verbose=verbose)
+        finally:
+            smp.backtrack(mark)
 
-        # recurse to make assignment for the next node in the unspecified cover
-        recursive_isomorphism_finder(
-            smp_copy,
-            unspec_node_idxs=unspec_node_idxs[1:],
-            verbose=verbose,
-            init_changed_cands=one_hot(node_idx, smp.tmplt.n_nodes),
-            found_isomorphisms=found_isomorphisms)
+def recursive_isomorphism_finder(smp, *,
+                                 unspec_node_idxs, verbose, init_changed_cands,
+                                 found_isomorphisms):
+    found_isomorphisms.extend(recursive_isomorphism_iterator(
+        smp, unspec_node_idxs=unspec_node_idxs, verbose=verbose))
     return found_isomorphisms
 
+def iter_isomorphisms(smp, *, verbose=True):
+    """ Yields isomorphisms as dictionaries mapping template nodes to world
+    nodes, one at a time, so that they need not all be held in memory and the
+    search can be stopped once enough have been found. The matching problem
+    is restored when the iteration stops, early or not.
+    """
+    unspec_node_idxs = np.where(smp.candidates().sum(axis=1) > 1)[0]
+    yield from recursive_isomorphism_iterator(
+        smp, verbose=verbose, unspec_node_idxs=unspec_node_idxs)
+
 def find_isomorphisms(smp, *, verbose=True):
     """ Returns a list of isomorphisms as dictionaries mapping template nodes to
     world nodes. Note: this is much slower than counting, and should only be
     done for small numbers of isomorphisms and fully filtered candidate matrices
     """
-    unspec_node_idxs = np.where(smp.candidates().sum(axis=1) > 1)[0]
-    found_isomorphisms = []
-
-    return recursive_isomorphism_finder(
-        smp, verbose=verbose,
-        unspec_node_idxs=unspec_node_idxs,
-        init_changed_cands=np.zeros(smp.tmplt.nodes.shape, dtype=np.bool),
-        found_isomorphisms=found_isomorphisms)
+    return list(iter_isomorphisms(smp, verbose=verbose))
 
 def print_isomorphisms(smp, *, verbose=True):
     """ Prints the list of isomorphisms """
@@ -5,7 +5,7 @@ import numpy as np
 import pandas as pd
 import sys
 
-from .utils import index_map, one_hot
+from .utils import IndexMap, idxs_of_values, index_dtype, one_hot
 
 # functools.cached_property was introduced in python 3.8.
 # https://docs.python.org/3/library/functools.html#functools.cached_property
@@ -112,7 +112,6 @@ class Graph:
 
         self.nodelist = nodelist
         self.nodes = self.nodelist[self.node_col]
-        self.node_idxs = index_map(self.nodes)
 
         # TODO: Make sure nodelist is indexed in a reasonable way
         # TODO: Make sure edgelist is indexed in a reasonable way
@@ -205,6 +204,77 @@ class Graph:
         """
         return np.argwhere(sparse.tril(self.is_nbr))
 
+    @cached_property
+    def sym_edge_counts(self):
+        """(1darray, 1darray, 2darray): Edge counts between neighbors.
+
+        The row pointers and column indices of `is_nbr` in csr format, along
+        with a 2darray of shape [nnz, 2 * n_channels]. For the entry (i, j),
+        the first n_channels columns count the edges from i to j in each
+        channel and the remaining n_channels columns count those from j to i.
+        """
+        is_nbr = sparse.csr_matrix(self.is_nbr)
+        is_nbr.sort_indices()
+        rows = np.repeat(np.arange(self.n_nodes), np.diff(is_nbr.indptr))
+        # Entries are sorted by row then column, so their keys are sorted too
+        keys = rows.astype(np.int64) * self.n_nodes + is_nbr.indices
+
+        dtype = np.result_type(*[adj.dtype for adj in self.adjs])
+        counts = np.zeros((len(keys), 2 * self.n_channels), dtype=dtype)
+        for ch_idx, adj in enumerate(self.adjs):
+            adj = adj.tocoo()
+            is_edge = adj.data != 0
+            srcs = adj.row[is_edge].astype(np.int64)
+            dsts = adj.col[is_edge].astype(np.int64)
+            n_edges = adj.data[is_edge]
+            fwd_pos = np.searchsorted(keys, srcs * self.n_nodes + dsts)
+            bwd_pos = np.searchsorted(keys, dsts * self.n_nodes + srcs)
+            counts[:, ch_idx] = np.bincount(
+                fwd_pos, weights=n_edges, minlength=len(keys))
+            counts[:, self.n_channels + ch_idx] = np.bincount(
+                bwd_pos, weights=n_edges, minlength=len(keys))
+        return is_nbr.indptr, is_nbr.indices, counts
+
+    @cached_property
+    def start_time_index(self):
+        """(1darray, 1darray): Nodes sorted by their start time.
+
+        The indices of the nodes with a start time in the "start" column of
+        the nodelist, sorted by that time, along with the sorted start times
+        as int64 nanoseconds since the epoch. Nodes with a missing start time
+        are left out. Sorting once lets the start times of any subset of
+        nodes be read in order by masking.
+        """
+        times = pd.to_datetime(self.nodelist["start"]).to_numpy(
+            dtype="datetime64[ns]")
+        has_time = ~np.isnat(times)
+        node_idxs = np.flatnonzero(has_time)
+        times = times[has_time].view(np.int64)
+        order = np.argsort(times, kind="stable")
+        return node_idxs[order], times[order]
+
+    @cached_property
+    def geo_coords(self):
+        """(1darray, 2darray): Coordinates of the nodes.
+
+        Whether each node has a value in the "latitude" and "longitude"
+        columns of the nodelist, where "", "%NA%" and "%NULL%" mark missing
+        values, along with a 2darray of shape [n_nodes, 2] holding the
+        latitude and longitude of each node in degrees. Coordinates which are
+        missing or cannot be parsed are nan.
+        """
+        null_values = ["", "%NA%", "%NULL%"]
+        lats = self.nodelist["latitude"]
+        lngs = self.nodelist["longitude"]
+        has_coords = ~lats.isin(null_values).to_numpy() & \
+            ~lngs.isin(null_values).to_numpy()
+        coords = np.full((self.n_nodes, 2), np.nan)
+        coords[has_coords, 0] = pd.to_numeric(lats[has_coords],
+                                              errors="coerce")
+        coords[has_coords, 1] = pd.to_numeric(lngs[has_coords],
+                                              errors="coerce")
+        return has_coords, coords
+
     @cached_property
     def self_edges(self):
         """2darray: An array of self-edge counts in each channel.
@@ -251,25 +321,53 @@ class Graph:
         deglist = [self.in_degrees, self.out_degrees]
         return np.concatenate(deglist, axis=1).astype(np.single)
 
+    @cached_property
+    def node_index(self):
+        """pd.Index: Index of the node identifiers, for vectorized lookups."""
+        return pd.Index(self.nodes)
+
+    @cached_property
+    def node_idxs(self):
+        """IndexMap: Map from node identifiers to their indices, backed by
+        `node_index` rather than a dict."""
+        return IndexMap(self.node_index)
+
+    def idxs_of_nodes(self, nodes):
+        """Get the indices of the given nodes.
+
+        Parameters
+        ----------
+        nodes : Iterable[str]
+            Identifiers of nodes in the graph.
+
+        Returns
+        -------
+        np.ndarray(int32 or int64)
+            The index of each node, as int32 unless there are too many nodes.
+        """
+        if hasattr(nodes, "compute"):
+            nodes = nodes.compute()
+        return idxs_of_values(nodes, self.node_index)
+
     @cached_property
     def edge_src_idxs(self):
         """Gets the node indices of the sources of each edge in the edgelist.
         Returns
         -------
-        np.ndarray(uint16)
+        np.ndarray(int32 or int64)
             The array of source node indices.
         """
-        return np.array([self.node_idxs[src_node] for src_node in self.edgelist[self.source_col]])
+        return self.idxs_of_nodes(self.edgelist[self.source_col])
 
     @cached_property
     def edge_dst_idxs(self):
         """Gets the node indices of the destinations of each edge in the edgelist.
         Returns
         -------
-        np.ndarray(uint16)
+        np.ndarray(int32 or int64)
             The array of destination node indices.
         """
-        return np.array([self.node_idxs[dst_node] for dst_node in self.edgelist[self.target_col]])
+        return self.idxs_of_nodes(self.edgelist[self.target_col])
 
     def loopless_subgraph(self):
         """Get a subgraph containing no self-edges.
@@ -321,12 +419,35 @@ class Graph:
         nodes = nodelist[self.node_col]
 
         edge_is_cand = None
+        sub_edge_src_idxs = None
+        sub_edge_dst_idxs = None
         if self.edgelist is not None:
-            # TODO: Test this to see if it works with dask DataFrames.
-            _sources = self.edgelist[self.source_col].isin(nodes)
-            _targets = self.edgelist[self.target_col].isin(nodes)
-            edge_is_cand = _sources & _targets
-            edgelist = self.edgelist[_sources & _targets].reset_index(drop=True)
+            try:
+                edge_src_idxs = self.edge_src_idxs
+                edge_dst_idxs = self.edge_dst_idxs
+            except (TypeError, KeyError):
+                # Edges with several alternative endpoints, or endpoints
+                # missing from the nodelist, have no single index
+                edge_src_idxs = None
+            if edge_src_idxs is not None and \
+                    isinstance(self.edgelist, pd.DataFrame):
+                # Map old node indices to new ones, or -1 for dropped nodes
+                kept_idxs = np.arange(self.n_nodes)[node_idxs]
+                new_idxs = np.full(self.n_nodes, -1,
+                                   dtype=index_dtype(self.n_nodes))
+                new_idxs[kept_idxs] = np.arange(len(kept_idxs))
+                sub_edge_src_idxs = new_idxs[edge_src_idxs]
+                sub_edge_dst_idxs = new_idxs[edge_dst_idxs]
+                edge_is_cand = (sub_edge_src_idxs >= 0) & \
+                               (sub_edge_dst_idxs >= 0)
+                sub_edge_src_idxs = sub_edge_src_idxs[edge_is_cand]
+                sub_edge_dst_idxs = sub_edge_dst_idxs[edge_is_cand]
+            else:
+                # TODO: Test this to see if it works with dask DataFrames.
+                _sources = self.edgelist[self.source_col].isin(nodes)
+                _targets = self.edgelist[self.target_col].isin(nodes)
+                edge_is_cand = _sources & _targets
+            edgelist = self.edgelist[edge_is_cand].reset_index(drop=True)
         else:
             edgelist = None
 
@@ -336,6 +457,10 @@ class Graph:
                     source_col=self.source_col,
                     target_col=self.target_col,
                     channel_col=self.channel_col)
+        if sub_edge_src_idxs is not None:
+            # Save the subgraph from looking its edges up again
+            subgraph.edge_src_idxs = sub_edge_src_idxs
+            subgraph.edge_dst_idxs = sub_edge_dst_idxs
         if get_edge_is_cand:
             return subgraph, edge_is_cand
         else:
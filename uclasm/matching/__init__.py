@@ -1,4 +1,8 @@
 from .matching_problem import MatchingProblem
+from .sparse_costs import SparseCostMatrix
+from .cost_cache import EdgewiseCostCache
+from .trail import Trail
+from .propagation import PropagationStats
 
 from .filters import *
 
@@ -0,0 +1,253 @@
+"""Provide a persistent, content-addressed cache of edgewise cost matrices."""
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+# Bump this when the layout or meaning of the cached matrices changes, so that
+# entries written by older versions are never read.
+COST_CACHE_FORMAT_VERSION = 1
+
+
+def hash_table(columns, rows):
+    """Hash a table of attributes by content.
+
+    Parameters
+    ----------
+    columns : list(str)
+        Name of each column of the table.
+    rows : 2darray
+        Values of the table. Values are compared by their string form.
+
+    Returns
+    -------
+    str
+        Hex digest which changes whenever the columns or values do.
+    """
+    str_array = np.frompyfunc(str, 1, 1)
+    rows = np.asarray(rows)
+    values = str_array(rows).astype(str) if rows.size else rows.astype(str)
+    values = np.ascontiguousarray(values)
+    digest = hashlib.sha256()
+    digest.update(json.dumps([list(map(str, columns)), values.dtype.str,
+                              list(values.shape)]).encode())
+    digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+def cost_fn_version(fn):
+    """Get a default version string for a cost function.
+
+    The version is derived from the name and compiled code of the function, so
+    editing the function invalidates its cached costs. It cannot see data the
+    function reads from outside, such as globals or closed over variables;
+    pass an explicit version when those affect the costs.
+
+    Parameters
+    ----------
+    fn : function
+        Cost function to describe.
+
+    Returns
+    -------
+    str
+        A string which identifies the function.
+    """
+    code = getattr(fn, "__code__", None)
+    if code is None:
+        # Callable objects have no code to hash, and their repr usually
+        # contains their address. Entries then only hit within a process.
+        return repr(fn)
+    digest = hashlib.sha256()
+    _hash_code(digest, code)
+    digest.update(repr(fn.__defaults__).encode())
+    return "{}.{}:{}".format(fn.__module__, fn.__qualname__,
+                             digest.hexdigest())
+
+
+def _hash_code(digest, code):
+    """Add compiled code and its constants to a digest.
+
+    Nested code objects, such as those of comprehensions and lambdas, are
+    hashed by content, since their repr contains their address.
+    """
+    digest.update(code.co_code)
+    for const in code.co_consts:
+        if hasattr(const, "co_code"):
+            _hash_code(digest, const)
+        else:
+            digest.update(repr(const).encode())
+
+
+class EdgewiseCostCache:
+    """A directory of edgewise cost matrices keyed by what they were computed
+    from.
+
+    Each entry is a single .npy file whose name is a hash of the template and
+    world attribute tables, the version of the edge attribute function, and
+    how the matrix is laid out. A matrix can therefore only be found again by
+    a problem which would compute exactly the same matrix.
+
+    Entries are written to a temporary file and renamed into place, so a
+    reader never sees a partially written matrix, and are read back as
+    read-only memory maps. When the total size of the entries exceeds
+    `max_bytes`, the least recently used entries are removed.
+
+    Examples
+    --------
+    >>> smp = uclasm.MatchingProblem(tmplt, world, edge_attr_fn=attr_fn,
+    ...                              cache_path="edge_costs",
+    ...                              edge_attr_fn_version="v2")
+
+    Parameters
+    ----------
+    path : str
+        Directory holding the entries. Created if it does not exist.
+    max_bytes : int, optional
+        Disk budget for the entries. Unlimited by default.
+
+    Attributes
+    ----------
+    path : str
+        Directory holding the entries.
+    max_bytes : int or None
+        Disk budget for the entries.
+    """
+
+    suffix = ".npy"
+
+    def __init__(self, path, max_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(tmplt_hash, world_hash, fn_version, by_unique_attrs):
+        """Combine everything a cost matrix depends on into a key.
+
+        Parameters
+        ----------
+        tmplt_hash, world_hash : str
+            Hashes of the template and world attribute tables.
+        fn_version : str
+            Version of the edge attribute function.
+        by_unique_attrs : bool
+            Whether the matrix is indexed by unique attributes rather than
+            by edges.
+
+        Returns
+        -------
+        str
+            Hex digest naming the entry.
+        """
+        parts = [COST_CACHE_FORMAT_VERSION, tmplt_hash, world_hash,
+                 str(fn_version), bool(by_unique_attrs)]
+        return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key + self.suffix)
+
+    def __contains__(self, key):
+        return os.path.exists(self._entry_path(key))
+
+    def get(self, key):
+        """Read an entry, marking it as recently used.
+
+        Parameters
+        ----------
+        key : str
+            Key of the entry, from `key`.
+
+        Returns
+        -------
+        2darray or None
+            A read-only memory map of the matrix, or None if there is no
+            such entry.
+        """
+        entry_path = self._entry_path(key)
+        try:
+            costs = np.load(entry_path, mmap_mode="r")
+        except (IOError, ValueError):
+            # Missing, or evicted or corrupted by another process
+            return None
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        return costs
+
+    def put(self, key, costs):
+        """Write an entry atomically, then evict entries over the budget.
+
+        Parameters
+        ----------
+        key : str
+            Key of the entry, from `key`.
+        costs : 2darray
+            Matrix to be stored.
+        """
+        fd, tmp_path = tempfile.mkstemp(prefix=".partial_", suffix=self.suffix,
+                                        dir=self.path)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.asarray(costs))
+            os.replace(tmp_path, self._entry_path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict(keep=key)
+
+    def entries(self):
+        """List the stored entries, least recently used first.
+
+        Returns
+        -------
+        list(tuple(str, int))
+            The key and size in bytes of each entry.
+        """
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(self.suffix) or name.startswith("."):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name[:-len(self.suffix)],
+                            stat.st_size))
+        entries.sort()
+        return [(key, size) for _, key, size in entries]
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until within the disk budget.
+
+        Parameters
+        ----------
+        keep : str, optional
+            Key of an entry which should not be removed.
+        """
+        if self.max_bytes is None:
+            return
+        entries = self.entries()
+        total_bytes = sum(size for _, size in entries)
+        for key, size in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(self._entry_path(key))
+            except OSError:
+                pass
+            total_bytes -= size
+
+    def clear(self):
+        """Remove every entry."""
+        for key, _ in self.entries():
+            try:
+                os.remove(self._entry_path(key))
+            except OSError:
+                pass
@@ -1,23 +1,50 @@
-import time
 import numpy as np
 from . import stats_filter
 from . import topology_filter
 from ..global_cost_bound import *
+from ..propagation import PropagationStats
 
 # Note: this run_filters is for testing purposes
 # TODO: Add other components
 
-def run_filters(smp, verbose=True):
+def run_filters(smp, verbose=True, stats=None):
     """
     Repeatedly run the desired filters until the candidates converge
+
+    The stats filter only depends on the degrees of the nodes, so it is
+    rerun only after the world is reduced. The topology filter only
+    reevaluates the template edges touching nodes whose candidates changed.
+
+    Returns
+    -------
+    PropagationStats
+        The effectiveness of each filter.
     """
+    if stats is None:
+        stats = PropagationStats()
     num_iter = 0
+    changed_cands = None
+    # Candidate counts as of the last run of the topology filter
+    topology_cand_counts = None
+    world_changed = True
+    cand_counts = smp.candidate_counts()
     # Note: most efficient if we only call from_local_bounds in reduce_world
     while smp.have_candidates_changed() or num_iter == 0:
-        stats_filter(smp)
-        topology_filter(smp)
-        from_local_bounds(smp)
+        if world_changed and stats.should_run("stats_filter"):
+            cand_counts = stats.run("stats_filter", smp, stats_filter,
+                                    cand_counts=cand_counts)
+        if stats.should_run("topology_filter"):
+            if topology_cand_counts is not None:
+                changed_cands = cand_counts != topology_cand_counts
+            topology_cand_counts = cand_counts
+            cand_counts = stats.run("topology_filter", smp, topology_filter,
+                                    cand_counts=cand_counts,
+                                    changed_cands=changed_cands)
+        cand_counts = stats.run("from_local_bounds", smp, from_local_bounds,
+                                cand_counts=cand_counts)
+        n_world_nodes = smp.world.n_nodes
         smp.reduce_world()
+        world_changed = smp.world.n_nodes < n_world_nodes
 
         if verbose:
             print("There are {} nodes left in the world.".format(smp.world.n_nodes))
@@ -26,4 +53,6 @@ def run_filters(smp, verbose=True):
 
     if verbose:
         print(smp)
+        print(stats)
         print("filters are done after {} iterations.".format(num_iter))
+    return stats
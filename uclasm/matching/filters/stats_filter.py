@@ -16,4 +16,5 @@ def stats_filter(smp):
                                    smp.local_cost_threshold)
 
     # TODO: check whether this works
+    smp.own_costs("local_costs")
     smp.local_costs[~is_cand] = np.inf
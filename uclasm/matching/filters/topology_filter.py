@@ -1,7 +1,7 @@
 from ..local_cost_bound.edgewise import edgewise_local_costs
 import numpy as np
 
-def topology_filter(smp):
+def topology_filter(smp, changed_cands=None):
     """Filtering based on topology.
 
     TODO: Add the option of filtering just for one node
@@ -10,11 +10,15 @@ def topology_filter(smp):
     ----------
     smp : MatchingProblem
         A subgraph matching problem on which to compute nodewise cost bounds.
+    changed_cands : ndarray(bool), optional
+        Template nodes whose candidates have changed since the last run. Only
+        the edges touching them have to be reevaluated.
     """
-    disagreements = edgewise_local_costs(smp)
+    disagreements = edgewise_local_costs(smp, changed_cands=changed_cands)
 
     is_cand = disagreements <= min(smp.global_cost_threshold,
                                    smp.local_cost_threshold)
 
     # TODO: check whether this works
+    smp.own_costs("local_costs")
     smp.local_costs[~is_cand] = np.inf
@@ -1,3 +1,5 @@
 """Provide functions for bounding global node assignment costs from below."""
 
 from .from_local_bounds import from_local_bounds
+from .sparse_lap import sparse_clap_costs
+from .relaxed_bounds import relaxed_clap_costs
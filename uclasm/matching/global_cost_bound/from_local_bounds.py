@@ -1,20 +1,32 @@
 """Provide a function for bounding global assignment costs from local costs."""
+import hashlib
+
 from laptools import clap
 import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+from .relaxed_bounds import relaxed_clap_costs
+from .sparse_lap import sparse_clap_costs
 
 
 def from_local_bounds(smp):
     """Bound global costs by smallest linear sum assignment of local costs.
 
+    The assignments are solved as selected by the problem, see
+    `assignment_bounds`.
+
     Parameters
     ----------
     smp : MatchingProblem
         A subgraph matching problem on which to compute nodewise cost bounds.
     """
-    if smp.match_fixed_costs:
+    if smp.sparse_costs:
+        from_local_bounds_sparse(smp)
+    elif smp.match_fixed_costs:
         costs = smp.local_costs / 2 + smp.fixed_costs
-        global_cost_bounds = clap.costs(costs)
-        smp.global_costs[:] = global_cost_bounds
+        global_cost_bounds = assignment_bounds(smp, costs, smp.candidates())
+        smp.global_costs = global_cost_bounds
     else:
         tmplt_idx_mask = np.ones(smp.tmplt.n_nodes, dtype=np.bool)
         world_idx_mask = np.ones(smp.world.n_nodes, dtype=np.bool)
@@ -25,15 +37,249 @@ def from_local_bounds(smp):
         partial_match_cost = np.sum([smp.local_costs[match]/2 + smp.fixed_costs[match] for match in smp.matching])
         mask = np.ix_(tmplt_idx_mask, world_idx_mask)
         total_match_cost = partial_match_cost
+        # Every entry is bounded below, so build the bounds in a new array and
+        # set them all at once
+        global_costs = np.full(smp.shape, float("inf"))
         if np.any(tmplt_idx_mask):
             costs = smp.local_costs[mask] / 2 + smp.fixed_costs[mask]
-            global_cost_bounds = clap.costs(costs)
-            smp.global_costs[mask] = global_cost_bounds + partial_match_cost
+            global_cost_bounds = assignment_bounds(
+                smp, costs, smp.candidates()[mask],
+                offset=partial_match_cost,
+                row_ids=np.flatnonzero(tmplt_idx_mask),
+                col_ids=np.flatnonzero(world_idx_mask))
+            global_costs[mask] = global_cost_bounds + partial_match_cost
             total_match_cost += np.min(global_cost_bounds)
         non_matching_mask = smp.get_non_matching_mask()
-        smp.global_costs[non_matching_mask] = float("inf")
+        global_costs[non_matching_mask] = float("inf")
         for tmplt_idx, world_idx in smp.matching:
-            smp.global_costs[tmplt_idx, world_idx] = total_match_cost
+            global_costs[tmplt_idx, world_idx] = total_match_cost
+        smp.global_costs = global_costs
 
     # TODO: should the global costs for local costs introduced by neighborhood
     # constraint be computed in the same way?
+
+
+def assignment_bounds(smp, costs, is_cand, offset=0, row_ids=None,
+                      col_ids=None):
+    """Bound the constrained assignment costs as selected by the problem.
+
+    With `smp.tiered_bounds`, the cheap bounds of `relaxed_clap_costs` are
+    computed first. If they eliminate any candidates, they are returned as
+    they are, and the exact bounds are left until the cheap ones stop
+    pruning. With `smp.sparse_lap`, the exact bounds are computed over the
+    candidates with `candidate_clap_costs`, which for tiered bounds are the
+    candidates which survive the cheap bounds. Otherwise the exact bounds
+    are computed with `decomposed_clap_costs`.
+
+    Parameters
+    ----------
+    smp : MatchingProblem
+        Problem selecting how to bound the costs.
+    costs : 2darray
+        Matrix of costs, or the submatrix of the unmatched template nodes and
+        world nodes.
+    is_cand : 2darray
+        Boolean matrix of the current candidates among `costs`.
+    offset : float, optional
+        Cost added to every bound to get the global costs, such as the cost
+        of a partial match.
+    row_ids, col_ids : 1darray, optional
+        Indices of the template nodes and world nodes of `costs`.
+
+    Returns
+    -------
+    2darray
+        Lower bounds on the constrained assignment costs, without `offset`.
+    """
+    if smp.tiered_bounds:
+        relaxed_bounds = relaxed_clap_costs(costs)
+        survivors = is_cand & smp._within_threshold(relaxed_bounds + offset)
+        if np.sum(survivors) < np.sum(is_cand):
+            return relaxed_bounds
+        if smp.sparse_lap:
+            exact_bounds = candidate_clap_costs(costs, survivors)
+            return np.where(survivors, exact_bounds, relaxed_bounds)
+        exact_bounds = decomposed_clap_costs(costs, is_cand=survivors,
+                                             cache=smp._clap_cache,
+                                             row_ids=row_ids, col_ids=col_ids)
+        return np.maximum(exact_bounds, relaxed_bounds)
+    is_cand = is_cand & smp._within_threshold(costs + offset)
+    if smp.sparse_lap:
+        return candidate_clap_costs(costs, is_cand)
+    return decomposed_clap_costs(costs, is_cand=is_cand,
+                                 cache=smp._clap_cache,
+                                 row_ids=row_ids, col_ids=col_ids)
+
+
+def candidate_clap_costs(costs, is_cand):
+    """Compute constrained assignment costs over the candidates only.
+
+    A match within the global cost threshold can only use pairs which are
+    candidates, so leaving the other pairs out of every assignment still
+    gives valid bounds. They are at least as tight as those of `clap.costs`,
+    and the work scales with the number of candidates.
+
+    Parameters
+    ----------
+    costs : 2darray
+        Matrix of costs.
+    is_cand : 2darray
+        Boolean matrix of the pairs which may be assigned.
+
+    Returns
+    -------
+    2darray
+        Entry (i, j) is the cost of the smallest assignment of candidates
+        sending i to j, or inf if (i, j) is not a candidate.
+    """
+    global_cost_bounds = np.full(costs.shape, np.inf)
+    if costs.shape[0] > costs.shape[1]:
+        return global_cost_bounds
+    rows, cols = np.nonzero(is_cand & np.isfinite(costs))
+    cand_costs = csr_matrix((np.asarray(costs)[rows, cols], (rows, cols)),
+                            shape=costs.shape)
+    cand_bounds = sparse_clap_costs(cand_costs).tocoo()
+    global_cost_bounds[cand_bounds.row, cand_bounds.col] = cand_bounds.data
+    return global_cost_bounds
+
+
+def decomposed_clap_costs(costs, is_cand=None, cache=None, row_ids=None,
+                          col_ids=None):
+    """Compute `clap.costs` separately on each component of the candidates.
+
+    Rows and columns are connected by their candidate pairs. A match within
+    the global cost threshold can not pair a row with a column in another
+    component, so the constrained assignment cost of an entry is its
+    constrained cost within its own component plus the smallest assignment
+    cost of every other component. Entries between components are not
+    candidates, and are bounded by inf.
+
+    The bounds of each component are cached under a hash of its rows,
+    columns and costs, so components whose costs have not changed since the
+    last call are not solved again. Only the components of the last call are
+    kept.
+
+    Parameters
+    ----------
+    costs : 2darray
+        Matrix of costs.
+    is_cand : 2darray, optional
+        Boolean matrix of the pairs which may be assigned. By default, the
+        pairs whose cost is finite.
+    cache : dict, optional
+        Bounds of the components solved by previous calls, updated in place.
+    row_ids, col_ids : 1darray, optional
+        Identify the rows and columns of `costs` in the cache, for when it
+        is a submatrix of the matrix they are numbered in. By default, rows
+        and columns are identified by their position.
+
+    Returns
+    -------
+    2darray
+        Entry (i, j) is the cost of the smallest assignment sending i to j
+        within the component of i, or inf if j is in another component.
+    """
+    costs = np.asarray(costs, dtype=np.float64)
+    n_rows, n_cols = costs.shape
+    if n_rows > n_cols:
+        return clap.costs(costs)
+    if cache is None:
+        cache = {}
+    if row_ids is None:
+        row_ids = np.arange(n_rows)
+    if col_ids is None:
+        col_ids = np.arange(n_cols)
+
+    is_cand = np.isfinite(costs) if is_cand is None else \
+        np.asarray(is_cand, dtype=np.bool_) & np.isfinite(costs)
+
+    # Rows come first and columns second in the bipartite graph
+    cand_rows, cand_cols = np.nonzero(is_cand)
+    bipartite = csr_matrix(
+        (np.ones(len(cand_rows), dtype=np.bool_),
+         (cand_rows, n_rows + cand_cols)),
+        shape=(n_rows + n_cols, n_rows + n_cols))
+    _, labels = connected_components(bipartite, directed=False)
+    row_labels = labels[:n_rows]
+    col_labels = labels[n_rows:]
+
+    row_label_set = np.unique(row_labels)
+    if len(row_label_set) == 1:
+        # Nothing to split, so solve the matrix as it is
+        comp_idxs = [(np.arange(n_rows), np.arange(n_cols))]
+    else:
+        comp_idxs = [(np.flatnonzero(row_labels == label),
+                      np.flatnonzero(col_labels == label))
+                     for label in row_label_set]
+
+    components = []
+    used_cache = {}
+    total_cost = 0.0
+    for comp_rows, comp_cols in comp_idxs:
+        if len(comp_rows) > len(comp_cols):
+            # Some row cannot be assigned, so no entry can either
+            return np.full(costs.shape, np.inf)
+        comp_costs = costs[np.ix_(comp_rows, comp_cols)]
+        digest = hashlib.sha1(np.array(comp_costs.shape).tobytes())
+        digest.update(row_ids[comp_rows].astype(np.int64).tobytes())
+        digest.update(col_ids[comp_cols].astype(np.int64).tobytes())
+        digest.update(np.ascontiguousarray(comp_costs).tobytes())
+        key = digest.digest()
+        comp_bounds = cache.get(key)
+        if comp_bounds is None:
+            comp_bounds = clap.costs(comp_costs)
+        used_cache[key] = comp_bounds
+        comp_cost = comp_bounds.min()
+        if not np.isfinite(comp_cost):
+            return np.full(costs.shape, np.inf)
+        total_cost += comp_cost
+        components.append((comp_rows, comp_cols, comp_bounds, comp_cost))
+
+    cache.clear()
+    cache.update(used_cache)
+
+    global_cost_bounds = np.full(costs.shape, np.inf)
+    for comp_rows, comp_cols, comp_bounds, comp_cost in components:
+        global_cost_bounds[np.ix_(comp_rows, comp_cols)] = \
+            comp_bounds + (total_cost - comp_cost)
+    return global_cost_bounds
+
+
+def from_local_bounds_sparse(smp):
+    """Bound global costs of a problem whose costs are sparse.
+
+    The constrained assignments are solved over the stored entries with
+    `sparse_clap_costs`, so the work and memory scale with the number of
+    candidates rather than with the size of the problem. Entries whose bound
+    exceeds the global cost threshold are discarded. The matching needs no
+    special treatment, as entries which violate it have already been
+    discarded.
+
+    Parameters
+    ----------
+    smp : MatchingProblem
+        A subgraph matching problem whose costs are SparseCostMatrix objects.
+    """
+    pattern = smp.global_costs
+    if pattern.nnz == 0:
+        return
+
+    costs = smp.local_costs.data / 2 + smp.fixed_costs.data
+
+    # Compact the columns down to the world nodes which are still candidates
+    cand_idxs, cand_cols = np.unique(pattern.indices, return_inverse=True)
+    if len(cand_idxs) < smp.tmplt.n_nodes:
+        # Not enough candidates left to assign each template node
+        smp.global_costs = np.inf
+    else:
+        # Infinite entries can never be assigned, so leave them out
+        is_finite = np.isfinite(costs)
+        global_cost_bounds = np.full(len(costs), np.inf)
+        cand_costs = csr_matrix(
+            (costs[is_finite], (pattern.rows[is_finite],
+                                cand_cols[is_finite])),
+            shape=(smp.tmplt.n_nodes, len(cand_idxs)))
+        # Entries are sorted by row and then column in both matrices
+        global_cost_bounds[is_finite] = sparse_clap_costs(cand_costs).data
+        smp.global_costs = global_cost_bounds
+    smp._prune_sparse_costs(smp._within_threshold(smp.global_costs.data))
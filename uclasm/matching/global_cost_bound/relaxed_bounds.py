@@ -0,0 +1,53 @@
+"""Provide cheap lower bounds on constrained assignment costs."""
+import numpy as np
+
+
+def relaxed_clap_costs(costs):
+    """Bound the constrained assignment costs from below without solving any
+    assignment.
+
+    Forcing row i to column j leaves the other rows to be assigned. Each of
+    them costs at least its row minimum, and they use distinct columns other
+    than j, so together they cost at least the smallest column minima of the
+    other columns. The larger of these two relaxations bounds the smallest
+    assignment sending i to j from below, and both take time linear in the
+    size of the matrix.
+
+    Parameters
+    ----------
+    costs : 2darray
+        Matrix of costs with no more rows than columns.
+
+    Returns
+    -------
+    2darray
+        Entry (i, j) is a lower bound on the cost of the smallest assignment
+        sending i to j. Entries are inf when there is no assignment at all.
+    """
+    costs = np.asarray(costs, dtype=np.float64)
+    n_rows, n_cols = costs.shape
+    if n_rows == 0:
+        return costs.copy()
+    row_mins = costs.min(axis=1)
+    col_mins = np.sort(costs.min(axis=0))
+    if n_rows > n_cols or not np.isfinite(row_mins).all() or \
+            not np.isfinite(col_mins[n_rows - 1]):
+        # Some row cannot be assigned, or there are too few usable columns
+        return np.full(costs.shape, np.inf)
+
+    row_bounds = costs + (row_mins.sum() - row_mins)[:, None]
+
+    # The other rows take the smallest column minima, skipping column j
+    col_min_sums = np.cumsum(col_mins[:n_rows])
+    others_cost = np.full(n_cols, col_min_sums[n_rows - 2]
+                          if n_rows > 1 else 0.0)
+    unsorted_col_mins = costs.min(axis=0)
+    # Column j is among the smallest when it does not exceed the largest of
+    # the n_rows - 1 smallest, and then the next column takes its place
+    if n_rows > 1:
+        takes_place = unsorted_col_mins <= col_mins[n_rows - 2]
+        others_cost[takes_place] = col_min_sums[n_rows - 1] - \
+            unsorted_col_mins[takes_place]
+    col_bounds = costs + others_cost[None, :]
+
+    return np.maximum(row_bounds, col_bounds)
@@ -0,0 +1,93 @@
+"""Provide constrained assignment costs over a sparse graph of candidates."""
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+
+def sparse_lap(costs):
+    """Solve a linear sum assignment problem over the stored entries.
+
+    Parameters
+    ----------
+    costs : csr_matrix
+        Costs of the allowed assignments. Entries which are not stored cannot
+        be assigned. Must have no more rows than columns.
+
+    Returns
+    -------
+    (float, 1darray)
+        The cost of the smallest assignment of every row and the column
+        assigned to each row. The cost is inf and the columns are None if
+        there is no such assignment.
+    """
+    n_rows = costs.shape[0]
+    if n_rows == 0:
+        return 0.0, np.zeros(0, dtype=np.int64)
+    if costs.nnz == 0:
+        return np.inf, None
+    # Stored zeros would be read as missing edges, so make every weight
+    # positive. Every assignment uses one entry per row, so shifting all of
+    # the weights by the same amount does not change which one is smallest.
+    shifted = costs.copy()
+    shifted.data = shifted.data - shifted.data.min() + 1
+    try:
+        _, col_idxs = min_weight_full_bipartite_matching(shifted)
+    except ValueError:
+        # No assignment covers every row
+        return np.inf, None
+    return costs[np.arange(n_rows), col_idxs].sum(), col_idxs
+
+
+def sparse_clap_costs(costs):
+    """Get the smallest assignment cost with each row forced to each column,
+    for every stored entry.
+
+    This is the sparse counterpart of `clap.costs`. Only the stored entries
+    of `costs` may be assigned, and only their constrained costs are
+    computed, so the work and memory scale with the number of stored
+    entries rather than with the size of the matrix. For each row, the
+    assignment of the remaining rows only needs to be recomputed when the
+    forced column is one that assignment uses.
+
+    Parameters
+    ----------
+    costs : csr_matrix
+        Costs of the allowed assignments, with no more rows than columns and
+        no duplicate entries.
+
+    Returns
+    -------
+    csr_matrix
+        Matrix with the same stored entries as `costs`, in the same order.
+        Entry (i, j) is the cost of the smallest assignment sending i to j,
+        which is inf when there is no such assignment.
+    """
+    costs = csr_matrix(costs, dtype=np.float64)
+    n_rows, n_cols = costs.shape
+    if n_rows > n_cols:
+        raise ValueError("The costs have more rows than columns.")
+    constrained_costs = costs.copy()
+    constrained_costs.data = np.full(costs.nnz, np.inf)
+    row_is_kept = np.ones(n_rows, dtype=np.bool_)
+    for row_idx in range(n_rows):
+        start, end = costs.indptr[row_idx], costs.indptr[row_idx + 1]
+        if start == end:
+            # A row with no candidates cannot be assigned, so no row can
+            return constrained_costs
+        row_is_kept[row_idx] = False
+        other_costs = costs[row_is_kept]
+        row_is_kept[row_idx] = True
+        base_cost, used_cols = sparse_lap(other_costs)
+        if not np.isfinite(base_cost):
+            # The other rows cannot be assigned at all
+            continue
+        row_cols = costs.indices[start:end]
+        row_costs = costs.data[start:end] + base_cost
+        for entry_idx in np.flatnonzero(np.isin(row_cols, used_cols)):
+            # Forcing row_idx to this column takes it from another row
+            col_is_kept = np.ones(n_cols, dtype=np.bool_)
+            col_is_kept[row_cols[entry_idx]] = False
+            sub_cost, _ = sparse_lap(other_costs[:, col_is_kept])
+            row_costs[entry_idx] = costs.data[start + entry_idx] + sub_cost
+        constrained_costs.data[start:end] = row_costs
+    return constrained_costs
@@ -3,4 +3,5 @@
 from .nodewise import feature_disagreements
 from .nodewise import nodewise
 from .edgewise import edgewise
+from .edgewise import vectorized_edge_attr_fn
 from .neighborhood import neighborhood
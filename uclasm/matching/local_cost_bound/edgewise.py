@@ -5,6 +5,10 @@ import numba
 import os
 import tqdm
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ..cost_cache import cost_fn_version, hash_table
+from . import geo
 
 def iter_adj_pairs(tmplt, world):
     """Generator for pairs of adjacency matrices.
@@ -29,6 +33,37 @@ def iter_adj_pairs(tmplt, world):
         yield (tmplt_adj, world_adj)
         yield (tmplt_adj.T, world_adj.T)
 
+def map_chunks(fn, items, n_jobs=1):
+    """Apply a function to chunks of a list of items using a pool of threads.
+
+    The expensive parts of the edgewise cost bound run in numba and numpy
+    code which releases the GIL, so threads can run them concurrently.
+
+    Parameters
+    ----------
+    fn : function
+        Function taking a list of items.
+    items : list
+        Items to split into one chunk per thread.
+    n_jobs : int
+        Number of threads. A value of -1 uses one thread per CPU.
+
+    Returns
+    -------
+    list
+        Result of the function on each chunk, in order.
+    """
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = os.cpu_count()
+    n_jobs = max(1, min(n_jobs, len(items)))
+    if n_jobs == 1:
+        return [fn(items)]
+    chunks = [list(chunk) for chunk in np.array_split(np.arange(len(items)),
+                                                        n_jobs)]
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        return list(pool.map(lambda idxs: fn([items[i] for i in idxs]),
+                             chunks))
+
 def get_src_dst_weights(smp, src_idx, dst_idx):
     """ Returns a tuple of src_weight, dst_weight indicating the weighting for
     edge costs to node costs. Weights sum to 2, as they will later be divided by
@@ -66,14 +101,69 @@ def get_edgelist_iterator(edgelist, src_col, dst_col, attr_keys, node_as_str=Tru
     attr_cols = [edgelist[key] for key in attr_keys]
     return zip(range(n_edges), srcs, dsts, *attr_cols)
 
-from numba import float64, int64, void
+from numba import float64, int32, int64, void
 
-@numba.njit(void(float64[:,:], int64, int64[:], float64[:]))
+# Node indices are int32 unless the world is too large for them
+@numba.njit([void(float64[:,:], int64, int32[:], float64[:]),
+             void(float64[:,:], int64, int64[:], float64[:])], nogil=True)
 def set_assignment_costs(assignment_costs, tmplt_idx, cand_idxs, attr_costs):
     for cand_idx, attr_cost in zip(cand_idxs, attr_costs):
         if attr_cost < assignment_costs[tmplt_idx, cand_idx]:
             assignment_costs[tmplt_idx, cand_idx] = attr_cost
 
+@numba.njit(nogil=True)
+def edge_support(indptr, indices, counts, tmplt_counts, src_cand_idxs,
+                 dst_cand_idxs, n_world_nodes):
+    """Compute the greatest edge support of each source and destination
+    candidate in a single pass over the world edges.
+
+    The support of a pair of candidates is the number of template edges
+    between the source and destination which also exist between the pair.
+
+    Parameters
+    ----------
+    indptr, indices, counts : 1darray, 1darray, 2darray
+        The `sym_edge_counts` of the world graph.
+    tmplt_counts : 1darray
+        The row of the template's `sym_edge_counts` for the template pair.
+    src_cand_idxs, dst_cand_idxs : 1darray
+        Indices of the candidates of the source and destination nodes.
+    n_world_nodes : int
+        Number of nodes in the world graph.
+
+    Returns
+    -------
+    (1darray, 1darray)
+        Greatest support over destination candidates for each source
+        candidate and over source candidates for each destination candidate.
+    """
+    # Only channels with template edges contribute to the support
+    tmplt_chs = np.flatnonzero(tmplt_counts > 0)
+    tmplt_vals = tmplt_counts[tmplt_chs]
+
+    dst_pos = np.full(n_world_nodes, -1, dtype=np.int64)
+    for pos in range(len(dst_cand_idxs)):
+        dst_pos[dst_cand_idxs[pos]] = pos
+
+    src_support = np.zeros(len(src_cand_idxs))
+    dst_support = np.zeros(len(dst_cand_idxs))
+    for src_pos in range(len(src_cand_idxs)):
+        src_cand_idx = src_cand_idxs[src_pos]
+        for edge_idx in range(indptr[src_cand_idx], indptr[src_cand_idx+1]):
+            pos = dst_pos[indices[edge_idx]]
+            if pos < 0:
+                continue
+            # Edges are supported up to the number of edges in the template
+            support = 0.0
+            for ch_idx in range(len(tmplt_chs)):
+                support += min(tmplt_vals[ch_idx],
+                               counts[edge_idx, tmplt_chs[ch_idx]])
+            if support > src_support[src_pos]:
+                src_support[src_pos] = support
+            if support > dst_support[pos]:
+                dst_support[pos] = support
+    return src_support, dst_support
+
 def get_edge_to_unique_attr(edgelist, src_col, dst_col):
     """Get a map from edge indexes to unique attribute indexes.
 
@@ -103,10 +193,103 @@ def get_edge_to_unique_attr(edgelist, src_col, dst_col):
 
     return unique_attrs, inverse
 
-def edgewise_no_attrs(smp, changed_cands=None):
+def edge_least_costs(smp, src_idx, dst_idx, src_cand_idxs, dst_cand_idxs,
+                     use_support_kernel=True):
+    """Compute the edgewise costs contributed by a single pair of template
+    nodes.
+
+    Parameters
+    ----------
+    smp : MatchingProblem
+        A subgraph matching problem on which to compute edgewise cost bounds.
+    src_idx, dst_idx : int
+        Indices of a pair of neighboring template nodes.
+    src_cand_idxs, dst_cand_idxs : 1darray
+        Indices of the candidates of the source and destination nodes.
+    use_support_kernel : bool
+        Compute the edge support with a single pass over the world edges
+        instead of slicing the world adjacency matrices of each channel.
+
+    Returns
+    -------
+    (1darray, 1darray)
+        Least number of missing edges for each candidate of the source and for
+        each candidate of the destination.
+    """
+    if use_support_kernel:
+        indptr, indices, counts = smp.tmplt.sym_edge_counts
+        start, stop = indptr[src_idx], indptr[src_idx+1]
+        tmplt_edge_idx = start + np.searchsorted(indices[start:stop], dst_idx)
+        tmplt_counts = counts[tmplt_edge_idx]
+        total_tmplt_edges = tmplt_counts.sum()
+
+        world_edge_counts = smp.world.sym_edge_counts
+        if len(dst_cand_idxs) < len(src_cand_idxs):
+            # Walk the edges of whichever side has fewer candidates
+            n_channels = smp.tmplt.n_channels
+            tmplt_counts = np.roll(tmplt_counts, n_channels)
+            dst_support, src_support = edge_support(
+                *world_edge_counts, tmplt_counts, dst_cand_idxs,
+                src_cand_idxs, smp.world.n_nodes)
+        else:
+            src_support, dst_support = edge_support(
+                *world_edge_counts, tmplt_counts, src_cand_idxs,
+                dst_cand_idxs, smp.world.n_nodes)
+        return (total_tmplt_edges - src_support,
+                total_tmplt_edges - dst_support)
+
+    # This sparse matrix stores the number of supported template edges
+    # between each pair of candidates for src and dst
+    # i.e. the number of template edges between src and dst that also exist
+    # between their candidates in the world
+    supported_edges = None
+
+    # Number of total edges in the template between src and dst
+    total_tmplt_edges = 0
+    for tmplt_adj, world_adj in iter_adj_pairs(smp.tmplt, smp.world):
+        tmplt_adj_val = tmplt_adj[src_idx, dst_idx]
+        total_tmplt_edges += tmplt_adj_val
+
+        # if there are no edges in this channel of the template, skip it
+        if tmplt_adj_val == 0:
+            continue
+
+        # sub adjacency matrix corresponding to edges from the source
+        # candidates to the destination candidates
+        world_sub_adj = world_adj[src_cand_idxs, :][:, dst_cand_idxs]
+
+        # Edges are supported up to the number of edges in the template
+        if supported_edges is None:
+            supported_edges = world_sub_adj.minimum(tmplt_adj_val)
+        else:
+            supported_edges += world_sub_adj.minimum(tmplt_adj_val)
+
+    src_support = supported_edges.max(axis=1)
+    src_least_cost = total_tmplt_edges - src_support.A
+
+    # Different algorithm from REU
+    # Main idea: assigning u' to u and v' to v causes cost for u to increase
+    # based on minimum between cost of v and missing edges between u and v
+    # src_least_cost = np.maximum(total_tmplt_edges - supported_edges.A,
+    #                             local_costs[dst_idx][dst_is_cand]).min(axis=1)
+
+    src_least_cost = np.array(src_least_cost).flatten()
+
+    dst_support = supported_edges.max(axis=0)
+    dst_least_cost = total_tmplt_edges - dst_support.A
+    dst_least_cost = np.array(dst_least_cost).flatten()
+    return src_least_cost, dst_least_cost
+
+def edgewise_no_attrs(smp, changed_cands=None, use_support_kernel=True):
     """Compute edgewise costs in the case where no attribute distance function
     is provided.
 
+    The costs contributed by each pair of neighboring template nodes are
+    cached on the matching problem along with the candidates they were
+    computed for, and are reused while those candidates are unchanged. The
+    result is the same as a full recompute. The pairs which do need to be
+    recomputed are split between `smp.n_jobs` threads.
+
     Parameters
     ----------
     smp : MatchingProblem
@@ -115,72 +298,182 @@ def edgewise_no_attrs(smp, changed_cands=None):
         Boolean array indicating which template nodes have candidates that have
         changed since the last run of the edgewise filter. Only these nodes and
         their neighboring template nodes have to be reevaluated.
+    use_support_kernel : bool
+        Compute the edge support with a single pass over the world edges
+        instead of slicing the world adjacency matrices of each channel.
     """
-    new_local_costs = np.zeros(smp.shape)
-    candidates = smp.candidates()
-    for src_idx, dst_idx in smp.tmplt.nbr_idx_pairs:
-        if changed_cands is not None:
-            # If neither the source nor destination has changed, there is no
-            # point in filtering on this pair of nodes
-            if not (changed_cands[src_idx] or changed_cands[dst_idx]):
-                continue
+    new_local_costs = smp.zero_costs()
+    edge_cache = smp._edge_least_costs_cache
 
-        # get indicators of candidate nodes in the world adjacency matrices
-        src_is_cand = candidates[src_idx]
-        dst_is_cand = candidates[dst_idx]
-        if ~np.any(src_is_cand) or ~np.any(dst_is_cand):
+    # Find the pairs of template nodes whose costs must be recomputed
+    edge_cands = []
+    stale_edges = []
+    least_costs = {}
+    for src_idx, dst_idx in smp.tmplt.nbr_idx_pairs:
+        # get indices of candidate nodes in the world adjacency matrices
+        src_cand_idxs = smp.candidate_idxs(src_idx)
+        dst_cand_idxs = smp.candidate_idxs(dst_idx)
+        if len(src_cand_idxs) == 0 or len(dst_cand_idxs) == 0:
             print("No candidates for given nodes, skipping edge")
             continue
+        edge_cands.append((src_idx, dst_idx, src_cand_idxs, dst_cand_idxs))
+
+        # If neither the source nor destination has changed, the costs from
+        # the last run can be reused. Make sure the candidates really are the
+        # ones the costs were computed for.
+        cached = None
+        if changed_cands is None or \
+                not (changed_cands[src_idx] or changed_cands[dst_idx]):
+            cached = edge_cache.get((src_idx, dst_idx))
+            if cached is not None and not (
+                    np.array_equal(cached[0], src_cand_idxs) and
+                    np.array_equal(cached[1], dst_cand_idxs)):
+                cached = None
+        if cached is None:
+            stale_edges.append(edge_cands[-1])
+        else:
+            least_costs[src_idx, dst_idx] = cached[2:]
+
+    if use_support_kernel:
+        # Build these before any threads try to build them concurrently, as
+        # sym_edge_counts is a lazily cached property
+        smp.tmplt.sym_edge_counts
+        smp.world.sym_edge_counts
+
+    def compute_least_costs(edges):
+        return [edge_least_costs(smp, *edge,
+                                 use_support_kernel=use_support_kernel)
+                for edge in edges]
+
+    if stale_edges:
+        chunks = map_chunks(compute_least_costs, stale_edges, smp.n_jobs)
+        new_least_costs = [costs for chunk in chunks for costs in chunk]
+        for (src_idx, dst_idx, src_cand_idxs, dst_cand_idxs), \
+                (src_least_cost, dst_least_cost) in zip(stale_edges,
+                                                        new_least_costs):
+            least_costs[src_idx, dst_idx] = (src_least_cost, dst_least_cost)
+            edge_cache[src_idx, dst_idx] = (src_cand_idxs, dst_cand_idxs,
+                                            src_least_cost, dst_least_cost)
+
+    for src_idx, dst_idx, src_cand_idxs, dst_cand_idxs in edge_cands:
+        src_least_cost, dst_least_cost = least_costs[src_idx, dst_idx]
 
-        # This sparse matrix stores the number of supported template edges
-        # between each pair of candidates for src and dst
-        # i.e. the number of template edges between src and dst that also exist
-        # between their candidates in the world
-        supported_edges = None
+        # Update the local cost bound
+        new_local_costs[src_idx, src_cand_idxs] += src_least_cost
 
-        # Number of total edges in the template between src and dst
-        total_tmplt_edges = 0
-        for tmplt_adj, world_adj in iter_adj_pairs(smp.tmplt, smp.world):
-            tmplt_adj_val = tmplt_adj[src_idx, dst_idx]
-            total_tmplt_edges += tmplt_adj_val
+        if src_idx != dst_idx:
+            new_local_costs[dst_idx, dst_cand_idxs] += dst_least_cost
+    return new_local_costs
 
-            # if there are no edges in this channel of the template, skip it
-            if tmplt_adj_val == 0:
-                continue
+def vectorized_edge_attr_fn(fn):
+    """Mark an edge attribute function as following the batch protocol.
 
-            # sub adjacency matrix corresponding to edges from the source
-            # candidates to the destination candidates
-            world_sub_adj = world_adj[:, dst_is_cand][src_is_cand, :]
+    A batch edge attribute function compares one template edge against many
+    world edges at once. It is called as
 
-            # Edges are supported up to the number of edges in the template
-            if supported_edges is None:
-                supported_edges = world_sub_adj.minimum(tmplt_adj_val)
-            else:
-                supported_edges += world_sub_adj.minimum(tmplt_adj_val)
+        fn(tmplt_edge, world_edges, tmplt_attrs, world_attrs, **kwargs)
 
-        src_support = supported_edges.max(axis=1)
-        src_least_cost = total_tmplt_edges - src_support.A
+    where `tmplt_edge` is the (source, destination) pair of the template edge
+    or None, `world_edges` is a pair of arrays of world sources and
+    destinations or None, `tmplt_attrs` is a dict of the template edge
+    attributes and `world_attrs` is a dict from each world attribute name to
+    an array of its values. It returns an array with the cost of each world
+    edge. The keyword arguments are those passed to a scalar function, such
+    as `importance_value`.
 
-        # Different algorithm from REU
-        # Main idea: assigning u' to u and v' to v causes cost for u to increase
-        # based on minimum between cost of v and missing edges between u and v
-        # src_least_cost = np.maximum(total_tmplt_edges - supported_edges.A,
-        #                             local_costs[dst_idx][dst_is_cand]).min(axis=1)
+    Examples
+    --------
+    >>> @vectorized_edge_attr_fn
+    ... def weight_diff(tmplt_edge, world_edges, tmplt_attrs, world_attrs,
+    ...                 importance_value=None):
+    ...     return np.abs(tmplt_attrs["weight"] - world_attrs["weight"])
 
-        src_least_cost = np.array(src_least_cost).flatten()
-        # Update the local cost bound
-        new_local_costs[src_idx][src_is_cand] += src_least_cost
+    Parameters
+    ----------
+    fn : function
+        Batch edge attribute function.
 
-        if src_idx != dst_idx:
-            dst_support = supported_edges.max(axis=0)
-            dst_least_cost = total_tmplt_edges - dst_support.A
-            dst_least_cost = np.array(dst_least_cost).flatten()
-            new_local_costs[dst_idx][dst_is_cand] += dst_least_cost
-    return new_local_costs
+    Returns
+    -------
+    function
+        The same function, marked as vectorized.
+    """
+    fn.vectorized = True
+    return fn
+
+def as_vectorized_edge_attr_fn(fn):
+    """Get a batch version of an edge attribute function.
+
+    Functions marked with `vectorized_edge_attr_fn` are returned unchanged.
+    Scalar functions, which compare a single pair of edges, are wrapped to
+    be called once for each world edge.
+
+    Parameters
+    ----------
+    fn : function
+        Scalar or batch edge attribute function.
+
+    Returns
+    -------
+    function
+        A function following the batch protocol.
+    """
+    if getattr(fn, "vectorized", False):
+        return fn
+
+    def batch_fn(tmplt_edge, world_edges, tmplt_attrs, world_attrs,
+                 **kwargs):
+        attr_keys = list(world_attrs.keys())
+        attr_cols = [world_attrs[key] for key in attr_keys]
+        if world_edges is None:
+            n_world_edges = len(attr_cols[0]) if attr_cols else 0
+            world_edges = [None] * n_world_edges
+        else:
+            world_edges = list(zip(*world_edges))
+        costs = np.empty(len(world_edges))
+        for world_edge_idx, (world_edge, *attrs) in \
+                enumerate(zip(world_edges, *attr_cols)):
+            costs[world_edge_idx] = fn(tmplt_edge, world_edge, tmplt_attrs,
+                                       dict(zip(attr_keys, attrs)), **kwargs)
+        return costs
+    return batch_fn
+
+def edgewise_cost_cache_key(smp, tmplt_attr_keys, tmplt_attrs,
+                            world_attr_keys, world_attrs,
+                            cache_by_unique_attrs):
+    """Get the key of the edgewise cost matrix of a matching problem in its
+    persistent cost cache.
+
+    Parameters
+    ----------
+    smp : MatchingProblem
+        A subgraph matching problem on which to compute edgewise cost bounds.
+    tmplt_attr_keys, world_attr_keys : list(str)
+        Names of the template and world attribute columns.
+    tmplt_attrs, world_attrs : 2darray
+        Rows of template and world attributes which index the cost matrix.
+    cache_by_unique_attrs : bool
+        Whether the rows are unique attributes rather than edges.
+
+    Returns
+    -------
+    str
+        Key of the cost matrix.
+    """
+    fn_version = smp.edge_attr_fn_version
+    if fn_version is None:
+        fn_version = cost_fn_version(smp.edge_attr_fn)
+    return smp.cost_cache.key(hash_table(tmplt_attr_keys, tmplt_attrs),
+                              hash_table(world_attr_keys, world_attrs),
+                              fn_version, cache_by_unique_attrs)
 
 def generate_edgewise_cost_cache(smp, cache_by_unique_attrs=True):
     """Generate a cache of edgewise costs for later use.
 
+    If the matching problem has a persistent cost cache, the costs are read
+    from it when they were computed before from identical attributes and an
+    identical edge attribute function, and written to it otherwise.
+
     Parameters
     ----------
     cache_by_unique_attrs : bool
@@ -190,6 +483,9 @@ def generate_edgewise_cost_cache(smp, cache_by_unique_attrs=True):
     src_col = smp.tmplt.source_col
     dst_col = smp.tmplt.target_col
     tmplt_attr_keys = [attr for attr in smp.tmplt.edgelist.columns if attr not in [src_col, dst_col, 'id', 'template_id']]
+    # Each template edge is compared against every world edge in one call
+    edge_attr_fn = as_vectorized_edge_attr_fn(smp.edge_attr_fn)
+    cache_key = None
     if cache_by_unique_attrs:
         print('Calculating edge to unique attr map')
         start_time = time.time()
@@ -206,7 +502,27 @@ def generate_edgewise_cost_cache(smp, cache_by_unique_attrs=True):
         smp.tmplt_edge_to_attr_idx = np.array(tmplt_edge_to_attr_idx)
         smp.world_edge_to_attr_idx = np.array(world_edge_to_attr_idx)
 
+        src_col_world = smp.world.source_col
+        dst_col_world = smp.world.target_col
+        # The same columns as the unique world attributes
+        cand_attr_keys = [attr for attr in smp.world.edgelist.columns if attr not in [src_col_world, dst_col_world, 'id', 'template_id']]
+
+        if smp.cost_cache is not None:
+            cache_key = edgewise_cost_cache_key(
+                smp, tmplt_attr_keys, tmplt_unique_attrs,
+                cand_attr_keys, world_unique_attrs, cache_by_unique_attrs)
+            cached_costs = smp.cost_cache.get(cache_key)
+            if cached_costs is not None:
+                smp._edgewise_costs_cache = cached_costs
+                print("Edge-to-edge costs loaded from cache")
+                return
+
         smp._edgewise_costs_cache = np.zeros((len(tmplt_unique_attrs), len(world_unique_attrs)))
+        # Columns of the world attributes, for the batch protocol
+        world_attrs_df = pd.DataFrame(
+            world_unique_attrs.reshape(len(world_unique_attrs), len(cand_attr_keys)),
+            columns=cand_attr_keys).infer_objects()
+        world_attrs = {key: world_attrs_df[key].to_numpy() for key in cand_attr_keys}
         pbar = tqdm.tqdm(total=len(tmplt_unique_attrs), position=0, leave=True, ascii=True)
 
         for tmplt_unique_idx, tmplt_attrs in enumerate(tmplt_unique_attrs):
@@ -219,49 +535,53 @@ def generate_edgewise_cost_cache(smp, cache_by_unique_attrs=True):
                 del tmplt_attrs_dict[smp.tmplt.source_col]
                 del tmplt_attrs_dict[smp.tmplt.target_col]
 
-            src_col_world = smp.world.source_col
-            dst_col_world = smp.world.target_col
-            cand_attr_keys = [attr for attr in smp.world.edgelist.columns if attr not in [src_col_world, dst_col_world, 'id']]
-            for world_unique_idx, cand_attrs in enumerate(world_unique_attrs):
-                cand_attrs_dict = dict(zip(cand_attr_keys, cand_attrs))
-                if 'importance' in tmplt_attr_keys:
-                    importance = tmplt_attrs_dict['importance']
-                else:
-                    importance = None
-                attr_cost = smp.edge_attr_fn(edge_key, None, tmplt_attrs_dict, cand_attrs_dict, importance_value=importance)
-                smp._edgewise_costs_cache[tmplt_unique_idx, world_unique_idx] = attr_cost
+            if 'importance' in tmplt_attr_keys:
+                importance = tmplt_attrs_dict['importance']
+            else:
+                importance = None
+            smp._edgewise_costs_cache[tmplt_unique_idx, :] = edge_attr_fn(
+                edge_key, None, tmplt_attrs_dict, world_attrs,
+                importance_value=importance)
             pbar.update(1)
         pbar.close()
 
     else:
+        src_col_world = smp.world.source_col
+        dst_col_world = smp.world.target_col
+        cand_attr_keys = [attr for attr in smp.world.edgelist.columns if attr not in [src_col_world, dst_col_world]]
+
+        if smp.cost_cache is not None:
+            tmplt_cols = [src_col, dst_col] + tmplt_attr_keys
+            world_cols = [src_col_world, dst_col_world] + cand_attr_keys
+            cache_key = edgewise_cost_cache_key(
+                smp, tmplt_cols, smp.tmplt.edgelist[tmplt_cols].to_numpy(),
+                world_cols, smp.world.edgelist[world_cols].to_numpy(),
+                cache_by_unique_attrs)
+            cached_costs = smp.cost_cache.get(cache_key)
+            if cached_costs is not None:
+                smp._edgewise_costs_cache = cached_costs
+                print("Edge-to-edge costs loaded from cache")
+                return
+
         n_tmplt_edges = len(smp.tmplt.edgelist.index)
         n_world_edges = len(smp.world.edgelist.index)
         smp._edgewise_costs_cache = np.zeros((n_tmplt_edges, n_world_edges))
+        world_edges = (smp.world.edgelist[src_col_world].astype(str).to_numpy(),
+                       smp.world.edgelist[dst_col_world].astype(str).to_numpy())
+        world_attrs = {key: smp.world.edgelist[key].to_numpy() for key in cand_attr_keys}
         pbar = tqdm.tqdm(total=len(smp.tmplt.edgelist.index), position=0, leave=True, ascii=True)
         for tmplt_edge_idx, src_node, dst_node, *tmplt_attrs in get_edgelist_iterator(smp.tmplt.edgelist, src_col, dst_col, tmplt_attr_keys):
             tmplt_attrs_dict = dict(zip(tmplt_attr_keys, tmplt_attrs))
-
-            src_col_world = smp.world.source_col
-            dst_col_world = smp.world.target_col
-            cand_attr_keys = [attr for attr in smp.world.edgelist.columns if attr not in [src_col_world, dst_col_world]]
-            for world_edge_idx, src_cand, dst_cand, *cand_attrs in get_edgelist_iterator(smp.world.edgelist, src_col_world, dst_col_world, cand_attr_keys):
-                cand_attrs_dict = dict(zip(cand_attr_keys, cand_attrs))
-                if 'importance' in tmplt_attr_keys:
-                    attr_cost = smp.edge_attr_fn((src_node, dst_node), (src_cand, dst_cand), tmplt_attrs_dict, cand_attrs_dict, importance_value=tmplt_attrs_dict['importance'])
-                else:
-                    attr_cost = smp.edge_attr_fn((src_node, dst_node), (src_cand, dst_cand), tmplt_attrs_dict, cand_attrs_dict)
-                smp._edgewise_costs_cache[tmplt_edge_idx, world_edge_idx] = attr_cost
+            kwargs = {}
+            if 'importance' in tmplt_attr_keys:
+                kwargs['importance_value'] = tmplt_attrs_dict['importance']
+            smp._edgewise_costs_cache[tmplt_edge_idx, :] = edge_attr_fn(
+                (src_node, dst_node), world_edges, tmplt_attrs_dict,
+                world_attrs, **kwargs)
             pbar.update(1)
         pbar.close()
-    if smp.cache_path is not None:
-        np.save(os.path.join(smp.cache_path, "edgewise_costs_cache.npy"), smp._edgewise_costs_cache)
-        if cache_by_unique_attrs:
-            np.save(os.path.join(smp.cache_path, "tmplt_edge_to_attr_idx.npy"), smp.tmplt_edge_to_attr_idx)
-            np.save(os.path.join(smp.cache_path, "world_edge_to_attr_idx.npy"), smp.world_edge_to_attr_idx)
-        try:
-            os.chmod(smp.cache_path, 0o770)
-        except:
-            pass
+    if cache_key is not None:
+        smp.cost_cache.put(cache_key, smp._edgewise_costs_cache)
         print("Edge-to-edge costs saved to cache")
 
 def verify_edgewise_cost_cache(smp, cache_by_unique_attrs=True):
@@ -277,31 +597,137 @@ def verify_edgewise_cost_cache(smp, cache_by_unique_attrs=True):
     n_world_edges = len(smp.world.edgelist.index)
     if cache_by_unique_attrs:
         if not hasattr(smp, 'tmplt_edge_to_attr_idx'):
-            try:
-                smp.tmplt_edge_to_attr_idx = np.load(os.path.join(smp.cache_path, "tmplt_edge_to_attr_idx.npy"))
-                smp.world_edge_to_attr_idx = np.load(os.path.join(smp.cache_path, "world_edge_to_attr_idx.npy"))
-                print('Edge to attr maps loaded from cache')
-            except:
-                print('Edge to attr cache not found')
-                print('Calculating edge to unique attr map')
-                start_time = time.time()
-                if 'importance' not in smp.tmplt.edgelist.columns:
-                    tmplt_unique_attrs, tmplt_edge_to_attr_idx = get_edge_to_unique_attr(smp.tmplt.edgelist, None, None)
-                else:
-                    tmplt_unique_attrs, tmplt_edge_to_attr_idx = get_edge_to_unique_attr(smp.tmplt.edgelist, smp.tmplt.source_col, smp.tmplt.target_col)
-                world_unique_attrs, world_edge_to_attr_idx = get_edge_to_unique_attr(smp.world.edgelist, smp.world.source_col, smp.world.target_col)
-                smp.tmplt_edge_to_attr_idx = tmplt_edge_to_attr_idx
-                smp.world_edge_to_attr_idx = world_edge_to_attr_idx
-                print('Edge to unique attr map calculated in {} seconds'.format(time.time()-start_time))
+            print('Calculating edge to unique attr map')
+            start_time = time.time()
+            if 'importance' not in smp.tmplt.edgelist.columns:
+                tmplt_unique_attrs, tmplt_edge_to_attr_idx = get_edge_to_unique_attr(smp.tmplt.edgelist, None, None)
+            else:
+                tmplt_unique_attrs, tmplt_edge_to_attr_idx = get_edge_to_unique_attr(smp.tmplt.edgelist, smp.tmplt.source_col, smp.tmplt.target_col)
+            world_unique_attrs, world_edge_to_attr_idx = get_edge_to_unique_attr(smp.world.edgelist, smp.world.source_col, smp.world.target_col)
+            smp.tmplt_edge_to_attr_idx = tmplt_edge_to_attr_idx
+            smp.world_edge_to_attr_idx = world_edge_to_attr_idx
+            print('Edge to unique attr map calculated in {} seconds'.format(time.time()-start_time))
         if len(smp.tmplt_edge_to_attr_idx) != n_tmplt_edges or len(smp.world_edge_to_attr_idx) != n_world_edges:
             raise Exception("Edgewise costs cache not properly computed!")
-        # TODO: implement a more effective check here
+        n_tmplt_attrs, n_world_attrs = smp._edgewise_costs_cache.shape
+        if np.any(smp.tmplt_edge_to_attr_idx >= n_tmplt_attrs) or \
+                np.any(smp.world_edge_to_attr_idx >= n_world_attrs):
+            raise Exception("Edgewise costs cache does not cover every edge!")
     else:
         if smp._edgewise_costs_cache.shape != (n_tmplt_edges, n_world_edges):
             raise Exception("Edgewise costs cache not properly computed!")
 
+def cached_attr_edge_costs(smp, candidates, tmplt_attr_keys,
+                           cache_by_unique_attrs, tmplt_edge_idx, src_node,
+                           dst_node, *tmplt_attrs):
+    """Compute the local costs contributed by a single template edge using the
+    cache of edge-to-edge costs.
+
+    Parameters
+    ----------
+    smp : MatchingProblem
+        A subgraph matching problem on which to compute edgewise cost bounds.
+    candidates : 2darray(bool)
+        The precomputed array of candidates.
+    tmplt_attr_keys : list(str)
+        Names of the template edge attributes.
+    cache_by_unique_attrs : bool
+        Whether the cache is indexed by unique attributes rather than edges.
+    tmplt_edge_idx, src_node, dst_node, *tmplt_attrs
+        A row of the template edgelist, as from `get_edgelist_iterator`.
+
+    Returns
+    -------
+    2darray
+        Costs of assigning the endpoints of the edge to each world node.
+    """
+    tmplt_attrs_dict = dict(zip(tmplt_attr_keys, tmplt_attrs))
+    if isinstance(src_node, list) or isinstance(dst_node, list):
+        # Handle templates with multiple alternatives
+        if len(src_node) > 1 and len(dst_node) > 1:
+            raise Exception("Edgewise cost bound cannot handle template edges with both multiple sources and multiple destinations.")
+        elif len(src_node) == 1 and len(dst_node) == 1:
+            src_node = src_node[0]
+            dst_node = dst_node[0]
+            src_idx = smp.tmplt.node_idxs[src_node]
+            dst_idx = smp.tmplt.node_idxs[dst_node]
+            src_node, dst_node = str(src_node), str(dst_node)
+        else:
+            src_idx = [smp.tmplt.node_idxs[src_node_i] for src_node_i in src_node]
+            dst_idx = [smp.tmplt.node_idxs[dst_node_i] for dst_node_i in dst_node]
+    else:
+        # Get candidates for src and dst
+        src_idx = smp.tmplt.node_idxs[src_node]
+        dst_idx = smp.tmplt.node_idxs[dst_node]
+        src_node, dst_node = str(src_node), str(dst_node)
+    # Matrix of costs of assigning template node src_idx and dst_idx
+    # to candidates row_idx and col_idx
+    assignment_costs = np.zeros(smp.shape)
+    if 'importance' in tmplt_attr_keys:
+        missing_edge_cost = smp.missing_edge_cost_fn((src_node, dst_node), tmplt_attrs_dict['importance'])
+    else:
+        missing_edge_cost = smp.missing_edge_cost_fn((src_node, dst_node))
+    # Put the weight of assignments on the unassigned nodes, when possible
+    # Only works if monotone is disabled
+    src_weight, dst_weight = get_src_dst_weights(smp, src_idx, dst_idx)
+    if src_weight > 0:
+        assignment_costs[src_idx, :] = src_weight * missing_edge_cost
+    if dst_weight > 0:
+        assignment_costs[dst_idx, :] = dst_weight * missing_edge_cost
+
+    # TODO: add some data to the graph classes to store the node indexes
+    # of the source and destination of each edge. You can then use this
+    # to efficiently get your masks by:
+    # >>> candidates[src_idx, smp.world.src_idxs]
+    world_edge_src_idxs = smp.world.edge_src_idxs
+    if isinstance(src_idx, list):
+        cand_edge_src_mask = np.sum(candidates[src_idx, :][:, world_edge_src_idxs], axis=0)
+    else:
+        cand_edge_src_mask = candidates[src_idx, world_edge_src_idxs]
+    world_edge_dst_idxs = smp.world.edge_dst_idxs
+    if isinstance(dst_idx, list):
+        cand_edge_dst_mask = np.sum(candidates[dst_idx, :][:, world_edge_dst_idxs], axis=0)
+    else:
+        cand_edge_dst_mask = candidates[dst_idx, world_edge_dst_idxs]
+    cand_edge_mask = np.logical_and(cand_edge_src_mask, cand_edge_dst_mask)
+    if np.any(cand_edge_mask):
+        src_cand_idxs = world_edge_src_idxs[cand_edge_mask]
+        dst_cand_idxs = world_edge_dst_idxs[cand_edge_mask]
+        # Put the weight of assignments on the unassigned nodes, when possible
+        # Only works if monotone is disabled
+        if cache_by_unique_attrs:
+            # cand_edge_idxs = np.arange(n_world_edges)[cand_edge_mask]
+            # cand_attr_idxs = [smp.world_edge_to_attr_idx[cand_edge_idx] for cand_edge_idx in cand_edge_idxs]
+            cand_attr_idxs = smp.world_edge_to_attr_idx[cand_edge_mask]
+            attr_costs = smp._edgewise_costs_cache[smp.tmplt_edge_to_attr_idx[tmplt_edge_idx], cand_attr_idxs]
+        else:
+            attr_costs = smp._edgewise_costs_cache[tmplt_edge_idx, cand_edge_mask]
+        if src_weight > 0:
+            set_assignment_costs(assignment_costs, src_idx, src_cand_idxs, src_weight * attr_costs)
+        if dst_weight > 0:
+            set_assignment_costs(assignment_costs, dst_idx, dst_cand_idxs, dst_weight * attr_costs)
+    return assignment_costs
+
+def sum_cached_attr_edge_costs(smp, candidates, tmplt_attr_keys,
+                               cache_by_unique_attrs, tmplt_edges):
+    """Sum the local costs contributed by several template edges.
+
+    Parameters
+    ----------
+    tmplt_edges : list(tuple)
+        Rows of the template edgelist, as from `get_edgelist_iterator`.
+
+    See `cached_attr_edge_costs` for the other parameters.
+    """
+    new_local_costs = np.zeros(smp.shape)
+    for tmplt_edge in tmplt_edges:
+        new_local_costs += cached_attr_edge_costs(
+            smp, candidates, tmplt_attr_keys, cache_by_unique_attrs,
+            *tmplt_edge)
+    return new_local_costs
+
 def edgewise_local_costs(smp, changed_cands=None, use_cost_cache=True,
-                         cache_by_unique_attrs=True):
+                         cache_by_unique_attrs=True, use_support_kernel=True):
     """Compute edge disagreements between candidates.
 
     Computes a lower bound on the local cost of assignment by iterating
@@ -312,6 +738,9 @@ def edgewise_local_costs(smp, changed_cands=None, use_cost_cache=True,
 
     TODO: Cite paper from REU.
 
+    The template edges are split between `smp.n_jobs` threads, except when
+    the edge attribute function is called directly without a cost cache.
+
     Parameters
     ----------
     smp : MatchingProblem
@@ -320,11 +749,17 @@ def edgewise_local_costs(smp, changed_cands=None, use_cost_cache=True,
         Boolean array indicating which template nodes have candidates that have
         changed since the last run of the edgewise filter. Only these nodes and
         their neighboring template nodes have to be reevaluated.
+    use_support_kernel : bool
+        Compute the edge support with a single pass over the world edges
+        instead of slicing the world adjacency matrices of each channel. Only
+        used when there is no edge attribute function.
     """
 
     if smp.edge_attr_fn is None:
-        return edgewise_no_attrs(smp, changed_cands=changed_cands)
+        return edgewise_no_attrs(smp, changed_cands=changed_cands,
+                                 use_support_kernel=use_support_kernel)
     else:
+        # MatchingProblem rejects edge attribute costs with sparse costs
         new_local_costs = np.zeros(smp.shape)
         candidates = smp.candidates()
         # Iterate over template edges and consider best matches for world edges
@@ -342,73 +777,20 @@ def edgewise_local_costs(smp, changed_cands=None, use_cost_cache=True,
             else:
                 verify_edgewise_cost_cache(smp, cache_by_unique_attrs=cache_by_unique_attrs)
 
-            for tmplt_edge_idx, src_node, dst_node, *tmplt_attrs in get_edgelist_iterator(smp.tmplt.edgelist, src_col, dst_col, tmplt_attr_keys, node_as_str=False):
-                tmplt_attrs_dict = dict(zip(tmplt_attr_keys, tmplt_attrs))
-                if isinstance(src_node, list) or isinstance(dst_node, list):
-                    # Handle templates with multiple alternatives
-                    if len(src_node) > 1 and len(dst_node) > 1:
-                        raise Exception("Edgewise cost bound cannot handle template edges with both multiple sources and multiple destinations.")
-                    elif len(src_node) == 1 and len(dst_node) == 1:
-                        src_node = src_node[0]
-                        dst_node = dst_node[0]
-                        src_idx = smp.tmplt.node_idxs[src_node]
-                        dst_idx = smp.tmplt.node_idxs[dst_node]
-                        src_node, dst_node = str(src_node), str(dst_node)
-                    else:
-                        src_idx = [smp.tmplt.node_idxs[src_node_i] for src_node_i in src_node]
-                        dst_idx = [smp.tmplt.node_idxs[dst_node_i] for dst_node_i in dst_node]
-                else:
-                    # Get candidates for src and dst
-                    src_idx = smp.tmplt.node_idxs[src_node]
-                    dst_idx = smp.tmplt.node_idxs[dst_node]
-                    src_node, dst_node = str(src_node), str(dst_node)
-                # Matrix of costs of assigning template node src_idx and dst_idx
-                # to candidates row_idx and col_idx
-                assignment_costs = np.zeros(smp.shape)
-                if 'importance' in tmplt_attr_keys:
-                    missing_edge_cost = smp.missing_edge_cost_fn((src_node, dst_node), tmplt_attrs_dict['importance'])
-                else:
-                    missing_edge_cost = smp.missing_edge_cost_fn((src_node, dst_node))
-                # Put the weight of assignments on the unassigned nodes, when possible
-                # Only works if monotone is disabled
-                src_weight, dst_weight = get_src_dst_weights(smp, src_idx, dst_idx)
-                if src_weight > 0:
-                    assignment_costs[src_idx, :] = src_weight * missing_edge_cost
-                if dst_weight > 0:
-                    assignment_costs[dst_idx, :] = dst_weight * missing_edge_cost
-
-                # TODO: add some data to the graph classes to store the node indexes
-                # of the source and destination of each edge. You can then use this
-                # to efficiently get your masks by:
-                # >>> candidates[src_idx, smp.world.src_idxs]
-                world_edge_src_idxs = smp.world.edge_src_idxs
-                if isinstance(src_idx, list):
-                    cand_edge_src_mask = np.sum(candidates[src_idx, :][:, world_edge_src_idxs], axis=0)
-                else:
-                    cand_edge_src_mask = candidates[src_idx, world_edge_src_idxs]
-                world_edge_dst_idxs = smp.world.edge_dst_idxs
-                if isinstance(dst_idx, list):
-                    cand_edge_dst_mask = np.sum(candidates[dst_idx, :][:, world_edge_dst_idxs], axis=0)
-                else:
-                    cand_edge_dst_mask = candidates[dst_idx, world_edge_dst_idxs]
-                cand_edge_mask = np.logical_and(cand_edge_src_mask, cand_edge_dst_mask)
-                if np.any(cand_edge_mask):
-                    src_cand_idxs = world_edge_src_idxs[cand_edge_mask]
-                    dst_cand_idxs = world_edge_dst_idxs[cand_edge_mask]
-                    # Put the weight of assignments on the unassigned nodes, when possible
-                    # Only works if monotone is disabled
-                    if cache_by_unique_attrs:
-                        # cand_edge_idxs = np.arange(n_world_edges)[cand_edge_mask]
-                        # cand_attr_idxs = [smp.world_edge_to_attr_idx[cand_edge_idx] for cand_edge_idx in cand_edge_idxs]
-                        cand_attr_idxs = smp.world_edge_to_attr_idx[cand_edge_mask]
-                        attr_costs = smp._edgewise_costs_cache[smp.tmplt_edge_to_attr_idx[tmplt_edge_idx], cand_attr_idxs]
-                    else:
-                        attr_costs = smp._edgewise_costs_cache[tmplt_edge_idx, cand_edge_mask]
-                    if src_weight > 0:
-                        set_assignment_costs(assignment_costs, src_idx, src_cand_idxs, src_weight * attr_costs)
-                    if dst_weight > 0:
-                        set_assignment_costs(assignment_costs, dst_idx, dst_cand_idxs, dst_weight * attr_costs)
-                new_local_costs += assignment_costs
+            # Build these before any threads try to build them concurrently,
+            # as the edge indices are lazily cached properties
+            smp.world.edge_src_idxs
+            smp.world.edge_dst_idxs
+            tmplt_edges = list(get_edgelist_iterator(smp.tmplt.edgelist, src_col, dst_col, tmplt_attr_keys, node_as_str=False))
+            # Each worker sums the costs of its own share of the template
+            # edges, then the partial sums are reduced
+            partial_costs = map_chunks(
+                lambda edges: sum_cached_attr_edge_costs(
+                    smp, candidates, tmplt_attr_keys, cache_by_unique_attrs,
+                    edges),
+                tmplt_edges, smp.n_jobs)
+            for costs in partial_costs:
+                new_local_costs += costs
 
             if hasattr(smp.tmplt, 'time_constraints'):
                 add_time_costs(smp, candidates, new_local_costs)
@@ -477,19 +859,81 @@ def edgewise_local_costs(smp, changed_cands=None, use_cost_cache=True,
 
     return new_local_costs
 
-def edgewise(smp, changed_cands=None):
+def edgewise(smp, changed_cands=None, use_support_kernel=True):
     """Bound local assignment costs by edge disagreements between candidates.
 
     Parameters
     ----------
     smp : MatchingProblem
         A subgraph matching problem on which to compute edgewise cost bounds.
+    changed_cands : ndarray(bool)
+        Boolean array indicating which template nodes have candidates that have
+        changed since the last run of the edgewise filter.
+    use_support_kernel : bool
+        Compute the edge support with a single pass over the world edges
+        instead of slicing the world adjacency matrices of each channel.
     """
-    smp.local_costs = edgewise_local_costs(smp, changed_cands)
+    smp.local_costs = edgewise_local_costs(
+        smp, changed_cands, use_support_kernel=use_support_kernel)
+
+def constraint_timedelta(time_constraint, key):
+    """Get a bound of a time constraint in nanoseconds.
+
+    Parameters
+    ----------
+    time_constraint : dict
+        A time constraint. Its bounds are measured in the unit given by
+        "unit", which may be any unit understood by `pandas.Timedelta`, such
+        as "D", "h", "min" or "s". Bounds are in days by default.
+    key : str
+        Name of the bound, such as "minValue" or "maxValue".
+
+    Returns
+    -------
+    int
+        The bound in nanoseconds.
+    """
+    unit = time_constraint.get("unit", "D")
+    return pd.Timedelta(time_constraint[key], unit=unit).value
+
+def time_constraint_costs(times1, times2, min_delta, max_delta=None):
+    """Find which of two sets of times can satisfy a time constraint.
+
+    Parameters
+    ----------
+    times1 : 1darray(int64)
+        Sorted times of the candidates for the earlier node.
+    times2 : 1darray(int64)
+        Sorted times of the candidates for the later node.
+    min_delta : int
+        Smallest allowed difference between the later and the earlier time.
+    max_delta : int, optional
+        Largest allowed difference, if any.
+
+    Returns
+    -------
+    (1darray(bool), 1darray(bool))
+        Whether each time of `times1` has some time of `times2` whose
+        difference lies within the bounds, and vice versa.
+    """
+    lo2 = np.searchsorted(times2, times1 + min_delta, side="left")
+    hi1 = np.searchsorted(times1, times2 - min_delta, side="right")
+    if max_delta is None:
+        hi2 = np.full(len(times1), len(times2))
+        lo1 = np.zeros(len(times2), dtype=np.int64)
+    else:
+        hi2 = np.searchsorted(times2, times1 + max_delta, side="right")
+        lo1 = np.searchsorted(times1, times2 - max_delta, side="left")
+    return hi2 > lo2, hi1 > lo1
 
 def add_time_costs(smp, candidates, local_costs):
     """Add costs associated with time constraints
 
+    The world nodes are sorted by their start time once, in
+    `Graph.start_time_index`. The candidates of each constrained node are
+    then read in time order, and the candidates which can satisfy the
+    constraint are found by binary search.
+
     Parameters
     ----------
     smp: MatchingProblem
@@ -499,85 +943,41 @@ def add_time_costs(smp, candidates, local_costs):
     local_costs: array
         Array of local costs to add the time costs to.
     """
-    import datetime
+    world_idxs, world_times = smp.world.start_time_index
     for time_constraint in smp.tmplt.time_constraints:
         node1_idx = smp.tmplt.node_idxs[time_constraint["node1"]]
         node2_idx = smp.tmplt.node_idxs[time_constraint["node2"]]
         importance = time_constraint["importance"]
-        cand1_times = smp.world.nodelist["start"][candidates[node1_idx]].to_numpy()
-        cand2_times = smp.world.nodelist["start"][candidates[node2_idx]].to_numpy()
+        is_cand1 = candidates[node1_idx]
+        is_cand2 = candidates[node2_idx]
 
-        # Flat inverse importance for missing information
-        cand1_costs = np.ones(cand1_times.shape) / importance
-        cand2_costs = np.ones(cand2_times.shape) / importance
-
-        cand1_nonnat_mask = np.logical_not(np.isnat(cand1_times))
-        cand2_nonnat_mask = np.logical_not(np.isnat(cand2_times))
-        cand1_times = cand1_times[cand1_nonnat_mask]
-        cand2_times = cand2_times[cand2_nonnat_mask]
-        cand1_nonnat_costs = np.ones(cand1_times.shape) / importance
-        cand2_nonnat_costs = np.ones(cand2_times.shape) / importance
-
-        # TODO: support constraints measured in units other than days
-        min_timedelta = np.timedelta64(0, 'D')
+        min_delta = 0
         if 'minValue' in time_constraint:
-            min_timedelta = np.timedelta64(int(time_constraint["minValue"]), 'D')
+            min_delta = constraint_timedelta(time_constraint, "minValue")
+        max_delta = None
         if 'maxValue' in time_constraint:
-            max_timedelta = np.timedelta64(int(time_constraint["maxValue"]), 'D')
+            max_delta = constraint_timedelta(time_constraint, "maxValue")
+
+        # Flat inverse importance for missing information
+        costs1 = np.zeros(len(is_cand1))
+        costs2 = np.zeros(len(is_cand2))
+        costs1[is_cand1] = 1 / importance
+        costs2[is_cand2] = 1 / importance
+
+        in_cands1 = is_cand1[world_idxs]
+        in_cands2 = is_cand2[world_idxs]
+        if in_cands1.any() and in_cands2.any():
+            is_valid1, is_valid2 = time_constraint_costs(
+                world_times[in_cands1], world_times[in_cands2],
+                min_delta, max_delta)
+            costs1[world_idxs[in_cands1][is_valid1]] = 0
+            costs2[world_idxs[in_cands2][is_valid2]] = 0
 
-        if len(cand1_times) == 0:
-            pass
-        elif len(cand2_times) == 0:
-            pass
-        else:
-            cand1_sorted_idxs = cand1_times.argsort()
-            cand2_sorted_idxs = cand2_times.argsort()
-
-            cand2_idx_idx = 0
-            cand2_idx = cand2_sorted_idxs[cand2_idx_idx]
-            cand2_time = cand2_times[cand2_idx]
-            last_valid_cand2_idx_idx = 0
-            for cand1_idx_idx, cand1_idx in enumerate(cand1_sorted_idxs):
-                cand1_time = cand1_times[cand1_idx]
-                while cand2_time - cand1_time < min_timedelta:
-                    cand2_idx_idx += 1
-                    if cand2_idx_idx >= len(cand2_sorted_idxs):
-                        cand2_time = None
-                        break
-                    cand2_idx = cand2_sorted_idxs[cand2_idx_idx]
-                    cand2_time = cand2_times[cand2_idx]
-                if cand2_time is not None:
-                    if 'maxValue' in time_constraint:
-                        if cand2_time - cand1_time > max_timedelta:
-                            continue
-                    cand1_nonnat_costs[cand1_idx] = 0
-                    if 'maxValue' in time_constraint:
-                        cand2_nonnat_costs[cand2_idx] = 0
-                        temp_cand2_idx_idx = max(last_valid_cand2_idx_idx, cand2_idx_idx) + 1
-                        if temp_cand2_idx_idx < len(cand2_sorted_idxs):
-                            next_cand2_idx = cand2_sorted_idxs[temp_cand2_idx_idx]
-                            next_cand2_time = cand2_times[next_cand2_idx]
-                            while next_cand2_time - cand1_time <= max_timedelta:
-                                cand2_nonnat_costs[next_cand2_idx] = 0
-                                last_valid_cand2_idx_idx = temp_cand2_idx_idx
-                                temp_cand2_idx_idx += 1
-                                if temp_cand2_idx_idx < len(cand2_sorted_idxs):
-                                    next_cand2_idx = cand2_sorted_idxs[temp_cand2_idx_idx]
-                                    next_cand2_time = cand2_times[next_cand2_idx]
-                                else:
-                                    break
-                    elif cand1_idx_idx == 0:
-                        # With only minimum timedelta, all future cand2_times are valid
-                        cand2_nonnat_costs[cand2_sorted_idxs[cand2_idx_idx:]] = 0
-                else:
-                    break
-        cand1_costs[cand1_nonnat_mask] = cand1_nonnat_costs
-        cand2_costs[cand2_nonnat_mask] = cand2_nonnat_costs
         node1_weight, node2_weight = get_src_dst_weights(smp, node1_idx, node2_idx)
         if node1_weight > 0:
-            local_costs[node1_idx, candidates[node1_idx]] += cand1_costs * node1_weight
+            local_costs[node1_idx, is_cand1] += costs1[is_cand1] * node1_weight
         if node2_weight > 0:
-            local_costs[node2_idx, candidates[node2_idx]] += cand2_costs * node2_weight
+            local_costs[node2_idx, is_cand2] += costs2[is_cand2] * node2_weight
 
 def valid_lat_lng(lat, lng):
     """Checks that the lat and lng values are valid
@@ -614,6 +1014,10 @@ def haversine(lat1, lon1, lat2, lon2):
 def add_geo_costs(smp, candidates, local_costs):
     """Add costs associated with geo constraints
 
+    The coordinates of the world nodes are parsed once, in
+    `Graph.geo_coords`, and the candidates which can satisfy each constraint
+    are found through a spatial index by `geo.has_partner_within`.
+
     Parameters
     ----------
     smp: MatchingProblem
@@ -623,57 +1027,41 @@ def add_geo_costs(smp, candidates, local_costs):
     local_costs: array
         Array of local costs to add the geo costs to.
     """
-    from geopy import distance
+    has_coords, coords = smp.world.geo_coords
+    lats, lngs = coords[:, 0], coords[:, 1]
+    is_valid = (lats >= -90.0) & (lats <= 90.0) & \
+        (lngs >= -180.0) & (lngs <= 180.0)
     for geo_constraint in smp.tmplt.geo_constraints:
         node1_idx = smp.tmplt.node_idxs[geo_constraint["node1"]]
         node2_idx = smp.tmplt.node_idxs[geo_constraint["node2"]]
         importance = geo_constraint["importance"]
-        cand1_lats = smp.world.nodelist["latitude"][candidates[node1_idx]]
-        cand1_lngs = smp.world.nodelist["longitude"][candidates[node1_idx]]
-        cand2_lats = smp.world.nodelist["latitude"][candidates[node2_idx]]
-        cand2_lngs = smp.world.nodelist["longitude"][candidates[node2_idx]]
+        is_cand1 = candidates[node1_idx]
+        is_cand2 = candidates[node2_idx]
 
         # Flat inverse importance costs for missing information
-        cand1_costs = np.ones(cand1_lats.shape) / importance
-        cand2_costs = np.ones(cand2_lats.shape) / importance
-
-        cand1_nonnull_mask = np.logical_and(~cand1_lats.isin(["", "%NA%", "%NULL%"]).to_numpy(),
-                                            ~cand1_lngs.isin(["", "%NA%", "%NULL%"]).to_numpy())
-        cand2_nonnull_mask = np.logical_and(~cand2_lats.isin(["", "%NA%", "%NULL%"]).to_numpy(),
-                                            ~cand2_lngs.isin(["", "%NA%", "%NULL%"]).to_numpy())
-        cand1_costs[cand1_nonnull_mask] = 0
-        cand2_costs[cand2_nonnull_mask] = 0
-
-        cand1_lats = cand1_lats[cand1_nonnull_mask].astype("float")
-        cand1_lngs = cand1_lngs[cand1_nonnull_mask].astype("float")
-        cand2_lats = cand2_lats[cand2_nonnull_mask].astype("float")
-        cand2_lngs = cand2_lngs[cand2_nonnull_mask].astype("float")
-
-        # Calculate geo costs matrix: memory inefficient, only use for a low number of nodes
-        cand1_n_geo_nodes = len(cand1_lats)
-        cand2_n_geo_nodes = len(cand2_lats)
-        if cand1_n_geo_nodes > 0 and cand2_n_geo_nodes > 0:
-            geo_costs = np.zeros((cand1_n_geo_nodes, cand2_n_geo_nodes))
-            for cand1_i, cand1_lat, cand1_lng in zip(range(cand1_n_geo_nodes), cand1_lats, cand1_lngs):
-                if not valid_lat_lng(cand1_lat, cand1_lng):
-                    geo_costs[cand1_i, :] = 1.0/importance
-                    continue
-                for cand2_i, cand2_lat, cand2_lng in zip(range(cand2_n_geo_nodes), cand2_lats, cand2_lngs):
-                    if not valid_lat_lng(cand2_lat, cand2_lng):
-                        geo_costs[cand1_i, cand2_i] = 1.0/importance
-                        continue
-
-                    # TODO: Support constraints measured in units other than meters
-                    geo_distance = distance.distance((cand1_lat, cand1_lng), (cand2_lat, cand2_lng)).meters
-                    # geo_distance = haversine(cand1_lat, cand1_lng, cand2_lat, cand2_lng)
-
-                    if ("maxValue" in geo_constraint and geo_distance > geo_constraint["maxValue"]) or ("minValue" in geo_constraint and geo_distance < geo_constraint["minValue"]):
-                        geo_costs[cand1_i, cand2_i] = 1.0/importance
-            cand1_costs[cand1_nonnull_mask] = np.min(geo_costs, axis=1)
-            cand2_costs[cand2_nonnull_mask] = np.min(geo_costs, axis=0)
+        costs1 = np.where(has_coords, 0, 1.0 / importance)
+        costs2 = costs1.copy()
+
+        geo_cands1 = np.flatnonzero(is_cand1 & has_coords)
+        geo_cands2 = np.flatnonzero(is_cand2 & has_coords)
+        if len(geo_cands1) > 0 and len(geo_cands2) > 0:
+            # Candidates with invalid coordinates never satisfy the constraint
+            valid_cands1 = geo_cands1[is_valid[geo_cands1]]
+            valid_cands2 = geo_cands2[is_valid[geo_cands2]]
+            costs1[geo_cands1] = 1.0 / importance
+            costs2[geo_cands2] = 1.0 / importance
+            # TODO: Support constraints measured in units other than meters
+            min_dist = geo_constraint.get("minValue")
+            max_dist = geo_constraint.get("maxValue")
+            costs1[valid_cands1[geo.has_partner_within(
+                coords[valid_cands1], coords[valid_cands2],
+                min_dist, max_dist)]] = 0
+            costs2[valid_cands2[geo.has_partner_within(
+                coords[valid_cands2], coords[valid_cands1],
+                min_dist, max_dist)]] = 0
 
         node1_weight, node2_weight = get_src_dst_weights(smp, node1_idx, node2_idx)
         if node1_weight > 0:
-            local_costs[node1_idx, candidates[node1_idx]] += cand1_costs * node1_weight
+            local_costs[node1_idx, is_cand1] += costs1[is_cand1] * node1_weight
         if node2_weight > 0:
-            local_costs[node2_idx, candidates[node2_idx]] += cand2_costs * node2_weight
+            local_costs[node2_idx, is_cand2] += costs2[is_cand2] * node2_weight
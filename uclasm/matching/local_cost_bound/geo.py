@@ -0,0 +1,160 @@
+"""Provide a spatial index for checking distance constraints between nodes."""
+import numpy as np
+from scipy.spatial import cKDTree
+
+try:
+    from geopy import distance as geopy_distance
+except ImportError:
+    geopy_distance = None
+
+# Approximate radius of the earth in meters
+EARTH_RADIUS = 6373.0 * 1000
+
+# Geodesic distances are within this relative error of haversine distances
+GEODESIC_TOLERANCE = 0.01
+
+# Relative slack absorbing rounding errors in the index
+ROUNDING_TOLERANCE = 1e-9
+
+
+def unit_vectors(coords):
+    """Get the points of the unit sphere at some coordinates.
+
+    Parameters
+    ----------
+    coords : 2darray
+        Latitude and longitude of each point in degrees.
+
+    Returns
+    -------
+    2darray
+        Cartesian coordinates of each point, with one row per point.
+    """
+    lats, lngs = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+    return np.stack([np.cos(lats) * np.cos(lngs),
+                     np.cos(lats) * np.sin(lngs),
+                     np.sin(lats)], axis=1)
+
+
+def haversine_distances(coords, other_coords):
+    """Get the haversine distances between pairs of points.
+
+    Parameters
+    ----------
+    coords : 2darray
+        Latitude and longitude of each point in degrees.
+    other_coords : 2darray
+        Latitude and longitude of the points paired with them, or of a single
+        point paired with all of them.
+
+    Returns
+    -------
+    1darray
+        Distance in meters between each pair of points.
+    """
+    lats, lngs = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+    other_coords = np.atleast_2d(other_coords)
+    other_lats = np.radians(other_coords[:, 0])
+    other_lngs = np.radians(other_coords[:, 1])
+    a = np.sin((other_lats - lats) / 2)**2 + np.cos(lats) * \
+        np.cos(other_lats) * np.sin((other_lngs - lngs) / 2)**2
+    return 2 * EARTH_RADIUS * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def geodesic_distances(coords, other_coords):
+    """Get the geodesic distances between pairs of points with geopy.
+
+    Takes the same arguments as `haversine_distances`.
+    """
+    other_coords = np.broadcast_to(other_coords, coords.shape)
+    return np.array([geopy_distance.distance(tuple(coord),
+                                             tuple(other_coord)).meters
+                     for coord, other_coord in zip(coords, other_coords)])
+
+
+def chord_lengths(dists):
+    """Convert distances along the earth to distances between unit vectors."""
+    angles = np.clip(np.asarray(dists, dtype=float) / EARTH_RADIUS, 0, np.pi)
+    return 2 * np.sin(angles / 2)
+
+
+def arc_lengths(chords):
+    """Convert distances between unit vectors to distances along the earth."""
+    return 2 * EARTH_RADIUS * np.arcsin(np.clip(chords / 2, 0, 1))
+
+
+def has_partner_within(coords, other_coords, min_dist=None, max_dist=None,
+                       geodesic=None):
+    """Find which points have some other point within a range of distances.
+
+    The other points are put in a k-d tree of their unit vectors, in which
+    distances between unit vectors grow with distances along the earth. The
+    nearest and the farthest other point of each point, the latter being the
+    one nearest to its antipode, settle most points with two queries. Only
+    the points which have no other point settled by them are checked against
+    every other point within the largest distance allowed.
+
+    Exact distances are geodesic when geopy is installed, and haversine
+    distances otherwise. Geodesic distances are within `GEODESIC_TOLERANCE`
+    of haversine distances, so they are only computed for the pairs too close
+    to a bound to settle by the index.
+
+    Parameters
+    ----------
+    coords : 2darray
+        Latitude and longitude of each point in degrees.
+    other_coords : 2darray
+        Latitude and longitude of each other point in degrees.
+    min_dist : float, optional
+        Smallest allowed distance in meters.
+    max_dist : float, optional
+        Largest allowed distance in meters.
+    geodesic : bool, optional
+        Whether to measure geodesic distances. By default, they are measured
+        whenever geopy is installed.
+
+    Returns
+    -------
+    1darray(bool)
+        Whether each point has some other point within the distances.
+    """
+    n_points = len(coords)
+    if n_points == 0 or len(other_coords) == 0:
+        return np.zeros(n_points, dtype=np.bool_)
+    if geodesic is None:
+        geodesic = geopy_distance is not None
+    min_dist = 0.0 if min_dist is None else float(min_dist)
+    max_dist = np.inf if max_dist is None else float(max_dist)
+    tolerance = GEODESIC_TOLERANCE if geodesic else 0.0
+    lo = (1 - tolerance) * (1 - ROUNDING_TOLERANCE)
+    hi = (1 + tolerance) * (1 + ROUNDING_TOLERANCE)
+    distance_fn = geodesic_distances if geodesic else haversine_distances
+
+    points = unit_vectors(coords)
+    tree = cKDTree(unit_vectors(other_coords))
+    nearest = arc_lengths(tree.query(points)[0])
+    # The farthest point from a point is the nearest to its antipode
+    farthest = arc_lengths(np.sqrt(np.clip(
+        4 - tree.query(-points)[0]**2, 0, 4)))
+
+    def surely_within(dists):
+        return (dists * lo >= min_dist) & (dists * hi <= max_dist)
+
+    is_within = surely_within(nearest) | surely_within(farthest)
+    is_unsettled = ~is_within & (nearest * lo <= max_dist) & \
+        (farthest * hi >= min_dist)
+    max_chord = chord_lengths(max_dist / lo) * (1 + ROUNDING_TOLERANCE)
+    for point_idx in np.flatnonzero(is_unsettled):
+        other_idxs = tree.query_ball_point(points[point_idx], max_chord)
+        if len(other_idxs) == 0:
+            continue
+        others = other_coords[other_idxs]
+        # Only measure the pairs not too close to be allowed
+        others = others[haversine_distances(
+            others, coords[point_idx]) * hi >= min_dist]
+        if len(others) == 0:
+            continue
+        dists = distance_fn(others, coords[point_idx])
+        is_within[point_idx] = np.any((dists >= min_dist) &
+                                      (dists <= max_dist))
+    return is_within
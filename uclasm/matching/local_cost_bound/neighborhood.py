@@ -1,32 +1,60 @@
 import numpy as np
-import networkx as nx
 from scipy import sparse
 from scipy import optimize
-import time
 
-def get_edge_seqs(graph, channels=None):
-    """
-    Return the edge sequences in each channel for each node.
+from .edgewise import map_chunks
+
+# Number of candidates of a template node bounded together by one thread
+PAIR_BLOCK_SIZE = 256
+
+
+def neighborhood_cost(tmplt_counts, world_counts, is_cand, has_other_cand):
+    """Bound the cost of the edges around a template node from below, given
+    the world node it is assigned to.
+
+    Each neighbor of the template node must be assigned to a distinct
+    candidate. A candidate which neighbors the world node misses the edges it
+    does not share, and any other candidate misses every edge.
+
+    Parameters
+    ----------
+    tmplt_counts : 2darray
+        Edge counts between the template node and each of its neighbors, with
+        one column for each channel and direction.
+    world_counts : 2darray
+        Edge counts between the world node and each of its neighbors.
+    is_cand : 2darray
+        Whether each world neighbor is a candidate for each template neighbor.
+    has_other_cand : 1darray
+        Whether each template neighbor has a candidate which does not neighbor
+        the world node.
 
     Returns
     -------
-    dict
-        Keys are the node indexes and values are their corresponding edge seqs.
+    float
+        Smallest number of missing edges over the assignments of neighbors,
+        or inf if there is no assignment.
     """
-    if channels is None:
-        channels = graph.channels
-
-    edge_seqs = {}
-    for node_idx in range(graph.n_nodes):
-        seq_list = []
-        for channel in channels:
-            adj = graph.ch_to_adj[channel]
-            seq_list.extend([adj[node_idx,:], adj.T[node_idx,:]])
-        edge_seqs[node_idx] = sparse.vstack(seq_list, format="csr")
+    n_tmplt_nbrs = len(tmplt_counts)
+    missing = np.maximum(tmplt_counts[:, None, :] - world_counts[None, :, :],
+                         0).sum(axis=2).astype(float)
+    missing[~is_cand] = np.inf
+    # Give each template neighbor its own column standing for every other
+    # candidate, as if they were never shared. This relaxation can only lower
+    # the bound, which keeps it a valid lower bound.
+    others = np.full((n_tmplt_nbrs, n_tmplt_nbrs), np.inf)
+    other_idxs = np.flatnonzero(has_other_cand)
+    others[other_idxs, other_idxs] = tmplt_counts[other_idxs].sum(axis=1)
+    lap_mat = np.hstack([missing, others])
+    try:
+        row_idxs, col_idxs = optimize.linear_sum_assignment(lap_mat)
+    except ValueError:
+        # Some neighbor has no candidate left
+        return np.inf
+    return lap_mat[row_idxs, col_idxs].sum()
 
-    return edge_seqs
 
-def neighborhood(smp):
+def neighborhood(smp, changed_cands=None):
     """
     Bound local assignment costs by neighborhood disagreements.
 
@@ -36,45 +64,97 @@ def neighborhood(smp):
     subgraph isomorphism exists in which the neighbors of v are candidates for
     the appropriate neighbors of u by looking for a bipartite matching.
 
+    Each bipartite matching is only between the neighbors of u and the
+    neighbors of v, with one more column per neighbor of u standing for the
+    candidates which do not neighbor v. The edge counts between neighbors
+    are read from `sym_edge_counts` of each graph, and the pairs are split
+    between `smp.n_jobs` threads.
+
     Parameters
     ----------
     smp : MatchingProblem
         A subgraph matching problem on which to compute edgewise cost bounds.
+    changed_cands : ndarray(bool), optional
+        Template nodes whose candidates have changed since the last run. Only
+        these nodes and their neighbors have to be reevaluated.
     """
     # TODO: check whether a world node is a candidate for any tmplt node
     # ---> This can be achieved by reduce_world?
 
-    tmplt_edge_seqs = get_edge_seqs(smp.tmplt)
-    world_edge_seqs = get_edge_seqs(smp.world, channels=smp.tmplt.channels)
-
-    nbr_counts = smp.tmplt.is_nbr.sum(axis=1).A.flatten()
-
-    # TODO: might want candidates to be sparse in other filters
-    sparse_is_cand = sparse.csr_matrix(smp.candidates())
-    for tnode_idx, wnode_idx in np.transpose(sparse_is_cand.nonzero()):
-        # If the template node has only 1 neighbor, the topology filter is
-        # equivalent to the neighborhood filter, so there is no point in
-        # using the neighborhood filter since it is more expensive.
-        if nbr_counts[tnode_idx] == 1:
-            continue
-
-        tmplt_seq = tmplt_edge_seqs[tnode_idx]
-        world_seq = world_edge_seqs[wnode_idx]
-
-        lap_mat_rows = []
-        for tnbr_idx in range(smp.tmplt.n_nodes):
-            # The world nodes that are not candidates to tnbr_idx are np.Inf
-            lap_mat_row = smp.global_costs[tnbr_idx]
-            lap_mat_row[lap_mat_row != np.Inf] = 0
-            # Check if all of the necessary edges are present
-            for i, edge_count in enumerate(tmplt_seq[:,tnbr_idx].A.flat):
-                if edge_count > 0:
-                    lap_mat_row = \
-                        lap_mat_row + np.maximum(edge_count-world_seq[i].A, 0)
-            lap_mat_rows.append(lap_mat_row.flatten())
-
-        lap_mat = np.stack(lap_mat_rows)
-        row_idxs, col_idxs = optimize.linear_sum_assignment(lap_mat)
-        # TODO: Figure out the relationship between local_costs and global_costs
-        # for neighborhood-local-costs.
-        smp.local_costs[tnode_idx, wnode_idx] = lap_mat[row_idxs, col_idxs].sum()
+    tmplt_indptr, tmplt_nbrs, tmplt_counts = smp.tmplt.sym_edge_counts
+    world_indptr, world_nbrs, world_counts = smp.world.sym_edge_counts
+    nbr_counts = np.diff(tmplt_indptr)
+
+    candidates = smp.candidates()
+    if not sparse.issparse(candidates):
+        candidates = sparse.csr_matrix(np.asarray(candidates))
+    candidates.sort_indices()
+    cand_counts = np.diff(candidates.indptr)
+
+    tmplt_idxs = np.arange(smp.tmplt.n_nodes)
+    if changed_cands is not None:
+        # The bound of a node depends on its own candidates and on those of
+        # its neighbors
+        changed_cands = np.asarray(changed_cands, dtype=bool)
+        nbr_changed = np.asarray(
+            smp.tmplt.is_nbr[changed_cands].sum(axis=0)).ravel() > 0
+        tmplt_idxs = np.flatnonzero(changed_cands | nbr_changed)
+    # If the template node has only 1 neighbor, the topology filter is
+    # equivalent to the neighborhood filter, so there is no point in
+    # using the neighborhood filter since it is more expensive.
+    tmplt_idxs = tmplt_idxs[nbr_counts[tmplt_idxs] > 1]
+
+    # Split the candidates of each template node into blocks, so that the
+    # pairs of a single template node with many candidates can be spread over
+    # several threads
+    blocks = []
+    for tnode_idx in tmplt_idxs:
+        wnode_idxs = candidates.indices[candidates.indptr[tnode_idx]:
+                                        candidates.indptr[tnode_idx + 1]]
+        for start in range(0, len(wnode_idxs), PAIR_BLOCK_SIZE):
+            blocks.append(
+                (tnode_idx, wnode_idxs[start:start + PAIR_BLOCK_SIZE]))
+
+    def bound_blocks(blocks):
+        bounds = []
+        for tnode_idx, wnode_idxs in blocks:
+            tnbr_slice = slice(tmplt_indptr[tnode_idx],
+                               tmplt_indptr[tnode_idx + 1])
+            tnbr_idxs = tmplt_nbrs[tnbr_slice]
+            tnbr_counts = tmplt_counts[tnbr_slice]
+            # Which world neighbors of every world node of the block are
+            # candidates for each template neighbor, in one lookup
+            starts = world_indptr[wnode_idxs]
+            ends = world_indptr[wnode_idxs + 1]
+            wnbr_counts = ends - starts
+            nbr_offsets = np.concatenate([[0], np.cumsum(wnbr_counts)])
+            block_wnbrs = world_nbrs[
+                np.repeat(starts - nbr_offsets[:-1], wnbr_counts) +
+                np.arange(nbr_offsets[-1])]
+            tnbr_cands = candidates[tnbr_idxs]
+            block_is_cand = tnbr_cands[:, block_wnbrs].toarray() != 0
+            # Neighbors can not be assigned to the world node itself
+            is_own_cand = tnbr_cands[:, wnode_idxs].toarray() != 0
+            cum_is_cand = np.zeros((len(tnbr_idxs), nbr_offsets[-1] + 1),
+                                   dtype=int)
+            np.cumsum(block_is_cand, axis=1, out=cum_is_cand[:, 1:])
+            n_nbr_cands = cum_is_cand[:, nbr_offsets[1:]] - \
+                cum_is_cand[:, nbr_offsets[:-1]]
+            has_other_cand = cand_counts[tnbr_idxs][:, None] > \
+                n_nbr_cands + is_own_cand
+            block_bounds = np.empty(len(wnode_idxs))
+            for i in range(len(wnode_idxs)):
+                nbr_slice = slice(nbr_offsets[i], nbr_offsets[i + 1])
+                block_bounds[i] = neighborhood_cost(
+                    tnbr_counts, world_counts[starts[i]:ends[i]],
+                    block_is_cand[:, nbr_slice], has_other_cand[:, i])
+            bounds.append((tnode_idx, wnode_idxs, block_bounds))
+        return bounds
+
+    chunks = map_chunks(bound_blocks, blocks, smp.n_jobs)
+    # TODO: Figure out the relationship between local_costs and global_costs
+    # for neighborhood-local-costs.
+    for chunk in chunks:
+        for tnode_idx, wnode_idxs, block_bounds in chunk:
+            smp.set_cost_entries("local_costs", (tnode_idx, wnode_idxs),
+                                 block_bounds)
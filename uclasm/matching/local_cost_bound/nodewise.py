@@ -1,6 +1,6 @@
 """Provide a function for bounding node assignment costs with nodewise info."""
 
-from ..matching_utils import feature_disagreements
+from ..matching_utils import feature_disagreements, feature_disagreements_at
 
 
 def nodewise(smp):
@@ -15,7 +15,17 @@ def nodewise(smp):
     smp : MatchingProblem
         A subgraph matching problem on which to compute nodewise cost bounds.
     """
-    smp.local_costs = feature_disagreements(
-        smp.tmplt.in_out_degrees,
-        smp.world.in_out_degrees
-    )
+    if smp.sparse_costs:
+        # Only compare the pairs whose costs are stored.
+        costs = smp.global_costs
+        smp.local_costs = feature_disagreements_at(
+            smp.tmplt.in_out_degrees,
+            smp.world.in_out_degrees,
+            costs.rows,
+            costs.indices
+        )
+    else:
+        smp.local_costs = feature_disagreements(
+            smp.tmplt.in_out_degrees,
+            smp.world.in_out_degrees
+        )
@@ -1,11 +1,19 @@
 """This module provides a class for representing subgraph matching problems."""
 import numpy as np
-import os
 
 from .matching_utils import inspect_channels, MonotoneArray, \
     feature_disagreements
+from .sparse_costs import SparseCostMatrix
+from .cost_cache import EdgewiseCostCache
+from .trail import Trail
 from .global_cost_bound import *
 
+# Attributes holding the cost matrices of a matching problem
+COST_ATTRS = ("_fixed_costs", "_local_costs", "_global_costs")
+
+# Attributes restored when backtracking to a checkpoint, besides the costs
+TRAILED_ATTRS = ("matching", "assigned_tmplt_idxs", "_num_valid_candidates")
+
 class MatchingProblem:
     """A class representing any subgraph matching problem, noisy or otherwise.
 
@@ -41,7 +49,8 @@ class MatchingProblem:
     edge_attr_fn : function
         Function for comparing edge attributes. Should take two pd.Series of
         edge attributes and return the cost associated with the difference
-        between them.
+        between them. Functions marked with `vectorized_edge_attr_fn` instead
+        compare one template edge against arrays of world edge attributes.
     missing_edge_cost_fn : function
         Function for computing the cost of a missing template edge. Should take
         a pd.Series of node attributes and return the cost associated with
@@ -61,8 +70,45 @@ class MatchingProblem:
     candidate_print_limit : int, optional
         When summarizing the candidates of each template node, limit the list
         of candidates to this many.
+    cache_path : str, optional
+        Directory of a persistent cache of edgewise attribute costs, shared
+        between runs. Costs are keyed by the template and world edge
+        attributes and by `edge_attr_fn_version`, so they are only reused for
+        identical inputs. See `EdgewiseCostCache`.
+    edgewise_costs_cache : 2darray, optional
+        Precomputed edgewise attribute costs.
+    cache_max_bytes : int, optional
+        Disk budget of the persistent cache. Least recently used entries are
+        removed to stay within it. Unlimited by default.
+    edge_attr_fn_version : str, optional
+        Version of `edge_attr_fn`, which should be changed whenever the costs
+        it returns change. By default it is derived from the code of the
+        function, which misses changes to data the function reads.
     use_monotone : bool, optional
         Whether to use monotone arrays for the cost. Defaults to true.
+    sparse_costs : bool, optional
+        Whether to store the costs as SparseCostMatrix objects which only keep
+        entries for live candidates, so that memory scales with the number of
+        candidates rather than with the size of the problem. Entries are
+        discarded as soon as they exceed the global cost threshold, so the
+        threshold should not be raised afterwards. Edge attribute costs are
+        only supported with dense costs, so `edge_attr_fn` must be None.
+        Defaults to false.
+    sparse_lap : bool, optional
+        Whether to bound the global costs by solving assignments over the
+        sparse graph of candidates rather than over the whole cost matrix.
+        The work then scales with the number of candidates, and the bounds
+        are at least as tight. Sparse costs are always bounded this way.
+        Defaults to false.
+    tiered_bounds : bool, optional
+        Whether to bound the global costs with cheap relaxations first, and
+        solve the exact assignments only once the relaxations stop
+        eliminating candidates. With `sparse_lap`, the exact assignments are
+        solved over the candidates which survive the relaxations only. Only
+        used with dense costs. Defaults to false.
+    n_jobs : int, optional
+        Number of threads with which to compute the edgewise cost bound. A
+        value of -1 uses one thread per CPU. Defaults to 1.
 
     Attributes
     ----------
@@ -81,6 +127,17 @@ class MatchingProblem:
         from the world graph. A cost of 0 corresponds to an exact match for the
         template, whereas a cost of 1 means that the match may be missing a
         single edge which is present in the template but not in the world.
+    sparse_costs : bool
+        Whether the costs are stored as SparseCostMatrix objects.
+    sparse_lap : bool
+        Whether the global costs are bounded over the sparse graph of
+        candidates.
+    tiered_bounds : bool
+        Whether the global costs are bounded with cheap relaxations first.
+    n_jobs : int
+        Number of threads with which to compute the edgewise cost bound.
+    cost_cache : EdgewiseCostCache or None
+        Persistent cache of edgewise attribute costs, if `cache_path` is set.
     """
 
     def __init__(self,
@@ -98,20 +155,41 @@ class MatchingProblem:
                  candidate_print_limit=10,
                  cache_path=None,
                  edgewise_costs_cache=None,
+                 cache_max_bytes=None,
+                 edge_attr_fn_version=None,
                  use_monotone=True,
-                 match_fixed_costs=False):
+                 match_fixed_costs=False,
+                 sparse_costs=False,
+                 sparse_lap=False,
+                 tiered_bounds=False,
+                 n_jobs=1):
+
+        if sparse_costs and edge_attr_fn is not None:
+            raise ValueError("Edge attribute costs do not support sparse "
+                             "costs. Pass sparse_costs=False or "
+                             "edge_attr_fn=None.")
 
         # Various important matrices will have this shape.
         self.shape = (tmplt.n_nodes, world.n_nodes)
+        self.sparse_costs = sparse_costs
+        self.sparse_lap = sparse_lap
+        self.tiered_bounds = tiered_bounds
+        self.n_jobs = n_jobs
 
-        if fixed_costs is None:
-            fixed_costs = np.zeros(self.shape)
+        # Sparse costs discard candidates against the thresholds as they go.
+        self.local_cost_threshold = local_cost_threshold
+        self.global_cost_threshold = global_cost_threshold
+        self.strict_threshold = strict_threshold
+
+        if not sparse_costs:
+            if fixed_costs is None:
+                fixed_costs = np.zeros(self.shape)
 
-        if local_costs is None:
-            local_costs = np.zeros(self.shape)
+            if local_costs is None:
+                local_costs = np.zeros(self.shape)
 
-        if global_costs is None:
-            global_costs = np.zeros(self.shape)
+            if global_costs is None:
+                global_costs = np.zeros(self.shape)
 
         # Make sure graphs have the same channels in the same order.
         if tmplt.channels != world.channels:
@@ -119,18 +197,25 @@ class MatchingProblem:
             world = world.channel_subgraph(tmplt.channels)
 
         # Account for self edges in fixed costs.
+        self_edges = None
         if tmplt.adjs is not None and tmplt.has_loops:
-            fixed_costs += feature_disagreements(
-                tmplt.self_edges,
-                world.self_edges
-            )
+            if sparse_costs:
+                self_edges = (tmplt.self_edges, world.self_edges)
+            else:
+                fixed_costs += feature_disagreements(
+                    tmplt.self_edges,
+                    world.self_edges
+                )
             tmplt = tmplt.loopless_subgraph()
             world = world.loopless_subgraph()
 
         self.use_monotone = use_monotone
         self.match_fixed_costs = match_fixed_costs
 
-        if use_monotone:
+        if sparse_costs:
+            self._init_sparse_costs(tmplt, world, fixed_costs, local_costs,
+                                    global_costs, self_edges=self_edges)
+        elif use_monotone:
             self._fixed_costs = fixed_costs.view(MonotoneArray)
             self._local_costs = local_costs.view(MonotoneArray)
             # self._global_costs = global_costs.view(MonotoneArray)
@@ -138,37 +223,34 @@ class MatchingProblem:
             self._fixed_costs = fixed_costs
             self._local_costs = local_costs
             # self._global_costs = global_costs
-        self._global_costs = global_costs.view(MonotoneArray)
+        if not sparse_costs:
+            self._global_costs = global_costs.view(MonotoneArray)
 
         # No longer care about self-edges because they are fixed costs.
         self.tmplt = tmplt
         self.world = world
 
-        # Cache of edge-to-edge costs for the edgewise local cost bound
+        # Undo log of changes for backtracking, from `checkpoint`
+        self.trail = None
+
+        # Cache of edge-to-edge costs for the edgewise local cost bound. The
+        # persistent cache is only consulted when the costs are generated.
         self._edgewise_costs_cache = edgewise_costs_cache
         self.cache_path = cache_path
-        if self.cache_path is not None and self._edgewise_costs_cache is None:
-            try:
-                self._edgewise_costs_cache = np.load(os.path.join(self.cache_path, "edgewise_costs_cache.npy"))
-                n_tmplt_edges = len(self.tmplt.edgelist.index)
-                n_world_edges = len(self.world.edgelist.index)
-                if self._edgewise_costs_cache.shape != (n_tmplt_edges, n_world_edges):
-                    tmplt_edge_to_attr_idx = np.load(os.path.join(self.cache_path, "tmplt_edge_to_attr_idx.npy"))
-                    world_edge_to_attr_idx = np.load(os.path.join(self.cache_path, "world_edge_to_attr_idx.npy"))
-                    print('Edge to attr maps loaded from cache')
-                    
-                    self.tmplt_edge_to_attr_idx = tmplt_edge_to_attr_idx
-                    self.world_edge_to_attr_idx = world_edge_to_attr_idx
-
-                    if len(self.tmplt_edge_to_attr_idx) != n_tmplt_edges or len(self.world_edge_to_attr_idx) != n_world_edges:
-                        raise Exception("Edgewise costs cache not properly computed!")
-                print("Edge-to-edge costs loaded from cache")
-            except IOError as e:
-                print("No edgewise cost cache found.")
-
-        self.local_cost_threshold = local_cost_threshold
-        self.global_cost_threshold = global_cost_threshold
-        self.strict_threshold = strict_threshold
+        self.cache_max_bytes = cache_max_bytes
+        self.edge_attr_fn_version = edge_attr_fn_version
+        self.cost_cache = None
+        if cache_path is not None:
+            self.cost_cache = EdgewiseCostCache(cache_path,
+                                                max_bytes=cache_max_bytes)
+
+        # Edgewise costs of each pair of neighboring template nodes, keyed by
+        # the pair, along with the candidates they were computed for
+        self._edge_least_costs_cache = {}
+        # Constrained assignment costs of each component of the candidates
+        # from the last global cost bound, along with the costs they were
+        # computed from
+        self._clap_cache = {}
 
         self._ground_truth_provided = ground_truth_provided
         self._candidate_print_limit = candidate_print_limit
@@ -182,18 +264,100 @@ class MatchingProblem:
         self.matching = tuple()
         self.assigned_tmplt_idxs = set()
 
-    def copy(self, copy_graphs=True):
-        """Returns a copy of the MatchingProblem."""
+    def _init_sparse_costs(self, tmplt, world, fixed_costs, local_costs,
+                           global_costs, self_edges=None):
+        """Set up sparse cost matrices holding only plausible candidates.
+
+        Unless the fixed costs are already a SparseCostMatrix, a pair of nodes
+        is only stored if its fixed cost plus half its degree disagreement is
+        within the global cost threshold. This is computed one template node
+        at a time so that no dense matrix is ever allocated.
+
+        Parameters
+        ----------
+        tmplt : Graph
+            Template graph to be matched, without self edges.
+        world : Graph
+            World graph to be searched, without self edges.
+        fixed_costs, local_costs, global_costs : SparseCostMatrix or 2darray
+            Initial costs, or None.
+        self_edges : (2darray, 2darray), optional
+            Self edge counts of the template and world, if the template has
+            self edges.
+        """
+        if not isinstance(fixed_costs, SparseCostMatrix):
+            tmplt_features = tmplt.in_out_degrees
+            world_features = world.in_out_degrees
+            row_idxs, col_idxs, values = [], [], []
+            for tmplt_idx in range(tmplt.n_nodes):
+                row_bounds = feature_disagreements(
+                    tmplt_features[tmplt_idx:tmplt_idx+1], world_features)[0]
+                row_fixed = np.zeros(world.n_nodes)
+                if fixed_costs is not None:
+                    row_fixed += fixed_costs[tmplt_idx]
+                if self_edges is not None:
+                    row_fixed += feature_disagreements(
+                        self_edges[0][tmplt_idx:tmplt_idx+1], self_edges[1])[0]
+                is_plausible = self._within_threshold(row_bounds/2 + row_fixed)
+                cand_idxs = np.flatnonzero(is_plausible)
+                row_idxs.append(np.full(len(cand_idxs), tmplt_idx))
+                col_idxs.append(cand_idxs)
+                values.append(row_fixed[cand_idxs])
+            fixed_costs = SparseCostMatrix.from_entries(
+                np.concatenate(row_idxs), np.concatenate(col_idxs),
+                np.concatenate(values), self.shape)
+
+        pattern = fixed_costs
+        self._fixed_costs = pattern.with_data(pattern.data,
+                                              monotone=self.use_monotone)
+
+        def as_sparse(costs, monotone):
+            if costs is None:
+                return pattern.zeros_like(monotone=monotone)
+            if isinstance(costs, SparseCostMatrix):
+                if not pattern.has_same_pattern(costs):
+                    raise ValueError("Sparse costs must store the same entries.")
+                return pattern.with_data(costs.data, monotone=monotone)
+            costs = np.asarray(costs)[pattern.rows, pattern.indices]
+            return pattern.with_data(costs, monotone=monotone)
+
+        self._local_costs = as_sparse(local_costs, self.use_monotone)
+        self._global_costs = as_sparse(global_costs, True)
+
+    def copy(self, copy_graphs=True, share_costs=False):
+        """Returns a copy of the MatchingProblem.
+
+        Parameters
+        ----------
+        copy_graphs : bool, optional
+            Whether to copy the template and world graphs.
+        share_costs : bool, optional
+            Whether to share the cost matrices with the copy until either
+            problem modifies them, rather than copying them up front. Shared
+            matrices are read-only; each problem replaces or copies its own
+            matrices before writing to them, so the two problems stay
+            independent. Search uses this so that branching costs memory in
+            proportion to what each branch changes.
+        """
         if copy_graphs:
             tmplt = self.tmplt.copy()
             world = self.world.copy()
         else:
             tmplt = self.tmplt
             world = self.world
+        if share_costs:
+            self._share_costs()
+            fixed_costs = self._fixed_costs
+            local_costs = self._local_costs
+            global_costs = self._global_costs
+        else:
+            fixed_costs = self._fixed_costs.copy() if self.match_fixed_costs else self._fixed_costs
+            local_costs = None if self._local_costs is None else self._local_costs.copy()
+            global_costs = None if self._global_costs is None else self._global_costs.copy()
         smp_copy = MatchingProblem(tmplt, world,
-            fixed_costs=self._fixed_costs.copy() if self.match_fixed_costs else self._fixed_costs,
-            local_costs=None if self._local_costs is None else self._local_costs.copy(),
-            global_costs=None if self._global_costs is None else self._global_costs.copy(),
+            fixed_costs=fixed_costs,
+            local_costs=local_costs,
+            global_costs=global_costs,
             node_attr_fn=self.node_attr_fn,
             edge_attr_fn=self.edge_attr_fn,
             missing_edge_cost_fn=self.missing_edge_cost_fn,
@@ -204,8 +368,16 @@ class MatchingProblem:
             candidate_print_limit=self._candidate_print_limit,
             cache_path=self.cache_path,
             edgewise_costs_cache=self._edgewise_costs_cache,
+            cache_max_bytes=self.cache_max_bytes,
+            edge_attr_fn_version=self.edge_attr_fn_version,
             use_monotone=self.use_monotone,
-            match_fixed_costs=self.match_fixed_costs)
+            match_fixed_costs=self.match_fixed_costs,
+            sparse_costs=self.sparse_costs,
+            sparse_lap=self.sparse_lap,
+            tiered_bounds=self.tiered_bounds,
+            n_jobs=self.n_jobs)
+        smp_copy._edge_least_costs_cache = self._edge_least_costs_cache.copy()
+        smp_copy._clap_cache = self._clap_cache.copy()
         if hasattr(self, "template_importance"):
             smp_copy.template_importance = self.template_importance
         if hasattr(self, "tmplt_edge_to_attr_idx"):
@@ -218,6 +390,163 @@ class MatchingProblem:
             smp_copy.tmplt.geo_constraints = self.tmplt.geo_constraints
         return smp_copy
 
+    def _share_costs(self):
+        """Make the cost matrices read-only so a copy can share them."""
+        for attr in COST_ATTRS:
+            costs = getattr(self, attr)
+            if costs is None:
+                continue
+            if self.sparse_costs:
+                data = costs.data.view()
+                data.flags.writeable = False
+                costs = costs.with_data(data)
+            else:
+                costs = costs.view()
+                costs.flags.writeable = False
+            setattr(self, attr, costs)
+
+    def _is_shared(self, attr):
+        """Check whether a cost matrix is read-only, as when it is shared."""
+        costs = getattr(self, attr)
+        if costs is None:
+            return False
+        if self.sparse_costs:
+            return not costs.data.flags.writeable
+        return not costs.flags.writeable
+
+    def _replace_costs(self, attr, costs):
+        """Replace a cost matrix, recording the old one on the trail."""
+        if self.trail is not None:
+            self.trail.record_attr(self, attr)
+        setattr(self, attr, costs)
+
+    def own_costs(self, *names):
+        """Copy cost matrices shared with other problems, so that they can be
+        modified in place.
+
+        Matrices shared by `copy` with `share_costs=True` are read-only until
+        they are owned. Assigning to `fixed_costs`, `local_costs` or
+        `global_costs` takes care of this, but code which writes into the
+        matrices directly, such as `smp.fixed_costs[mask] = inf`, must first
+        call this method.
+
+        Parameters
+        ----------
+        *names : str
+            Names of the cost matrices to own: "fixed_costs", "local_costs" or
+            "global_costs".
+        """
+        for name in names:
+            attr = "_" + name
+            if self._is_shared(attr):
+                self._replace_costs(attr, getattr(self, attr).copy())
+
+    def set_cost_entries(self, name, key, value):
+        """Set some entries of a cost matrix in place, respecting
+        monotonicity.
+
+        Unlike writing into the matrix directly, this takes care of matrices
+        shared with copies and of recording the old values on the trail.
+
+        Parameters
+        ----------
+        name : str
+            Name of the cost matrix: "fixed_costs", "local_costs" or
+            "global_costs".
+        key : 2darray(bool) or tuple
+            Boolean mask of the entries to set, or any index of a dense
+            matrix. With sparse costs, a row index and column indices.
+        value : float or ndarray
+            New values of the entries.
+        """
+        attr = "_" + name
+        self.own_costs(name)
+        costs = getattr(self, attr)
+        if self.trail is not None:
+            if self.sparse_costs:
+                row, cols = key
+                idxs = costs.positions(row, np.atleast_1d(cols))
+                idxs = idxs[idxs >= 0]
+            elif isinstance(key, np.ndarray) and key.dtype == np.bool_ \
+                    and key.shape == costs.shape:
+                idxs = np.flatnonzero(key)
+            else:
+                idxs = np.arange(costs.size).reshape(costs.shape)[key].ravel()
+            self.trail.record_entries(self, attr, idxs)
+        costs[key] = value
+
+    def checkpoint(self):
+        """Start recording changes, so that they can later be undone.
+
+        Checkpoints can be nested. Every change made to the costs and the
+        matching after the checkpoint is recorded on `trail` until the
+        problem backtracks to it. Reducing the world cannot be undone, so it
+        is not allowed while recording.
+
+        Returns
+        -------
+        int
+            Mark to pass to `backtrack`.
+        """
+        if self.trail is None:
+            self.trail = Trail()
+        mark = self.trail.mark()
+        for name in TRAILED_ATTRS:
+            self.trail.record_attr(self, name)
+        return mark
+
+    def backtrack(self, mark):
+        """Undo every change made since a checkpoint.
+
+        Parameters
+        ----------
+        mark : int
+            Mark returned by `checkpoint`.
+        """
+        trail = self.trail
+        # Changes made while undoing must not be recorded themselves
+        self.trail = None
+        trail.undo(mark)
+        if len(trail) > 0:
+            self.trail = trail
+
+    def _assign_costs(self, attr, value):
+        """Set every entry of a cost matrix, respecting monotonicity."""
+        costs = getattr(self, attr)
+        if not self._is_shared(attr):
+            if self.trail is not None:
+                if self.sparse_costs:
+                    new_costs = costs.copy()
+                    new_costs.set_data(value)
+                    self.trail.record_assignment(self, attr, new_costs.data)
+                else:
+                    new_costs = np.broadcast_to(value, costs.shape)
+                    if isinstance(costs, MonotoneArray):
+                        new_costs = np.maximum(np.asarray(costs), new_costs)
+                    self.trail.record_assignment(self, attr, new_costs)
+            if self.sparse_costs:
+                costs.set_data(value)
+            else:
+                costs[:] = value
+            return
+        # Write the new values into new storage instead of copying the shared
+        # matrix only to overwrite it
+        if self.sparse_costs:
+            if isinstance(value, SparseCostMatrix):
+                if not costs.has_same_pattern(value):
+                    raise ValueError("Sparse cost matrices store different entries.")
+                value = value.data
+            data = np.broadcast_to(value, costs.data.shape)
+            if costs.monotone:
+                data = np.maximum(costs.data, data)
+            self._replace_costs(attr, costs.with_data(np.array(data, dtype=np.float64)))
+        else:
+            new_costs = np.broadcast_to(value, costs.shape)
+            if isinstance(costs, MonotoneArray):
+                new_costs = np.maximum(np.asarray(costs), new_costs)
+            new_costs = np.array(new_costs, dtype=costs.dtype)
+            self._replace_costs(attr, new_costs.view(type(costs)))
+
     def set_costs(self, fixed_costs=None, local_costs=None, global_costs=None):
         """Set the cost arrays by force. Override monotonicity.
 
@@ -228,7 +557,24 @@ class MatchingProblem:
         global_costs : 2darray, optional
 
         """
-        if self.use_monotone:
+        if self.trail is not None:
+            for attr, costs in zip(COST_ATTRS,
+                                   [fixed_costs, local_costs, global_costs]):
+                if costs is not None:
+                    self.trail.record_attr(self, attr)
+        if self.sparse_costs:
+            if fixed_costs is not None:
+                self._fixed_costs = self._as_sparse_costs(
+                    fixed_costs, monotone=self.use_monotone)
+
+            if local_costs is not None:
+                self._local_costs = self._as_sparse_costs(
+                    local_costs, monotone=self.use_monotone)
+
+            if global_costs is not None:
+                self._global_costs = self._as_sparse_costs(
+                    global_costs, monotone=True)
+        elif self.use_monotone:
             if fixed_costs is not None:
                 self._fixed_costs = fixed_costs.view(MonotoneArray)
 
@@ -247,6 +593,12 @@ class MatchingProblem:
             if global_costs is not None:
                 self._global_costs = global_costs
 
+    def _as_sparse_costs(self, costs, monotone):
+        """Wrap costs in a SparseCostMatrix storing the current entries."""
+        if isinstance(costs, SparseCostMatrix):
+            return costs.with_data(costs.data, monotone=monotone)
+        return self._global_costs.with_data(costs, monotone=monotone)
+
     @property
     def fixed_costs(self):
         """2darray: Fixed costs such as node attribute mismatches.
@@ -259,7 +611,7 @@ class MatchingProblem:
 
     @fixed_costs.setter
     def fixed_costs(self, value):
-        self._fixed_costs[:] = value
+        self._assign_costs("_fixed_costs", value)
 
     @property
     def local_costs(self):
@@ -274,10 +626,12 @@ class MatchingProblem:
 
     @local_costs.setter
     def local_costs(self, value):
-        if self._local_costs is not None:
-            self._local_costs[:] = value
+        if self._local_costs is None:
+            if self.sparse_costs:
+                value = self._as_sparse_costs(value, monotone=self.use_monotone)
+            self._replace_costs("_local_costs", value)
         else:
-            self._local_costs = value
+            self._assign_costs("_local_costs", value)
 
     @property
     def global_costs(self):
@@ -292,7 +646,30 @@ class MatchingProblem:
 
     @global_costs.setter
     def global_costs(self, value):
-        self._global_costs[:] = value
+        self._assign_costs("_global_costs", value)
+
+    def zero_costs(self):
+        """Get a matrix of zero costs using the storage of the problem.
+
+        Returns
+        -------
+        2darray or SparseCostMatrix
+            Zeros of shape `self.shape`. With sparse costs, only the entries
+            of the current candidates are stored.
+        """
+        if self.sparse_costs:
+            return self._global_costs.zeros_like()
+        return np.zeros(self.shape)
+
+    def _within_threshold(self, costs):
+        """Check which global costs satisfy the global cost threshold."""
+        if self.strict_threshold:
+            # return np.logical_and(costs < self.global_cost_threshold,
+            #                       ~np.isclose(costs, self.global_cost_threshold))
+            return costs < (self.global_cost_threshold - 1e-8)
+        # return np.logical_or(costs <= self.global_cost_threshold,
+        #                      np.isclose(costs, self.global_cost_threshold))
+        return costs <= (self.global_cost_threshold + 1e-8)
 
     def candidates(self, tmplt_idx=None):
         """Get the matrix of compatibility between template and world nodes.
@@ -303,24 +680,56 @@ class MatchingProblem:
 
         This could be a property, but it is not particularly cheap to compute.
 
+        Parameters
+        ----------
+        tmplt_idx : int, optional
+            If provided, only get the candidates of this template node.
+
         Returns
         -------
-        2darray
+        2darray or spmatrix
             A boolean matrix where each entry indicates whether the world node
             corresponding to the column is a candidate for the template node
-            corresponding to the row.
+            corresponding to the row. A csr_matrix when using sparse costs.
+            If `tmplt_idx` is provided, a dense boolean row instead.
         """
-        if self.strict_threshold:
-            # return np.logical_and(self.global_costs < self.global_cost_threshold,
-            #                       ~np.isclose(self.global_costs, self.global_cost_threshold))
-            if tmplt_idx is not None:
-                return self.global_costs[tmplt_idx] < (self.global_cost_threshold - 1e-8)
-            return self.global_costs < (self.global_cost_threshold - 1e-8)
-        # return np.logical_or(self.global_costs <= self.global_cost_threshold,
-        #                      np.isclose(self.global_costs, self.global_cost_threshold))
+        if self.sparse_costs and tmplt_idx is None:
+            costs = self.global_costs
+            return costs.tocsr(self._within_threshold(costs.data))
         if tmplt_idx is not None:
-            return self.global_costs[tmplt_idx] <= (self.global_cost_threshold + 1e-8)
-        return self.global_costs <= (self.global_cost_threshold + 1e-8)
+            return self._within_threshold(self.global_costs[tmplt_idx])
+        return self._within_threshold(self.global_costs)
+
+    def candidate_idxs(self, tmplt_idx):
+        """Get the indices of the candidates of a template node.
+
+        Parameters
+        ----------
+        tmplt_idx : int
+            Index of the template node.
+
+        Returns
+        -------
+        1darray
+            Increasing indices of the world nodes which are candidates.
+        """
+        if self.sparse_costs:
+            cand_idxs, costs = self.global_costs.row(tmplt_idx)
+            return cand_idxs[self._within_threshold(costs)]
+        return np.flatnonzero(self.candidates(tmplt_idx))
+
+    def candidate_counts(self):
+        """Count the candidates of each template node.
+
+        Returns
+        -------
+        1darray
+            The number of candidates of each template node.
+        """
+        if self.sparse_costs:
+            costs = self.global_costs
+            return costs.count_rows(self._within_threshold(costs.data))
+        return np.asarray(self.candidates().sum(axis=1)).flatten()
 
     def __str__(self):
         """Summarize the state of the matching problem.
@@ -338,18 +747,15 @@ class MatchingProblem:
         info_strs.append("There are {} template nodes and {} world nodes."
                          .format(self.tmplt.n_nodes, self.world.n_nodes))
 
-        # Wouldn't want to recompute this too often.
-        candidates = self.candidates()
-
         # Number of candidates for each template node.
-        cand_counts = candidates.sum(axis=1)
+        cand_counts = self.candidate_counts()
 
         # TODO: if multiple nodes have the same candidates, condense them.
 
         # Iterate over template nodes in decreasing order of candidates.
         for idx in np.flip(np.argsort(cand_counts)):
             node = self.tmplt.nodes[idx]
-            cands = sorted(self.world.nodes[candidates[idx]])
+            cands = sorted(self.world.nodes.iloc[self.candidate_idxs(idx)])
             n_cands = len(cands)
 
             if n_cands <= 1:
@@ -386,7 +792,7 @@ class MatchingProblem:
             # which ground truth identity is not a candidate
             missing_ground_truth = [
                 node for idx, node in enumerate(self.tmplt.nodes)
-                if node not in self.world.nodes[candidates[idx]]
+                if node not in self.world.nodes.iloc[self.candidate_idxs(idx)]
             ]
             n_missing = len(missing_ground_truth)
 
@@ -411,7 +817,15 @@ class MatchingProblem:
         # Note: need to update the global_costs before reduce_world to reflect
         # changes in the candidates
 
-        is_cand = self.candidates().any(axis=0)
+        if self.trail is not None:
+            raise ValueError("The world cannot be reduced while changes are "
+                             "recorded for backtracking.")
+
+        if self.sparse_costs:
+            is_cand = np.zeros(self.world.n_nodes, dtype=np.bool_)
+            is_cand[self.candidates().indices] = True
+        else:
+            is_cand = self.candidates().any(axis=0)
 
         # If some world node does not serve as candidates to any tmplt node
         if ~is_cand.all():
@@ -425,11 +839,18 @@ class MatchingProblem:
 
             self.world, edge_is_cand = self.world.node_subgraph(is_cand, get_edge_is_cand=True)
             self.shape = (self.tmplt.n_nodes, self.world.n_nodes)
+            # Cached edgewise costs refer to the old world indices
+            self._edge_least_costs_cache = {}
+            self._clap_cache = {}
 
             # Update parameters based on new world
-            self.set_costs(local_costs=self.local_costs[:, is_cand])
-            self.set_costs(fixed_costs=self.fixed_costs[:, is_cand])
-            self.set_costs(global_costs=self.global_costs[:, is_cand])
+            if self.sparse_costs:
+                keep = np.ones(self._global_costs.nnz, dtype=np.bool_)
+                self._prune_sparse_costs(keep, world_is_kept=is_cand)
+            else:
+                self.set_costs(local_costs=self.local_costs[:, is_cand])
+                self.set_costs(fixed_costs=self.fixed_costs[:, is_cand])
+                self.set_costs(global_costs=self.global_costs[:, is_cand])
             from_local_bounds(self)
 
             if edge_is_cand is not None and self._edgewise_costs_cache is not None:
@@ -449,7 +870,7 @@ class MatchingProblem:
         """
         # TODO: this function needs to be updated
         num_valid_candidates = self._num_valid_candidates
-        self._num_valid_candidates = np.count_nonzero(self.candidates())
+        self._num_valid_candidates = np.sum(self.candidate_counts())
         return num_valid_candidates != self._num_valid_candidates
 
     def add_match(self, tmplt_idx, world_idx):
@@ -475,14 +896,35 @@ class MatchingProblem:
             Iterable of 2-tuples indicating pairs of template-world indexes
         """
         self.matching = matching
-        if self.match_fixed_costs:
+        if self.sparse_costs:
+            # Entries which violate the matching are infinite, so drop them.
+            self._prune_sparse_costs(~self.get_non_matching_mask())
+        elif self.match_fixed_costs:
             mask = self.get_non_matching_mask()
-            self.fixed_costs[mask] = float("inf")
+            self.set_cost_entries("fixed_costs", mask, float("inf"))
         self.assigned_tmplt_idxs = {tmplt_idx for tmplt_idx, cand_idx in self.matching}
 
     def get_non_matching_mask(self):
         """Gets a boolean mask for the costs array corresponding to all entries
-        that would violate the matching."""
+        that would violate the matching. With sparse costs, the mask has one
+        entry for each stored cost entry."""
+        if self.sparse_costs:
+            costs = self._global_costs
+            mask = np.zeros(costs.nnz, dtype=np.bool_)
+            if len(self.matching) > 0:
+                tmplt_idxs, world_idxs = np.array(self.matching).T
+                # Entries in matched rows off of the matched column
+                row_match = np.full(self.tmplt.n_nodes, -1)
+                row_match[tmplt_idxs] = world_idxs
+                entry_match = row_match[costs.rows]
+                mask |= (entry_match >= 0) & (entry_match != costs.indices)
+                # Entries in matched columns off of the matched row
+                order = np.argsort(world_idxs)
+                in_matched_col = np.isin(costs.indices, world_idxs)
+                col_owners = tmplt_idxs[order][np.searchsorted(
+                    world_idxs[order], costs.indices[in_matched_col])]
+                mask[in_matched_col] |= col_owners != costs.rows[in_matched_col]
+            return mask
         mask = np.zeros(self.fixed_costs.shape, dtype=np.bool)
         if len(self.matching) > 0:
             mask[[pair[0] for pair in self.matching],:] = True
@@ -500,4 +942,36 @@ class MatchingProblem:
         world_idx : int
             The index of the world node not to be matched.
         """
-        self.fixed_costs[tmplt_idx, world_idx] = float("inf")
+        if self.sparse_costs:
+            keep = np.ones(self._global_costs.nnz, dtype=np.bool_)
+            pos = self._global_costs.positions(tmplt_idx, [world_idx])[0]
+            if pos >= 0:
+                keep[pos] = False
+                self._prune_sparse_costs(keep)
+        else:
+            self.set_cost_entries("fixed_costs", (tmplt_idx, world_idx),
+                                  float("inf"))
+
+    def _prune_sparse_costs(self, keep, world_is_kept=None):
+        """Discard stored entries of the sparse cost matrices.
+
+        Parameters
+        ----------
+        keep : 1darray(bool)
+            Indicators of which stored entries to keep.
+        world_is_kept : 1darray(bool), optional
+            Indicators of which world nodes to keep. Columns of the other
+            world nodes are removed and the remaining columns renumbered.
+        """
+        if world_is_kept is not None:
+            keep = keep & world_is_kept[self._global_costs.indices]
+        if self.trail is not None:
+            for attr in COST_ATTRS:
+                self.trail.record_attr(self, attr)
+        global_costs = self._global_costs.select(keep, col_is_kept=world_is_kept)
+        self._fixed_costs = global_costs.with_data(
+            self._fixed_costs.data[keep], monotone=self._fixed_costs.monotone)
+        if self._local_costs is not None:
+            self._local_costs = global_costs.with_data(
+                self._local_costs.data[keep], monotone=self._local_costs.monotone)
+        self._global_costs = global_costs
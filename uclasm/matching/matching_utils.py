@@ -154,3 +154,38 @@ def feature_disagreements(tmplt_features, world_features):
             disagreements[tidx, widx] = disagreement
 
     return disagreements
+
+@numba.njit(parallel=True)
+def feature_disagreements_at(tmplt_features, world_features,
+                             tmplt_idxs, world_idxs):
+    """Compute feature disagreements for the given pairs of nodes only.
+
+    This is equivalent to indexing the output of `feature_disagreements` by
+    `tmplt_idxs` and `world_idxs`, without computing the full matrix.
+
+    Parameters
+    ----------
+    tmplt_features : 2darray
+        [n_tmplt_nodes, n_features] array of features for each template node.
+    world_features : 2darray
+        [n_world_nodes, n_features] array of features for each world node.
+    tmplt_idxs : 1darray
+        Template node index of each pair.
+    world_idxs : 1darray
+        World node index of each pair.
+
+    Returns
+    -------
+    1darray
+        Amount by which the template node's features exceed the world node's
+        features, summed across all of the features, for each pair.
+    """
+    n_pairs = len(tmplt_idxs)
+    disagreements = np.empty(n_pairs)
+    for pair_idx in numba.prange(n_pairs):
+        tnode_features = tmplt_features[tmplt_idxs[pair_idx], :]
+        wnode_features = world_features[world_idxs[pair_idx], :]
+        disagreement = np.maximum(tnode_features - wnode_features, 0).sum()
+        disagreements[pair_idx] = disagreement
+
+    return disagreements
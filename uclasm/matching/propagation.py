@@ -0,0 +1,148 @@
+"""Keep track of how effective each filter is while propagating bounds."""
+import time
+
+
+class FilterStats:
+    """Effectiveness of a single filter.
+
+    Attributes
+    ----------
+    n_runs : int
+        Number of times the filter was run.
+    n_skipped : int
+        Number of times the filter was skipped for not pruning.
+    n_eliminated : int
+        Total number of candidates eliminated by the filter.
+    seconds : float
+        Total time spent running the filter.
+    n_idle_runs : int
+        Number of runs since the filter last eliminated a candidate.
+    """
+
+    def __init__(self):
+        self.n_runs = 0
+        self.n_skipped = 0
+        self.n_eliminated = 0
+        self.seconds = 0.0
+        self.n_idle_runs = 0
+
+    def __str__(self):
+        return ("{} runs, {} skipped, {} candidates eliminated in {:.3f}s"
+                .format(self.n_runs, self.n_skipped, self.n_eliminated,
+                        self.seconds))
+
+
+class PropagationStats:
+    """Effectiveness of the filters run while propagating bounds.
+
+    Every filter run records how long it took and how many candidates it
+    eliminated. When `patience` is set, a filter which has run that many
+    times in a row without eliminating any candidates is skipped from then
+    on. Skipping a filter leaves the costs looser than they could be, but
+    every remaining bound is still valid. Pass the same stats to several
+    calls of `iterate_to_convergence`, such as those made by a search, to
+    learn which filters are worth running across all of them.
+
+    Examples
+    --------
+    >>> stats = PropagationStats(patience=3)
+    >>> iterate_to_convergence(smp, stats=stats)
+    >>> print(stats)
+
+    Parameters
+    ----------
+    patience : int, optional
+        Number of consecutive runs without pruning after which a filter is
+        skipped. Filters are never skipped by default.
+
+    Attributes
+    ----------
+    filters : dict(str, FilterStats)
+        Effectiveness of each filter by name, in the order they first ran.
+    patience : int or None
+        Number of consecutive runs without pruning after which a filter is
+        skipped.
+    """
+
+    def __init__(self, patience=None):
+        self.filters = {}
+        self.patience = patience
+
+    def __getitem__(self, name):
+        if name not in self.filters:
+            self.filters[name] = FilterStats()
+        return self.filters[name]
+
+    def should_run(self, name):
+        """Check whether a filter is still worth running, counting it as
+        skipped if not.
+
+        Parameters
+        ----------
+        name : str
+            Name of the filter.
+
+        Returns
+        -------
+        bool
+            False if the filter has gone `patience` runs without pruning.
+        """
+        stats = self[name]
+        if self.patience is not None and stats.n_idle_runs >= self.patience:
+            stats.n_skipped += 1
+            return False
+        return True
+
+    def run(self, name, smp, filter_fn, *args, cand_counts=None, **kwargs):
+        """Run a filter, recording its time and the candidates it eliminated.
+
+        Parameters
+        ----------
+        name : str
+            Name of the filter.
+        smp : MatchingProblem
+            Problem the filter is run on.
+        filter_fn : function
+            Called with `smp` followed by the remaining arguments.
+        cand_counts : 1darray, optional
+            Number of candidates of each template node before the filter, if
+            already known.
+
+        Returns
+        -------
+        1darray
+            Number of candidates of each template node after the filter.
+        """
+        if cand_counts is None:
+            cand_counts = smp.candidate_counts()
+        start_time = time.perf_counter()
+        filter_fn(smp, *args, **kwargs)
+        seconds = time.perf_counter() - start_time
+        new_cand_counts = smp.candidate_counts()
+        self.record(name, seconds, cand_counts.sum() - new_cand_counts.sum())
+        return new_cand_counts
+
+    def record(self, name, seconds, n_eliminated):
+        """Record a run of a filter.
+
+        Parameters
+        ----------
+        name : str
+            Name of the filter.
+        seconds : float
+            Time spent running the filter.
+        n_eliminated : int
+            Number of candidates the filter eliminated.
+        """
+        stats = self[name]
+        stats.n_runs += 1
+        stats.seconds += seconds
+        stats.n_eliminated += int(n_eliminated)
+        if n_eliminated > 0:
+            stats.n_idle_runs = 0
+        else:
+            stats.n_idle_runs += 1
+
+    def __str__(self):
+        return "\n".join("{}: {}".format(name, stats)
+                         for name, stats in self.filters.items())
@@ -1,3 +1,8 @@
 """Provide functions for searching for solutions."""
 
 from .greedy_best_k_matching import greedy_best_k_matching, greedy_best_k_matching_recursive
+from .greedy_best_k_matching import iter_best_k_matching, iter_best_k_matching_recursive
+from .frontier import Frontier, BoundedFrontier, SpillingFrontier, StackFrontier
+from .search_utils import SearchResult
+from .budget import SearchBudget
+from .checkpoint import Checkpointer, save_checkpoint, load_checkpoint
@@ -0,0 +1,88 @@
+"""Provide budgets on the time, states and memory used by a search."""
+import os
+import time
+
+
+def memory_in_use():
+    """Get the resident memory of the current process in bytes.
+
+    Read from /proc where it exists. Elsewhere, the peak resident memory is
+    used instead, which never decreases.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            n_pages = int(f.read().split()[1])
+        return n_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        import resource
+        # ru_maxrss is in kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class SearchBudget:
+    """Limits on the resources a single search may use.
+
+    A search starts the budget when it begins, counts every state it
+    expands, and stops once any limit is reached. It then returns what it
+    found so far along with the states left to expand, from which it can be
+    resumed. Once exhausted, a budget stays exhausted until it is started
+    again, so every level of a recursive search stops.
+
+    Examples
+    --------
+    >>> budget = SearchBudget(max_seconds=60, max_memory=4 * 2**30)
+    >>> solutions = greedy_best_k_matching(smp, k=10, budget=budget)
+    >>> if not solutions.complete:
+    ...     solutions = greedy_best_k_matching(smp, k=10, resume=solutions)
+
+    Parameters
+    ----------
+    max_seconds : float, optional
+        Largest wall-clock time in seconds.
+    max_states : int, optional
+        Largest number of states to expand.
+    max_memory : int, optional
+        Largest resident memory of the process in bytes.
+
+    Attributes
+    ----------
+    n_states : int
+        Number of states expanded since the budget was started.
+    exhausted_by : str or None
+        Which limit was reached first, among "time", "states" and "memory",
+        or None if none was.
+    """
+
+    def __init__(self, max_seconds=None, max_states=None, max_memory=None):
+        self.max_seconds = max_seconds
+        self.max_states = max_states
+        self.max_memory = max_memory
+        self.start()
+
+    def start(self):
+        """Start counting from zero."""
+        self.start_time = time.monotonic()
+        self.n_states = 0
+        self.exhausted_by = None
+
+    def expand(self):
+        """Count a state expanded by the search."""
+        self.n_states += 1
+
+    def elapsed(self):
+        """Get the number of seconds since the budget was started."""
+        return time.monotonic() - self.start_time
+
+    def is_exhausted(self):
+        """Check whether any limit has been reached."""
+        if self.exhausted_by is None:
+            if self.max_seconds is not None and \
+                    self.elapsed() >= self.max_seconds:
+                self.exhausted_by = "time"
+            elif self.max_states is not None and \
+                    self.n_states >= self.max_states:
+                self.exhausted_by = "states"
+            elif self.max_memory is not None and \
+                    memory_in_use() >= self.max_memory:
+                self.exhausted_by = "memory"
+        return self.exhausted_by is not None
@@ -0,0 +1,321 @@
+"""Provide checkpoints from which long searches can be resumed.
+
+A checkpoint is a directory of .npy files, so that the cost matrices, which
+take most of the space, are memory-mapped rather than read when the search
+is resumed. The matchings of the states are packed into flat integer arrays
+rather than pickled one state at a time.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from .frontier import Frontier, StackFrontier
+from .search_utils import State, SearchResult
+from ..cost_cache import hash_table
+from ..sparse_costs import SparseCostMatrix
+
+# Name of the file holding the name of the latest checkpoint of a directory
+LATEST_FILE = "LATEST"
+
+COST_NAMES = ("fixed_costs", "local_costs", "global_costs")
+
+
+class Checkpointer:
+    """Write checkpoints of a search to a directory at regular intervals.
+
+    The search asks whether a checkpoint is due about once per state it
+    expands, and saves one when it is, as well as when it runs out of
+    budget. Each checkpoint replaces the previous one only once it has been
+    written in full, so a search killed while saving can be resumed from
+    the previous checkpoint.
+
+    Examples
+    --------
+    >>> checkpointer = Checkpointer("search_ckpt", interval_seconds=600)
+    >>> solutions = greedy_best_k_matching(smp, k=10, checkpoint=checkpointer)
+
+    After the job is killed, the search is resumed with
+
+    >>> resume = load_checkpoint("search_ckpt", smp)
+    >>> solutions = greedy_best_k_matching(smp, k=10, resume=resume,
+    ...                                    checkpoint=checkpointer)
+
+    Parameters
+    ----------
+    path : str
+        Directory in which to write the checkpoints.
+    interval_seconds : float, optional
+        Smallest number of seconds between checkpoints.
+    interval_states : int, optional
+        Smallest number of states expanded between checkpoints.
+
+    Attributes
+    ----------
+    n_saved : int
+        Number of checkpoints saved since the checkpointer was started.
+    """
+
+    def __init__(self, path, interval_seconds=None, interval_states=None):
+        self.path = path
+        self.interval_seconds = interval_seconds
+        self.interval_states = interval_states
+        self.start()
+
+    def start(self):
+        """Start counting the interval to the next checkpoint."""
+        self.n_saved = 0
+        self._reset()
+
+    def _reset(self):
+        self._last_time = time.monotonic()
+        self._n_states = 0
+
+    def is_due(self):
+        """Count a state expanded by the search and check whether the next
+        checkpoint is due."""
+        self._n_states += 1
+        if self.interval_states is not None and \
+                self._n_states >= self.interval_states:
+            return True
+        return self.interval_seconds is not None and \
+            time.monotonic() - self._last_time >= self.interval_seconds
+
+    def save(self, smp, result):
+        """Save a checkpoint and start counting the next interval."""
+        save_checkpoint(self.path, smp, result)
+        self.n_saved += 1
+        self._reset()
+
+
+def pack_states(states):
+    """Pack the matchings and costs of states into flat arrays.
+
+    Parameters
+    ----------
+    states : list
+        States of a search.
+
+    Returns
+    -------
+    (1darray, 2darray, 1darray)
+        Where the pairs of each state start and end, the template and world
+        index of each pair, and the cost of each state.
+    """
+    matchings = [state.matching for state in states]
+    indptr, pairs = pack_matchings(matchings)
+    costs = np.array([float(state.cost) for state in states], dtype=float)
+    return indptr, pairs, costs
+
+
+def pack_matchings(matchings):
+    """Pack matchings into the first two arrays returned by `pack_states`."""
+    indptr = np.zeros(len(matchings) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(matching) for matching in matchings])
+    pairs = np.array([pair for matching in matchings for pair in matching],
+                     dtype=np.int64).reshape(-1, 2)
+    return indptr, pairs
+
+
+def unpack_matchings(indptr, pairs):
+    """Get the matchings packed by `pack_matchings`."""
+    pairs = [(int(tmplt_idx), int(world_idx))
+             for tmplt_idx, world_idx in pairs]
+    return [tuple(pairs[start:end])
+            for start, end in zip(indptr[:-1], indptr[1:])]
+
+
+def unpack_states(indptr, pairs, costs):
+    """Get the states packed by `pack_states`."""
+    states = []
+    for matching, cost in zip(unpack_matchings(indptr, pairs), costs):
+        state = State()
+        state.matching = matching
+        state.cost = float(cost)
+        states.append(state)
+    return states
+
+
+def save_checkpoint(path, smp, result):
+    """Save the state of a search to a directory.
+
+    Parameters
+    ----------
+    path : str
+        Directory in which to write the checkpoint. Earlier checkpoints in it
+        are removed once this one is complete.
+    smp : MatchingProblem
+        The problem being searched, whose costs and thresholds are saved.
+    result : SearchResult
+        The solutions found so far and the frontier of states left to
+        expand, as returned by a search which ran out of budget.
+    """
+    os.makedirs(path, exist_ok=True)
+    latest = _read_latest(path)
+    seq = 0 if latest is None else int(latest.rsplit("-", 1)[1]) + 1
+    name = "checkpoint-{}".format(seq)
+    ckpt_dir = os.path.join(path, name)
+    if os.path.exists(ckpt_dir):
+        # Left behind by a save which did not complete
+        shutil.rmtree(ckpt_dir)
+    os.makedirs(ckpt_dir)
+
+    def save_array(name, array):
+        np.save(os.path.join(ckpt_dir, name + ".npy"), np.asarray(array))
+
+    for cost_name in COST_NAMES:
+        costs = getattr(smp, cost_name)
+        if costs is None:
+            continue
+        if smp.sparse_costs:
+            save_array(cost_name + "_indptr", costs.indptr)
+            save_array(cost_name + "_indices", costs.indices)
+            save_array(cost_name + "_data", costs.data)
+        else:
+            save_array(cost_name, costs)
+
+    frontier = result.frontier
+    for prefix, states in [("solutions", list(result)),
+                           ("frontier", frontier.states())]:
+        for suffix, array in zip(["_indptr", "_pairs", "_costs"],
+                                 pack_states(states)):
+            save_array(prefix + suffix, array)
+    # Every state reached, which the frontier will not push again
+    for suffix, array in zip(["_indptr", "_pairs"],
+                             pack_matchings(frontier.seen_matchings())):
+        save_array("seen" + suffix, array)
+
+    meta = {
+        "shape": list(smp.shape),
+        "fingerprint": problem_fingerprint(smp),
+        "sparse_costs": bool(smp.sparse_costs),
+        "costs": [cost_name for cost_name in COST_NAMES
+                  if getattr(smp, cost_name) is not None],
+        "local_cost_threshold": float(smp.local_cost_threshold),
+        "global_cost_threshold": float(smp.global_cost_threshold),
+        "strict_threshold": bool(smp.strict_threshold),
+        "kth_cost": float(result.kth_cost),
+        "stack": isinstance(frontier, StackFrontier),
+    }
+    with open(os.path.join(ckpt_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    # Switch to the new checkpoint only once it is complete
+    tmp_path = os.path.join(path, LATEST_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        f.write(name)
+    os.replace(tmp_path, os.path.join(path, LATEST_FILE))
+    if latest is not None:
+        shutil.rmtree(os.path.join(path, latest), ignore_errors=True)
+
+
+def load_checkpoint(path, smp, frontier=None):
+    """Restore the state of a search from a directory.
+
+    The cost matrices of `smp` are replaced by memory-mapped copies of the
+    saved ones, which are only read from disk as they are used and never
+    written back. The thresholds of `smp` are restored as well.
+
+    Parameters
+    ----------
+    path : str
+        Directory written by `save_checkpoint` or a `Checkpointer`.
+    smp : MatchingProblem
+        The problem which was being searched, with the same template, world
+        and cost functions.
+    frontier : Frontier, optional
+        Empty frontier of the kind used by the search, into which to push the
+        saved states. A `Frontier`, or a `StackFrontier` for recursive
+        searches, by default.
+
+    Returns
+    -------
+    SearchResult
+        The solutions found and states left to expand when the checkpoint was
+        saved, to pass as `resume` to the search.
+    """
+    latest = _read_latest(path)
+    if latest is None:
+        raise FileNotFoundError("No checkpoint in {}".format(path))
+    ckpt_dir = os.path.join(path, latest)
+    with open(os.path.join(ckpt_dir, "meta.json")) as f:
+        meta = json.load(f)
+    if tuple(meta["shape"]) != tuple(smp.shape) or \
+            meta["sparse_costs"] != bool(smp.sparse_costs) or \
+            meta["fingerprint"] != problem_fingerprint(smp):
+        raise ValueError("The checkpoint was saved for a different problem.")
+
+    def load_array(name, mmap_mode=None):
+        return np.load(os.path.join(ckpt_dir, name + ".npy"),
+                       mmap_mode=mmap_mode)
+
+    costs = {}
+    for cost_name in meta["costs"]:
+        if smp.sparse_costs:
+            costs[cost_name] = SparseCostMatrix(
+                load_array(cost_name + "_indptr"),
+                load_array(cost_name + "_indices"),
+                load_array(cost_name + "_data", mmap_mode="c"),
+                meta["shape"])
+        else:
+            # Copy on write, so that the search never modifies the file
+            costs[cost_name] = load_array(cost_name, mmap_mode="c")
+    smp.set_costs(**costs)
+    if "local_costs" not in costs:
+        smp._local_costs = None
+    smp.local_cost_threshold = meta["local_cost_threshold"]
+    smp.global_cost_threshold = meta["global_cost_threshold"]
+    smp.strict_threshold = meta["strict_threshold"]
+
+    if frontier is None:
+        frontier = StackFrontier() if meta["stack"] else Frontier()
+    # States are pushed in the order they were held in, which rebuilds the
+    # same heap or stack
+    for state in unpack_states(load_array("frontier_indptr"),
+                               load_array("frontier_pairs"),
+                               load_array("frontier_costs")):
+        frontier.push(state)
+    frontier.mark_seen(unpack_matchings(load_array("seen_indptr"),
+                                        load_array("seen_pairs")))
+    solutions = unpack_states(load_array("solutions_indptr"),
+                              load_array("solutions_pairs"),
+                              load_array("solutions_costs"))
+    return SearchResult(solutions, exact=False, complete=False,
+                        lower_bound=frontier.lower_bound(), frontier=frontier,
+                        kth_cost=meta["kth_cost"])
+
+
+def problem_fingerprint(smp):
+    """Hash the template and world nodes and the channels of a problem.
+
+    Parameters
+    ----------
+    smp : MatchingProblem
+        A subgraph matching problem.
+
+    Returns
+    -------
+    str
+        Hex digest which differs between problems whose cost matrices do not
+        line up, such as problems with different templates or differently
+        reduced worlds.
+    """
+    parts = [hash_table([smp.tmplt.node_col],
+                        np.asarray(smp.tmplt.nodes)[:, None]),
+             hash_table([smp.world.node_col],
+                        np.asarray(smp.world.nodes)[:, None]),
+             list(map(str, smp.tmplt.channels)),
+             list(map(int, smp.shape))]
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+def _read_latest(path):
+    """Get the name of the latest checkpoint in a directory, if any."""
+    try:
+        with open(os.path.join(path, LATEST_FILE)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
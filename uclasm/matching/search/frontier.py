@@ -0,0 +1,382 @@
+"""Provide frontiers of open states for best-first search, with optional
+bounds on the memory they use, and a stack of open states for depth-first
+search."""
+import os
+import pickle
+import tempfile
+from heapq import heappush, heappop, heapify
+
+
+class Frontier:
+    """An unbounded frontier of the states left to expand.
+
+    States are expanded best first, in the order defined by `State`. Every
+    state which has been pushed is remembered, so that a state reached along
+    several paths is only expanded once. Nothing is ever forgotten, so the
+    search is exact, but the memory used grows with the number of states
+    reached.
+
+    Attributes
+    ----------
+    n_forgotten : int
+        Number of states dropped from the frontier without being expanded.
+    forgotten_cost : float
+        Smallest cost of any state dropped without being expanded. Solutions
+        can only have been missed below a forgotten state, so the search is
+        exact when this is no smaller than the cost of the kth solution.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._seen = set()
+        self.n_forgotten = 0
+        self.forgotten_cost = float("inf")
+        # Open states by cost, removed lazily
+        self._cost_heap = []
+        self._cost_entries = {}
+        self._cost_seq = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, state):
+        """Add a state to expand later."""
+        self._seen.add(state.matching)
+        self._track(state)
+        heappush(self._heap, state)
+
+    def pop(self):
+        """Remove and return the best state."""
+        state = heappop(self._heap)
+        self._untrack(state)
+        return state
+
+    def lower_bound(self):
+        """Get the smallest cost of any open state.
+
+        Every solution the search has yet to find lies below some open
+        state, so none of them can cost less than this.
+
+        Returns
+        -------
+        float
+            The smallest cost, or inf if there are no open states.
+        """
+        while self._cost_heap and not self._cost_heap[0][2]:
+            heappop(self._cost_heap)
+        if not self._cost_heap:
+            return float("inf")
+        return self._cost_heap[0][0]
+
+    def _track(self, state):
+        """Start tracking the cost of an open state."""
+        entry = [float(state.cost), self._cost_seq, True]
+        self._cost_seq += 1
+        self._cost_entries[id(state)] = entry
+        heappush(self._cost_heap, entry)
+        if len(self._cost_heap) > 2 * len(self._cost_entries) + 16:
+            self._cost_heap = [entry for entry in self._cost_heap
+                               if entry[2]]
+            heapify(self._cost_heap)
+
+    def _untrack(self, state):
+        """Stop tracking the cost of a state which is no longer open."""
+        self._cost_entries.pop(id(state))[2] = False
+
+    def has_seen(self, matching):
+        """Check whether a matching has already been reached."""
+        return matching in self._seen
+
+    def seen_matchings(self):
+        """Get the matchings which the frontier remembers having reached.
+
+        These are the matchings which `has_seen` reports, which frontiers
+        that forget states may limit to those of their open states.
+        """
+        return list(self._seen)
+
+    def mark_seen(self, matchings):
+        """Remember that matchings have been reached, as when restoring the
+        frontier of an earlier search."""
+        self._seen.update(matchings)
+
+    def forget(self, state):
+        """Record that a state was dropped without being expanded."""
+        self.n_forgotten += 1
+        self.forgotten_cost = min(self.forgotten_cost, state.cost)
+
+    def is_exact(self, kth_cost, cost_threshold=float("inf")):
+        """Check whether no better solution can have been forgotten.
+
+        Parameters
+        ----------
+        kth_cost : float
+            Cost of the kth best solution found, which other solutions must
+            beat. Infinite if fewer than k solutions were found.
+        cost_threshold : float
+            Largest cost allowed for a solution.
+
+        Returns
+        -------
+        bool
+            True if no forgotten state can lead to a solution costing less
+            than `kth_cost` and no more than `cost_threshold`.
+        """
+        return self.forgotten_cost >= kth_cost or \
+            self.forgotten_cost > cost_threshold
+
+    def states(self):
+        """Get the states left to expand, in no particular order."""
+        return list(self._heap)
+
+
+class StackFrontier(Frontier):
+    """A frontier expanding the last state pushed first.
+
+    Holds the states left on the stack of a depth first search, pushed from
+    the shallowest to the deepest and from the worst to the best, so that
+    resuming the search expands them in the order it would have.
+    """
+
+    def push(self, state):
+        self._seen.add(state.matching)
+        self._track(state)
+        self._heap.append(state)
+
+    def pop(self):
+        state = self._heap.pop()
+        self._untrack(state)
+        return state
+
+
+def _order_key(state):
+    """Sort key of a state, smaller for better states as in `State`."""
+    return (-len(state.matching), state.cost)
+
+
+def _forget_key(state):
+    """Sort key of a state, larger for states to forget first.
+
+    As in SMA*, the most costly state is forgotten first, and the shallowest
+    among those tied on cost. Forgetting by the search order instead would
+    drop cheap states near the root before costly deep ones.
+    """
+    return (state.cost, -len(state.matching))
+
+
+class _Entry:
+    """A state in a BoundedFrontier, which may be removed from the heaps
+    holding it without searching them."""
+    __slots__ = ["key", "forget_key", "seq", "state", "alive"]
+
+    def __init__(self, state, seq):
+        self.key = _order_key(state)
+        self.forget_key = _forget_key(state)
+        self.seq = seq
+        self.state = state
+        self.alive = True
+
+    def __lt__(self, other):
+        return (self.key, self.seq) < (other.key, other.seq)
+
+
+class _WorstFirst:
+    """Wrap an entry so that heaps pop the entry to forget first."""
+    __slots__ = ["entry"]
+
+    def __init__(self, entry):
+        self.entry = entry
+
+    def __lt__(self, other):
+        return (other.entry.forget_key, other.entry.seq) < \
+            (self.entry.forget_key, self.entry.seq)
+
+
+class BoundedFrontier(Frontier):
+    """A frontier holding at most a fixed number of states.
+
+    When the frontier is full, the most costly state is forgotten to make
+    room, as in SMA*. With a beam width, each depth of the search, measured
+    by the number of matched template nodes, keeps only its cheapest states,
+    as in beam search. Only the matchings of the states currently open are
+    remembered, so a state reached again after it was expanded may be
+    expanded twice, and the search must discard repeated solutions.
+
+    Either bound can make the search miss solutions, which `is_exact`
+    reports. Forgotten states are not regenerated.
+
+    Parameters
+    ----------
+    max_states : int, optional
+        Largest number of open states.
+    beam_width : int, optional
+        Largest number of open states with the same number of matches.
+    """
+
+    def __init__(self, max_states=None, beam_width=None):
+        super().__init__()
+        self.max_states = max_states
+        self.beam_width = beam_width
+        self._worst = []
+        self._depth_worst = {}
+        self._depth_counts = {}
+        self._n_alive = 0
+        self._seq = 0
+
+    def __len__(self):
+        return self._n_alive
+
+    def push(self, state):
+        entry = _Entry(state, self._seq)
+        self._seq += 1
+        self._seen.add(state.matching)
+        self._track(state)
+        heappush(self._heap, entry)
+        self._n_alive += 1
+        depth = len(state.matching)
+        self._depth_counts[depth] = self._depth_counts.get(depth, 0) + 1
+        if self.max_states is not None:
+            heappush(self._worst, _WorstFirst(entry))
+            while self._n_alive > self.max_states:
+                self._forget_worst(self._worst)
+        if self.beam_width is not None:
+            depth_worst = self._depth_worst.setdefault(depth, [])
+            heappush(depth_worst, _WorstFirst(entry))
+            while self._depth_counts[depth] > self.beam_width:
+                self._forget_worst(depth_worst)
+        self._compact()
+
+    def pop(self):
+        while True:
+            entry = heappop(self._heap)
+            if entry.alive:
+                self._remove(entry)
+                return entry.state
+
+    def states(self):
+        return [entry.state for entry in self._heap if entry.alive]
+
+    def _remove(self, entry):
+        """Mark an entry as removed from every heap."""
+        entry.alive = False
+        self._n_alive -= 1
+        self._depth_counts[len(entry.state.matching)] -= 1
+        self._seen.discard(entry.state.matching)
+        self._untrack(entry.state)
+
+    def _forget_worst(self, worst_heap):
+        """Forget the most costly open state of a worst-first heap."""
+        while True:
+            entry = heappop(worst_heap).entry
+            if entry.alive:
+                self._remove(entry)
+                self.forget(entry.state)
+                return
+
+    def _compact(self):
+        """Drop removed entries once they make up most of a heap."""
+        if len(self._heap) > 2 * self._n_alive + 16:
+            self._heap = [entry for entry in self._heap if entry.alive]
+            heapify(self._heap)
+        if len(self._worst) > 2 * self._n_alive + 16:
+            self._worst = [item for item in self._worst if item.entry.alive]
+            heapify(self._worst)
+        for depth, depth_worst in self._depth_worst.items():
+            if len(depth_worst) > 2 * self._depth_counts[depth] + 16:
+                depth_worst[:] = [item for item in depth_worst
+                                  if item.entry.alive]
+                heapify(depth_worst)
+
+
+class SpillingFrontier(Frontier):
+    """A frontier which keeps a fixed number of states in memory and spills
+    the rest to disk.
+
+    When the frontier is full, its worse half is written to a file as a
+    sorted run. A run is read back once its best state is better than every
+    state in memory. No state is lost, so the search stays exact, at the cost
+    of disk space and of reading and writing the spilled states. Only the
+    matchings of the states in memory are remembered, so the search must
+    discard repeated solutions.
+
+    Parameters
+    ----------
+    max_states : int
+        Largest number of open states kept in memory.
+    spill_dir : str, optional
+        Directory in which to write the spilled states. A temporary
+        directory by default.
+    """
+
+    def __init__(self, max_states, spill_dir=None):
+        super().__init__()
+        self.max_states = max(max_states, 2)
+        self.spill_dir = spill_dir
+        # Path, best state and smallest cost of each spilled run
+        self._runs = []
+        self._n_spilled = 0
+        self._tmp_dir = None
+
+    def __len__(self):
+        return len(self._heap) + self._n_spilled
+
+    def push(self, state):
+        super().push(state)
+        if len(self._heap) > self.max_states:
+            self._spill()
+
+    def pop(self):
+        best_run = min(range(len(self._runs)),
+                       key=lambda run_idx: self._runs[run_idx][1],
+                       default=None)
+        if best_run is not None and (len(self._heap) == 0 or
+                                     self._runs[best_run][1] < self._heap[0]):
+            self._load(best_run)
+        state = super().pop()
+        # Only the matchings of the states in memory are remembered
+        self._seen.discard(state.matching)
+        return state
+
+    def lower_bound(self):
+        return min([super().lower_bound()] +
+                   [min_cost for _, _, min_cost in self._runs])
+
+    def states(self):
+        states = list(self._heap)
+        for path, _, _ in self._runs:
+            with open(path, "rb") as f:
+                states.extend(pickle.load(f))
+        return states
+
+    def _spill(self):
+        """Write the worse half of the states in memory to disk."""
+        self._heap.sort()
+        n_kept = len(self._heap) // 2
+        run = self._heap[n_kept:]
+        del self._heap[n_kept:]
+        for state in run:
+            self._seen.discard(state.matching)
+            self._untrack(state)
+        if self.spill_dir is None and self._tmp_dir is None:
+            self._tmp_dir = tempfile.TemporaryDirectory()
+        spill_dir = self.spill_dir or self._tmp_dir.name
+        fd, path = tempfile.mkstemp(suffix=".pkl", dir=spill_dir)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(run, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._runs.append((path, run[0],
+                           min(float(state.cost) for state in run)))
+        self._n_spilled += len(run)
+
+    def _load(self, run_idx):
+        """Read a spilled run back into memory."""
+        path, _, _ = self._runs.pop(run_idx)
+        with open(path, "rb") as f:
+            run = pickle.load(f)
+        os.remove(path)
+        self._n_spilled -= len(run)
+        for state in run:
+            self._seen.add(state.matching)
+            self._track(state)
+            heappush(self._heap, state)
+        if len(self._heap) > self.max_states:
+            self._spill()
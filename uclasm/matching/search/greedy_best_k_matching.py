@@ -4,17 +4,29 @@ total costs."""
 import numpy as np
 import bisect
 import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 from .search_utils import *
+from .frontier import Frontier, StackFrontier
 from ..global_cost_bound import *
 from ..local_cost_bound import *
 from ..matching_problem import MatchingProblem
+from ...shared_graph import publish_graph, attach_graph
 from ...utils import one_hot
-from heapq import heappush, heappop, heapify
+from heapq import heapify
 
 def greedy_best_k_matching(smp, k=1, nodewise=True, edgewise=True,
-                           verbose=False):
+                           verbose=False, frontier=None, budget=None,
+                           resume=None, checkpoint=None):
     """Greedy search on the cost heuristic to find the best k matchings.
+
+    The open states are kept in `frontier`. By default every state reached is
+    kept, which can take a lot of memory on large templates. A
+    `BoundedFrontier` caps the number of open states, forgetting the worst
+    ones or keeping a beam of the best states at each depth, and a
+    `SpillingFrontier` writes the states beyond its cap to disk.
+
     Parameters
     ----------
     smp: MatchingProblem
@@ -27,71 +39,169 @@ def greedy_best_k_matching(smp, k=1, nodewise=True, edgewise=True,
         Whether to use the nodewise cost bound.
     edgewise: bool
         Whether to use the edgewise cost bound.
+    frontier: Frontier, optional
+        Holds the states still left to be processed. An unbounded `Frontier`
+        by default. Resumed searches continue with the frontier of `resume`
+        instead; pass the frontier to `load_checkpoint` to choose its kind.
+    budget: SearchBudget, optional
+        Limits on the time, expanded states and memory of the search. Once
+        one is reached, the search stops and returns what it found so far.
+    resume: SearchResult, optional
+        The result of an earlier search on the same problem which ran out of
+        budget. The search continues from its solutions and frontier.
+        Checkpoints loaded by `load_checkpoint` are resumed the same way.
+    checkpoint: Checkpointer, optional
+        Writes the state of the search to disk at regular intervals, and
+        when the budget runs out.
+
+    Returns
+    -------
+    SearchResult
+        The solution states. Its `exact` attribute tells whether they are
+        guaranteed to be the best k, which fails when the frontier forgot
+        some state or the budget ran out. In the latter case, `complete` is
+        False, `lower_bound` bounds the cost of the solutions left to find
+        and `frontier` holds the states left to expand.
+    """
+    return run_to_end(_greedy_best_k_search(
+        smp, k=k, nodewise=nodewise, edgewise=edgewise, verbose=verbose,
+        frontier=frontier, stream=False, budget=budget, resume=resume,
+        checkpoint=checkpoint))
+
+def iter_best_k_matching(smp, k=1, nodewise=True, edgewise=True,
+                         verbose=False, frontier=None, mapping=False):
+    """Yield the best k matchings found by `greedy_best_k_matching` as soon
+    as they are proven.
+
+    A solution is proven once every open state costs more than it. The cost
+    of a state bounds the costs of the solutions below it, so no solution
+    found later can then displace it from the best k. The remaining
+    solutions are yielded when the search ends. With k <= 0 every solution
+    within the threshold is yielded as soon as it is found, without being
+    kept in memory.
+
+    Parameters
+    ----------
+    smp: MatchingProblem
+        A subgraph matching problem.
+    k: int
+        The maximum number of solutions to find.
+    nodewise: bool
+        Whether to use the nodewise cost bound.
+    edgewise: bool
+        Whether to use the edgewise cost bound.
+    frontier: Frontier, optional
+        Holds the states still left to be processed.
+    mapping: bool
+        Whether to yield dicts from template nodes to world nodes instead of
+        states.
+
+    Yields
+    ------
+    State or dict
+        Each solution, in order of increasing cost when k > 0.
     """
+    for solution in _greedy_best_k_search(
+            smp, k=k, nodewise=nodewise, edgewise=edgewise, verbose=verbose,
+            frontier=frontier, stream=True):
+        yield node_mapping(smp, solution) if mapping else solution
+
+def _greedy_best_k_search(smp, *, k, nodewise, edgewise, verbose, frontier,
+                          stream, budget=None, resume=None,
+                          checkpoint=None):
+    """Run the greedy search, yielding solutions once proven if `stream`,
+    and return the SearchResult."""
     if smp.global_cost_threshold == float("inf"):
         raise Exception("Invalid global cost threshold.")
+    if resume is not None and frontier is not None:
+        raise ValueError("A resumed search continues with the frontier of "
+                         "`resume` and can not take another frontier.")
+    if budget is not None:
+        budget.start()
+    if checkpoint is not None:
+        checkpoint.start()
 
-    # States still left to be processed
-    open_list = []
-    # States which have already been processed
-    closed_list = []
-    # Map from states to computed costs
-    cost_map = {}
-    # States where all nodes have been assigned
-    solutions = []
+    # Matchings of the solutions already yielded
+    yielded = set()
 
-    # Map from template indexes to world indexes
-    current_matching = {}
+    if resume is not None:
+        # States still left to be processed
+        frontier = resume.frontier
+        # States where all nodes have been assigned
+        solutions = list(resume)
+        # Cost of the kth solution
+        kth_cost = resume.kth_cost
+    else:
+        # States still left to be processed
+        if frontier is None:
+            frontier = Frontier()
+        # States where all nodes have been assigned
+        solutions = []
+        # Cost of the kth solution
+        kth_cost = float("inf")
 
-    # Initialize matching with known matches
-    candidates = smp.candidates()
-    for i in range(smp.tmplt.n_nodes):
-        if np.sum(candidates[i]) == 1:
-            current_matching[i] = np.argwhere(candidates[i])[0][0]
+        # Map from template indexes to world indexes
+        current_matching = {}
 
-    start_state = State()
-    start_state.matching = tuple_from_dict(current_matching)
-    start_state.cost = smp.global_costs.min()
-    cost_map[start_state.matching] = start_state.cost
+        # Initialize matching with known matches
+        cand_counts = smp.candidate_counts()
+        for i in range(smp.tmplt.n_nodes):
+            if cand_counts[i] == 1:
+                current_matching[i] = smp.candidate_idxs(i)[0]
 
-    # Handle the case where we start in a solved state
-    if len(start_state.matching) == smp.tmplt.n_nodes:
-        solutions.append(start_state)
-        return solutions
+        start_state = State()
+        start_state.matching = tuple_from_dict(current_matching)
+        start_state.cost = smp.global_costs.min()
 
-    heappush(open_list, start_state)
+        # Handle the case where we start in a solved state
+        if len(start_state.matching) == smp.tmplt.n_nodes:
+            solutions.append(start_state)
+            if stream:
+                yield start_state
+            return SearchResult(solutions, frontier=frontier)
 
-    # Cost of the kth solution
-    kth_cost = float("inf")
+        frontier.push(start_state)
+
+    # Bounded frontiers may reach a solution more than once
+    solution_matchings = {solution.matching for solution in solutions}
 
-    while len(open_list) > 0:
-        current_state = heappop(open_list)
+    while len(frontier) > 0:
+        if checkpoint is not None and checkpoint.is_due():
+            checkpoint.save(smp, _partial_result(solutions, frontier,
+                                                 kth_cost))
+        if budget is not None and budget.is_exhausted():
+            if verbose:
+                print("Out of {} budget with {} open states".format(
+                    budget.exhausted_by, len(frontier)))
+            break
+        current_state = frontier.pop()
         # Ignore states whose cost is too high
         if current_state.cost > smp.global_cost_threshold or current_state.cost >= kth_cost:
             # Only print multiples of 10000 for skipped states
-            if verbose and len(open_list) % 10000 == 0:
+            if verbose and len(frontier) % 10000 == 0:
                 print("Skipped state: {} matches".format(len(current_state.matching)),
-                      "{} open states".format(len(open_list)), "current_cost:", current_state.cost,
+                      "{} open states".format(len(frontier)), "current_cost:", current_state.cost,
                       "kth cost:", kth_cost, "max cost", smp.global_cost_threshold, "solutions found:", len(solutions))
             continue
+        if budget is not None:
+            budget.expand()
         if verbose:
             print("Current state: {} matches".format(len(current_state.matching)),
-                  "{} open states".format(len(open_list)), "current_cost:", current_state.cost,
+                  "{} open states".format(len(frontier)), "current_cost:", current_state.cost,
                   "kth cost:", kth_cost, "max cost", smp.global_cost_threshold, "solutions found:", len(solutions))
 
-        curr_smp = smp.copy()
+        curr_smp = smp.copy(copy_graphs=False, share_costs=True)
         curr_smp.enforce_matching(current_state.matching)
         # Do not reduce world as it can mess up the world indices in the matching
         iterate_to_convergence(curr_smp, reduce_world=False, nodewise=nodewise,
                                edgewise=edgewise)
         matching_dict = dict_from_tuple(current_state.matching)
-        candidates = curr_smp.candidates()
         # Identify template node with the least number of candidates
-        cand_counts = np.sum(candidates, axis=1)
+        cand_counts = curr_smp.candidate_counts()
         # Prevent previously matched template idxs from being chosen
         cand_counts[list(matching_dict)] = np.max(cand_counts) + 1
         tmplt_idx = np.argmin(cand_counts)
-        cand_idxs = np.argwhere(candidates[tmplt_idx]).flatten()
+        cand_idxs = curr_smp.candidate_idxs(tmplt_idx)
         if verbose:
             print("Choosing candidate for", tmplt_idx,
                   "with {} possibilities".format(len(cand_idxs)))
@@ -101,14 +211,25 @@ def greedy_best_k_matching(smp, k=1, nodewise=True, edgewise=True,
             new_matching = matching_dict.copy()
             new_matching[tmplt_idx] = cand_idx
             new_matching_tuple = tuple_from_dict(new_matching)
-            if new_matching_tuple not in cost_map:
+            if not frontier.has_seen(new_matching_tuple) and \
+                    new_matching_tuple not in solution_matchings:
                 new_state = State()
                 new_state.matching = new_matching_tuple
-                new_state.cost = smp.global_costs[tmplt_idx, cand_idx]
+                # Every matching below the state contains all of its pairs,
+                # so it costs at least the bound of each of them. Taking the
+                # max keeps costs from decreasing along a path, so that the
+                # open states bound the solutions left to find.
+                new_state.cost = max(current_state.cost,
+                                     smp.global_costs[tmplt_idx, cand_idx])
                 if new_state.cost > smp.global_cost_threshold or new_state.cost >= kth_cost:
                     continue
-                cost_map[new_matching_tuple] = new_state.cost
-                if len(new_state.matching) == smp.tmplt.n_nodes:
+                if len(new_state.matching) == smp.tmplt.n_nodes and \
+                        stream and k <= 0:
+                    # Every solution within the threshold is kept, so it is
+                    # final as soon as it is found
+                    solution_matchings.add(new_matching_tuple)
+                    yield new_state
+                elif len(new_state.matching) == smp.tmplt.n_nodes:
                     # temp_smp = curr_smp.copy(copy_graphs=False)
                     # temp_smp.enforce_matching(new_state.matching)
                     # # Do not reduce world as it can mess up the world indices in the matching
@@ -116,6 +237,7 @@ def greedy_best_k_matching(smp, k=1, nodewise=True, edgewise=True,
                     #                        nodewise=nodewise, edgewise=edgewise)
                     # new_state.cost = temp_smp.global_costs.min()
                     solutions.append(new_state)
+                    solution_matchings.add(new_matching_tuple)
                     if k > 0 and len(solutions) > k:
                         solutions.sort()
                         solutions.pop()
@@ -126,14 +248,45 @@ def greedy_best_k_matching(smp, k=1, nodewise=True, edgewise=True,
                         iterate_to_convergence(smp, reduce_world=False, nodewise=nodewise,
                                                    edgewise=edgewise)
                 else:
-                    heappush(open_list, new_state)
+                    frontier.push(new_state)
             else:
                 if verbose:
                     print("Recognized state: ", new_matching)
+        if stream and k > 0 and len(yielded) < len(solutions):
+            # Solutions cheaper than every open state cannot be displaced
+            lower_bound = frontier.lower_bound()
+            for solution in sorted(solutions):
+                if solution.cost >= lower_bound:
+                    break
+                if solution.matching not in yielded:
+                    yielded.add(solution.matching)
+                    yield solution
+    # States shared the cost matrices, so make them writable again
+    smp.own_costs("fixed_costs", "local_costs", "global_costs")
     if verbose and len(solutions) < 100:
         for solution in solutions:
             print(solution)
-    return solutions
+    if stream:
+        for solution in sorted(solutions):
+            if solution.matching not in yielded:
+                yield solution
+    if len(frontier) > 0:
+        result = _partial_result(solutions, frontier, kth_cost)
+        if checkpoint is not None:
+            checkpoint.save(smp, result)
+        return result
+    return SearchResult(
+        solutions, exact=frontier.is_exact(kth_cost,
+                                           smp.global_cost_threshold),
+        lower_bound=frontier.lower_bound(), frontier=frontier,
+        kth_cost=kth_cost)
+
+def _partial_result(solutions, frontier, kth_cost=float("inf")):
+    """Wrap up the state of a search which stopped before the end, from
+    which it can be resumed."""
+    return SearchResult(solutions, exact=False, complete=False,
+                        lower_bound=frontier.lower_bound(), frontier=frontier,
+                        kth_cost=kth_cost)
 
 def satisfies_cost_threshold(smp, cost):
     # Ignore states whose cost is too high
@@ -185,7 +338,7 @@ def propagate_cost_threshold_changes(smp, child_smp, nodewise, edgewise):
     return False
 
 def add_new_solution(smp, solution_state, tmplt_idx, solutions, k, **kwargs):
-    child_smp = smp.copy(copy_graphs=False)
+    child_smp = smp.copy(copy_graphs=False, share_costs=True)
     impose_state_assignments_on_smp(child_smp, tmplt_idx, solution_state, **kwargs)
     old_cost = solution_state.cost
     solution_state.cost = child_smp.global_costs.min()
@@ -214,11 +367,9 @@ def add_new_solution(smp, solution_state, tmplt_idx, solutions, k, **kwargs):
     return False
 
 def next_matchings(smp, state):
-    candidates = smp.candidates()
-
     # TODO: Wrap the next few lines into a function in search_utils.py unless you reuse them.
     # Identify template node with the least number of candidates
-    cand_counts = candidates.sum(axis=1)
+    cand_counts = smp.candidate_counts()
     # TODO: Maybe update the matching with any template nodes that have only one candidate.
     # Prevent previously matched template idxs from being chosen
     matching_dict = dict_from_tuple(state.matching)
@@ -226,8 +377,7 @@ def next_matchings(smp, state):
 
     tmplt_idx = cand_counts.argmin()
 
-    cost_min = smp.global_costs.min()
-    min_cost_counts = np.sum(smp.global_costs == cost_min, axis=1)
+    min_cost_counts = count_min_cost_cands(smp)
     for new_tmplt_idx in range(smp.tmplt.n_nodes):
         # if cand_counts[tmplt_idx] >= cand_counts[new_tmplt_idx]:
         if new_tmplt_idx not in matching_dict:
@@ -265,7 +415,7 @@ def next_matchings(smp, state):
     #                 if curr_importance < new_importance:
     #                     tmplt_idx = new_tmplt_idx
 
-    cand_idxs = list(np.argwhere(candidates[tmplt_idx]).flatten())
+    cand_idxs = list(smp.candidate_idxs(tmplt_idx))
 
     return tmplt_idx, cand_idxs
 
@@ -279,14 +429,35 @@ def pop_least_cost_cand(smp, tmplt_idx, cand_idxs):
     return cand_idxs.pop(min_idx)
 
 def _greedy_best_k_matching_recursive(smp, *, current_state, k,
-                                      nodewise, edgewise, solutions, verbose):
+                                      nodewise, edgewise, solutions, verbose,
+                                      shared_bound=None, stream=False,
+                                      open_levels=None, yielded=None,
+                                      budget=None, save_if_due=None):
+    """Search below a state depth first, adding the solutions found to
+    `solutions`.
 
-    if verbose:
-        # kth_cost is a bound on the cost of the k'th best match.
-        kth_cost = float("inf")
-        if len(solutions) == k:
-            kth_cost = solutions[-1].cost  # Assume `solutions` is sorted.
+    This is a generator. If `stream`, it yields each solution once no
+    solution found later can displace it, adding its matching to `yielded`.
+    The levels of the search still holding candidates are kept in
+    `open_levels`, and their candidates bound the cost of every solution
+    left to find. If `budget` runs out, `_BudgetExhausted` is raised with
+    the states below these candidates. `save_if_due` is called with the open
+    levels about once per state, to save checkpoints.
+    """
+    if open_levels is None:
+        open_levels = []
+    if yielded is None:
+        yielded = set()
+    # Prune against the solutions found by other workers
+    tighten_to_shared_bound(smp, shared_bound, nodewise=nodewise,
+                            edgewise=edgewise)
+
+    # kth_cost is a bound on the cost of the k'th best match.
+    kth_cost = float("inf")
+    if len(solutions) == k:
+        kth_cost = solutions[-1].cost  # Assume `solutions` is sorted.
 
+    if verbose:
         print("Current state: {} matches".format(len(current_state.matching)),
               "current_cost:", current_state.cost,
               "kth cost:", kth_cost,  "max cost", smp.global_cost_threshold,
@@ -295,6 +466,8 @@ def _greedy_best_k_matching_recursive(smp, *, current_state, k,
     # Ignore states whose cost is too high
     if not satisfies_cost_threshold(smp, current_state.cost):
         return
+    if budget is not None:
+        budget.expand()
 
     # Choose the next template node to match
     tmplt_idx, cand_idxs = next_matchings(smp, current_state)
@@ -310,7 +483,7 @@ def _greedy_best_k_matching_recursive(smp, *, current_state, k,
 
     # candidates = smp.candidates()
     # cand_idxs = list(np.argwhere(candidates[tmplt_idx]).flatten())
-    cand_idxs = list(np.argwhere(smp.candidates(tmplt_idx)).flatten())
+    cand_idxs = list(smp.candidate_idxs(tmplt_idx))
     print("Updated current state: {} matches".format(len(current_state.matching)),
           "current_cost:", current_state.cost,
           "kth_cost:", kth_cost,  "max cost", smp.global_cost_threshold,
@@ -319,7 +492,27 @@ def _greedy_best_k_matching_recursive(smp, *, current_state, k,
     # Sort candidates for the template node by global cost bound
     # sort_by_cost(smp, tmplt_idx, cand_idxs)
 
+    open_levels.append((smp, current_state, tmplt_idx, cand_idxs))
+    try:
+        yield from _expand_candidates(
+            smp, current_state=current_state, tmplt_idx=tmplt_idx,
+            cand_idxs=cand_idxs, k=k, nodewise=nodewise, edgewise=edgewise,
+            solutions=solutions, verbose=verbose, shared_bound=shared_bound,
+            stream=stream, open_levels=open_levels, yielded=yielded,
+            budget=budget, save_if_due=save_if_due)
+    finally:
+        open_levels.pop()
+
+def _expand_candidates(smp, *, current_state, tmplt_idx, cand_idxs, k,
+                       nodewise, edgewise, solutions, verbose, shared_bound,
+                       stream, open_levels, yielded, budget, save_if_due):
+    """Search below each candidate of a template node in turn, as part of
+    `_greedy_best_k_matching_recursive`."""
     while len(cand_idxs) > 0:
+        if save_if_due is not None:
+            save_if_due(open_levels)
+        if budget is not None and budget.is_exhausted():
+            raise _BudgetExhausted(_open_states(open_levels))
         print("Choosing least cost candidate out of", len(cand_idxs), "options")
         # # Pop the candidate with the lowest cost
         # cand_idx = cand_idxs[0]
@@ -334,8 +527,19 @@ def _greedy_best_k_matching_recursive(smp, *, current_state, k,
         if len(new_state.matching) == smp.tmplt.n_nodes:
             costs_changed = add_new_solution(smp, new_state, tmplt_idx, solutions, k,
                              reduce_world=False, nodewise=nodewise, edgewise=edgewise)
+            is_accepted = any(solution is new_state
+                              for solution in solutions)
+            if shared_bound is not None and is_accepted:
+                shared_bound.add(new_state.cost)
+            if stream and k <= 0 and is_accepted:
+                # Every solution within the threshold is kept, so it is
+                # final as soon as it is found
+                yielded.add(new_state.matching)
+                yield new_state
+            elif stream:
+                yield from _proven_solutions(solutions, open_levels, yielded)
         else:
-            child_smp = smp.copy(copy_graphs=False)
+            child_smp = smp.copy(copy_graphs=False, share_costs=True)
 
             print("Old cost:", smp.global_costs[tmplt_idx, cand_idx])
             impose_state_assignments_on_smp(child_smp, tmplt_idx, new_state,
@@ -347,13 +551,17 @@ def _greedy_best_k_matching_recursive(smp, *, current_state, k,
                       "threshold:", smp.global_cost_threshold)
                 continue
 
-            _greedy_best_k_matching_recursive(child_smp, current_state=new_state,
-                                             k=k, nodewise=nodewise,
-                                             edgewise=edgewise,
-                                             solutions=solutions,
-                                             verbose=verbose)
+            yield from _greedy_best_k_matching_recursive(
+                child_smp, current_state=new_state, k=k, nodewise=nodewise,
+                edgewise=edgewise, solutions=solutions, verbose=verbose,
+                shared_bound=shared_bound, stream=stream,
+                open_levels=open_levels, yielded=yielded, budget=budget,
+                save_if_due=save_if_due)
 
             costs_changed = propagate_cost_threshold_changes(smp, child_smp, nodewise=nodewise, edgewise=edgewise)
+        if tighten_to_shared_bound(smp, shared_bound, nodewise=nodewise,
+                                   edgewise=edgewise):
+            costs_changed = True
         if costs_changed:
             old_cost = current_state.cost
             current_state.cost = smp.global_costs.min()
@@ -365,17 +573,380 @@ def _greedy_best_k_matching_recursive(smp, *, current_state, k,
         # if costs_changed:
             # sort_by_cost(smp, tmplt_idx, cand_idxs)
 
-def matching_dict_from_candidates(candidates):
+def _proven_solutions(solutions, open_levels, yielded):
+    """Yield the solutions not yet yielded which cost less than every
+    candidate left in the open levels of a depth first search.
+
+    No solution found later can cost less than the candidate it lies below,
+    so these solutions can no longer be displaced from the best k.
+    """
+    lower_bound = min((level_smp.global_costs[tmplt_idx, cand_idxs].min()
+                       for level_smp, _, tmplt_idx, cand_idxs in open_levels
+                       if len(cand_idxs) > 0),
+                      default=float("inf"))
+    for solution in solutions:
+        if solution.cost >= lower_bound:
+            break
+        if solution.matching not in yielded:
+            yielded.add(solution.matching)
+            yield solution
+
+class _BudgetExhausted(Exception):
+    """Raised through a depth first search when its budget runs out.
+
+    Attributes
+    ----------
+    states : list
+        The states left to expand, which together cover every solution the
+        search has yet to find.
+    """
+    def __init__(self, states):
+        super().__init__()
+        self.states = states
+
+def _open_states(open_levels):
+    """Get the states below the candidates left in the open levels of a
+    depth first search, in the order to push them on a `StackFrontier`."""
+    states = []
+    for level_smp, level_state, tmplt_idx, cand_idxs in open_levels:
+        costs = level_smp.global_costs[tmplt_idx, cand_idxs]
+        # `pop_least_cost_cand` takes the first of the cheapest candidates
+        order = sorted(range(len(cand_idxs)),
+                       key=lambda i: (costs[i], i), reverse=True)
+        states.extend(create_new_state(level_smp, tmplt_idx, cand_idxs[i],
+                                       level_state.matching)
+                      for i in order)
+    return states
+
+def _search_open_states(smp, frontier, *, k, nodewise, edgewise, solutions,
+                        verbose, budget, save_if_due):
+    """Search depth first below each state of a frontier in turn, as when
+    resuming a search which ran out of budget."""
+    while len(frontier) > 0:
+        if save_if_due is not None:
+            save_if_due([])
+        if budget is not None and budget.is_exhausted():
+            raise _BudgetExhausted([])
+        state = frontier.pop()
+        if not satisfies_cost_threshold(smp, state.cost):
+            continue
+        # Any assigned template node will do to read the cost of the state
+        tmplt_idx = state.matching[-1][0]
+        if len(state.matching) == smp.tmplt.n_nodes:
+            add_new_solution(smp, state, tmplt_idx, solutions, k,
+                             reduce_world=False, nodewise=nodewise,
+                             edgewise=edgewise)
+            continue
+        state_smp = smp.copy(copy_graphs=False, share_costs=True)
+        impose_state_assignments_on_smp(state_smp, tmplt_idx, state,
+                                        reduce_world=False,
+                                        nodewise=nodewise, edgewise=edgewise)
+        yield from _greedy_best_k_matching_recursive(
+            state_smp, current_state=state, k=k, nodewise=nodewise,
+            edgewise=edgewise, solutions=solutions, verbose=verbose,
+            budget=budget, save_if_due=save_if_due)
+        propagate_cost_threshold_changes(smp, state_smp, nodewise=nodewise,
+                                         edgewise=edgewise)
+
+class SharedBound:
+    """The costs of the best k solutions found by the workers of a parallel
+    search, kept in shared memory.
+
+    Every worker adds the cost of each solution it accepts. The kth smallest
+    of these costs bounds the cost of the kth best solution overall, so each
+    worker can prune against the solutions found by all of them.
+
+    Parameters
+    ----------
+    k : int
+        Number of solutions searched for.
+    context : multiprocessing context, optional
+        Context of the processes sharing the bound.
+    """
+    def __init__(self, k, context=multiprocessing):
+        self.costs = context.Array("d", [float("inf")] * k)
+
+    def add(self, cost):
+        """Add the cost of a solution, keeping the k smallest."""
+        with self.costs.get_lock():
+            worst_idx = int(np.argmax(self.costs[:]))
+            if cost < self.costs[worst_idx]:
+                self.costs[worst_idx] = cost
+
+    def kth_cost(self):
+        """Get the kth smallest cost, or inf if fewer than k were added."""
+        with self.costs.get_lock():
+            return max(self.costs[:])
+
+def tighten_to_shared_bound(smp, shared_bound, **kwargs):
+    """Lower the cost threshold of a problem to the shared kth cost.
+
+    As in `add_new_solution`, once k solutions are known the threshold
+    becomes strict, so that only better solutions are accepted.
+
+    Returns
+    -------
+    bool
+        True if the threshold changed, in which case the costs have been
+        propagated again.
+    """
+    if shared_bound is None:
+        return False
+    kth_cost = shared_bound.kth_cost()
+    if kth_cost < smp.global_cost_threshold or (
+            kth_cost == smp.global_cost_threshold and
+            not smp.strict_threshold):
+        smp.global_cost_threshold = kth_cost
+        smp.strict_threshold = True
+        iterate_to_convergence(smp, reduce_world=False, **kwargs)
+        return True
+    return False
+
+# Problem and shared bound of each worker process of a parallel search
+_worker_smp = None
+_worker_shared_bound = None
+
+def _init_worker(smp, tmplt_handle, world_handle, shared_bound):
+    global _worker_smp, _worker_shared_bound
+    smp.tmplt = _attach_graph_handle(tmplt_handle)
+    smp.world = _attach_graph_handle(world_handle)
+    _worker_smp = smp
+    _worker_shared_bound = shared_bound
+
+def _graph_handle(shared_graph, graph, with_edgelist):
+    """Get what a worker needs to attach to a published graph: its path, and
+    the attributes of the graph which are not published along with it.
+
+    The edgelist, which may be as large as the graph itself, is only sent
+    when the edgewise bound reads it.
+    """
+    extras = {}
+    if len(graph.nodelist.columns) > 1:
+        extras["nodelist"] = graph.nodelist
+    if with_edgelist:
+        extras["edgelist"] = graph.edgelist
+    for name in ["time_constraints", "geo_constraints"]:
+        if hasattr(graph, name):
+            extras[name] = getattr(graph, name)
+    return shared_graph.path, extras
+
+def _attach_graph_handle(handle):
+    """Attach to a graph from the handle made by `_graph_handle`."""
+    path, extras = handle
+    graph = attach_graph(path)
+    for name, value in extras.items():
+        setattr(graph, name, value)
+    return graph
+
+def _search_subtree(tmplt_idx, cand_idx, current_state, k, nodewise,
+                    edgewise, verbose):
+    """Search below a child of the root state in a worker process.
+
+    Follows the loop of `_greedy_best_k_matching_recursive` for a single
+    candidate, returning the solutions found below it.
+    """
+    smp = _worker_smp.copy(copy_graphs=False, share_costs=True)
+    solutions = []
+    tighten_to_shared_bound(smp, _worker_shared_bound, nodewise=nodewise,
+                            edgewise=edgewise)
+    new_state = create_new_state(smp, tmplt_idx, cand_idx,
+                                 current_state.matching)
+    if not satisfies_cost_threshold(smp, new_state.cost):
+        return solutions
+    child_smp = smp.copy(copy_graphs=False, share_costs=True)
+    impose_state_assignments_on_smp(child_smp, tmplt_idx, new_state,
+                                    reduce_world=False, nodewise=nodewise,
+                                    edgewise=edgewise)
+    if not satisfies_cost_threshold(smp, new_state.cost):
+        return solutions
+    run_to_end(_greedy_best_k_matching_recursive(
+        child_smp, current_state=new_state, k=k, nodewise=nodewise,
+        edgewise=edgewise, solutions=solutions, verbose=verbose,
+        shared_bound=_worker_shared_bound))
+    return solutions
+
+def _parallel_best_k_matching(smp, *, current_state, k, nodewise, edgewise,
+                              solutions, verbose, n_processes):
+    """Search the subtrees below the root state in a pool of processes.
+
+    Each candidate of the first template node chosen is searched by its own
+    task. The workers share the costs of the solutions they find through a
+    `SharedBound`, so each of them prunes against the best k found so far by
+    any of them. The graphs are published with `publish_graph`, so that the
+    workers map a single copy of them, and only the costs of the problem are
+    sent to each worker.
+    """
+    if not satisfies_cost_threshold(smp, current_state.cost):
+        return
+    tmplt_idx, cand_idxs = next_matchings(smp, current_state)
+    if len(current_state.matching) + 1 == smp.tmplt.n_nodes:
+        # The children are solutions, so there is nothing to split
+        run_to_end(_greedy_best_k_matching_recursive(
+            smp, current_state=current_state, k=k, nodewise=nodewise,
+            edgewise=edgewise, solutions=solutions, verbose=verbose))
+        return
+
+    smp.next_tmplt_idx = tmplt_idx
+    iterate_to_convergence(smp, reduce_world=False, nodewise=nodewise,
+                           edgewise=edgewise)
+    smp._local_costs = None
+    cand_idxs = np.array(smp.candidate_idxs(tmplt_idx))
+    # Start with the most promising subtrees, as the serial search does
+    cand_idxs = cand_idxs[np.argsort(smp.global_costs[tmplt_idx, cand_idxs],
+                                     kind="stable")]
+
+    # Forked workers can deadlock on locks held by the threads of the
+    # parent, such as those of the numba compiler, so start fresh ones
+    context = multiprocessing.get_context("spawn")
+    shared_bound = SharedBound(k, context) if k > 0 else None
+    with_edgelist = smp.edge_attr_fn is not None or \
+        hasattr(smp.tmplt, "time_constraints")
+    worker_smp = smp.copy(copy_graphs=False, share_costs=True)
+    worker_smp.tmplt = worker_smp.world = None
+    with publish_graph(smp.tmplt) as shared_tmplt, \
+            publish_graph(smp.world) as shared_world:
+        initargs = (worker_smp,
+                    _graph_handle(shared_tmplt, smp.tmplt, with_edgelist),
+                    _graph_handle(shared_world, smp.world, with_edgelist),
+                    shared_bound)
+        with ProcessPoolExecutor(max_workers=n_processes, mp_context=context,
+                                 initializer=_init_worker,
+                                 initargs=initargs) as executor:
+            futures = [executor.submit(_search_subtree, tmplt_idx, cand_idx,
+                                       current_state, k, nodewise, edgewise,
+                                       verbose)
+                       for cand_idx in cand_idxs]
+            for future in futures:
+                for solution in future.result():
+                    bisect.insort(solutions, solution)
+    if k > 0:
+        del solutions[k:]
+
+def matching_dict_from_candidates(smp):
     matching_dict = {}
-    for i in range(candidates.shape[0]):
-        if np.sum(candidates[i]) == 1:
-            matching_dict[i] = np.argwhere(candidates[i])[0][0]
+    cand_counts = smp.candidate_counts()
+    for i in range(smp.tmplt.n_nodes):
+        if cand_counts[i] == 1:
+            matching_dict[i] = smp.candidate_idxs(i)[0]
     return matching_dict
 
 def greedy_best_k_matching_recursive(orig_smp, k=1, nodewise=True, edgewise=True,
-                                     solutions=None, verbose=False, copy_smp=False):
+                                     solutions=None, verbose=False, copy_smp=False,
+                                     n_processes=None, budget=None, resume=None,
+                                     checkpoint=None):
+    """Depth-first branch and bound search for the best k matchings.
+
+    Parameters
+    ----------
+    orig_smp: MatchingProblem
+        A subgraph matching problem. It is copied rather than modified.
+    k: int
+        The maximum number of solutions to find.
+    nodewise: bool
+        Whether to use the nodewise cost bound.
+    edgewise: bool
+        Whether to use the edgewise cost bound.
+    solutions: list, optional
+        Solutions already known, to which the new ones are added.
+    verbose: bool
+        Flag for verbose output.
+    n_processes: int, optional
+        Number of processes among which to split the subtrees of the first
+        template node chosen. The processes share the costs of the best k
+        solutions found so far, so that each of them prunes against all of
+        them. The graphs are shared with `publish_graph` rather than copied
+        into each process, but the costs and attribute functions are
+        pickled, so the functions must be defined at module level. Searched
+        serially by default.
+    budget: SearchBudget, optional
+        Limits on the time, expanded states and memory of the search. Once
+        one is reached, the search stops and returns what it found so far.
+        Only serial searches take a budget.
+    resume: SearchResult, optional
+        The result of an earlier search on the same problem which ran out of
+        budget. The search continues below the states of its frontier, in
+        the order it would have explored them, starting from its solutions.
+        Checkpoints loaded by `load_checkpoint` are resumed the same way.
+    checkpoint: Checkpointer, optional
+        Writes the solutions and the candidates left on the stack of the
+        search to disk at regular intervals, and when the budget runs out.
+        Only serial searches write checkpoints.
+
+    Returns
+    -------
+    SearchResult
+        The solution states, sorted by cost. Solutions tied with the kth
+        cost may differ between serial and parallel searches, which find
+        them in different orders. If the budget ran out, `complete` is
+        False, `lower_bound` bounds the cost of the solutions left to find
+        and `frontier` holds the states below the candidates left on the
+        stack of the search.
+    """
+    return run_to_end(_greedy_best_k_recursive_search(
+        orig_smp, k=k, nodewise=nodewise, edgewise=edgewise,
+        solutions=solutions, verbose=verbose, n_processes=n_processes,
+        stream=False, budget=budget, resume=resume, checkpoint=checkpoint))
+
+def iter_best_k_matching_recursive(orig_smp, k=1, nodewise=True,
+                                   edgewise=True, verbose=False,
+                                   mapping=False):
+    """Yield the best k matchings found by
+    `greedy_best_k_matching_recursive` as soon as they are proven.
+
+    A solution is proven once every candidate left on the stack of the
+    search costs more than it, as no solution found later can then displace
+    it from the best k. The remaining solutions are yielded when the search
+    ends. With k <= 0 every solution within the threshold is yielded as soon
+    as it is found.
+
+    Parameters
+    ----------
+    orig_smp: MatchingProblem
+        A subgraph matching problem. It is copied rather than modified.
+    k: int
+        The maximum number of solutions to find.
+    nodewise: bool
+        Whether to use the nodewise cost bound.
+    edgewise: bool
+        Whether to use the edgewise cost bound.
+    verbose: bool
+        Flag for verbose output.
+    mapping: bool
+        Whether to yield dicts from template nodes to world nodes instead of
+        states.
+
+    Yields
+    ------
+    State or dict
+        Each solution, in order of increasing cost when k > 0.
+    """
+    for solution in _greedy_best_k_recursive_search(
+            orig_smp, k=k, nodewise=nodewise, edgewise=edgewise,
+            solutions=None, verbose=verbose, n_processes=None, stream=True):
+        yield node_mapping(orig_smp, solution) if mapping else solution
+
+def _greedy_best_k_recursive_search(orig_smp, *, k, nodewise, edgewise,
+                                    solutions, verbose, n_processes, stream,
+                                    budget=None, resume=None,
+                                    checkpoint=None):
+    """Run the recursive search, yielding solutions once proven if `stream`,
+    and return the SearchResult."""
     if orig_smp.global_cost_threshold == float("inf"):
         raise Exception("Invalid global cost threshold.")
+    is_parallel = n_processes is not None and n_processes > 1
+    if is_parallel and (budget is not None or resume is not None or
+                        checkpoint is not None):
+        raise ValueError("Parallel searches can not take a budget, resume "
+                         "or checkpoint.")
+    if budget is not None:
+        budget.start()
+    if checkpoint is not None:
+        checkpoint.start()
+    if resume is not None:
+        solutions = yield from _resume_recursive_search(
+            orig_smp, resume, k=k, nodewise=nodewise, edgewise=edgewise,
+            verbose=verbose, budget=budget, checkpoint=checkpoint)
+        return solutions
     # Initialize matching with known matches
     if solutions is None:
         solutions = []
@@ -389,9 +960,8 @@ def greedy_best_k_matching_recursive(orig_smp, k=1, nodewise=True, edgewise=True
 
     smp = orig_smp.copy(copy_graphs=False)
     current_state = State()  # Consider initializing this at the end of the block with arguments of `matching` and `cost`
-    candidates = smp.candidates()
 
-    matching_dict = matching_dict_from_candidates(candidates)
+    matching_dict = matching_dict_from_candidates(smp)
     current_state.matching = tuple_from_dict(matching_dict)
 
     current_state.cost = max((smp.global_costs[x] for x in current_state.matching),
@@ -400,7 +970,9 @@ def greedy_best_k_matching_recursive(orig_smp, k=1, nodewise=True, edgewise=True
     # Handle the case where we start in a solved state
     if len(current_state.matching) == smp.tmplt.n_nodes and len(solutions) == 0:
         solutions.append(current_state)
-        return solutions
+        if stream:
+            yield current_state
+        return SearchResult(solutions, frontier=StackFrontier())
 
     changed_cands = np.zeros((smp.tmplt.n_nodes,), dtype=np.bool)
     for tmplt_idx, cand_idx in current_state.matching:
@@ -411,7 +983,82 @@ def greedy_best_k_matching_recursive(orig_smp, k=1, nodewise=True, edgewise=True
                            nodewise=nodewise,
                            edgewise=edgewise)
 
-    _greedy_best_k_matching_recursive(smp, current_state=current_state,
-                                      k=k, nodewise=nodewise, edgewise=edgewise,
-                                      solutions=solutions, verbose=verbose)
-    return solutions
+    if is_parallel:
+        _parallel_best_k_matching(smp, current_state=current_state, k=k,
+                                  nodewise=nodewise, edgewise=edgewise,
+                                  solutions=solutions, verbose=verbose,
+                                  n_processes=n_processes)
+        return SearchResult(solutions, frontier=StackFrontier())
+
+    yielded = set()
+    frontier = StackFrontier()
+    try:
+        yield from _greedy_best_k_matching_recursive(
+            smp, current_state=current_state, k=k, nodewise=nodewise,
+            edgewise=edgewise, solutions=solutions, verbose=verbose,
+            stream=stream, yielded=yielded, budget=budget,
+            save_if_due=_checkpoint_saver(checkpoint, smp, solutions,
+                                          frontier))
+    except _BudgetExhausted as exhausted:
+        for state in exhausted.states:
+            frontier.push(state)
+    if stream:
+        for solution in solutions:
+            if solution.matching not in yielded:
+                yield solution
+    return _recursive_search_result(smp, solutions, frontier, checkpoint)
+
+def _checkpoint_saver(checkpoint, smp, solutions, frontier):
+    """Get a function saving a checkpoint of a recursive search when one is
+    due, given its open levels, or None without a checkpointer.
+
+    The states left on the stack are those of `frontier` followed by those
+    below the candidates of the open levels.
+    """
+    if checkpoint is None:
+        return None
+
+    def save_if_due(open_levels):
+        if checkpoint.is_due():
+            stack = StackFrontier()
+            for state in frontier.states() + _open_states(open_levels):
+                stack.push(state)
+            checkpoint.save(smp, _partial_result(solutions, stack))
+    return save_if_due
+
+def _resume_recursive_search(orig_smp, resume, *, k, nodewise, edgewise,
+                             verbose, budget, checkpoint):
+    """Continue a recursive search which ran out of budget, and return the
+    SearchResult."""
+    smp = orig_smp.copy(copy_graphs=False)
+    solutions = list(resume)
+    frontier = resume.frontier
+    if k > 0 and len(solutions) >= k:
+        # Only better solutions are accepted once k are known, as in
+        # `add_new_solution`
+        smp.global_cost_threshold = min(smp.global_cost_threshold,
+                                        solutions[k - 1].cost)
+        smp.strict_threshold = True
+    iterate_to_convergence(smp, reduce_world=False, nodewise=nodewise,
+                           edgewise=edgewise)
+    try:
+        yield from _search_open_states(
+            smp, frontier, k=k, nodewise=nodewise, edgewise=edgewise,
+            solutions=solutions, verbose=verbose, budget=budget,
+            save_if_due=_checkpoint_saver(checkpoint, smp, solutions,
+                                          frontier))
+    except _BudgetExhausted as exhausted:
+        for state in exhausted.states:
+            frontier.push(state)
+    return _recursive_search_result(smp, solutions, frontier, checkpoint)
+
+def _recursive_search_result(smp, solutions, frontier, checkpoint):
+    """Wrap up the solutions of a recursive search, which is complete
+    unless it left states in the frontier, in which case a checkpoint is
+    saved."""
+    if len(frontier) > 0:
+        result = _partial_result(solutions, frontier)
+        if checkpoint is not None:
+            checkpoint.save(smp, result)
+        return result
+    return SearchResult(solutions, frontier=frontier)
@@ -1,8 +1,10 @@
 """Utility functions and classes for search"""
 import numpy as np
+import pandas as pd
 
 from .. import global_cost_bound
 from .. import local_cost_bound
+from ..propagation import PropagationStats
 
 class State:
     """A state for the greedy search algorithm.
@@ -26,6 +28,68 @@ class State:
     def __str__(self):
         return str(self.matching) + ": " + str(self.cost)
 
+class SearchResult(list):
+    """The solutions found by a search, along with how complete it was.
+
+    Behaves as the list of solution states.
+
+    Attributes
+    ----------
+    exact : bool
+        Whether the solutions are guaranteed to be the best ones within the
+        cost threshold. False if a bounded frontier forgot a state which
+        could have led to a better solution, or if the search ran out of
+        budget.
+    complete : bool
+        Whether the search ran to the end. False if it ran out of budget, in
+        which case it can be resumed from this result.
+    lower_bound : float
+        Smallest cost of any state left to expand. The cost of a state never
+        exceeds those of the states and solutions below it, so this bounds
+        the cost of the solutions the search has yet to find. It is inf once
+        the search is complete.
+    frontier : Frontier or None
+        The states left to expand when the search stopped.
+    kth_cost : float
+        Cost which a new solution had to beat when the search stopped.
+    """
+    def __init__(self, solutions=(), exact=True, complete=True,
+                 lower_bound=float("inf"), frontier=None,
+                 kth_cost=float("inf")):
+        super().__init__(solutions)
+        self.exact = exact
+        self.complete = complete
+        self.lower_bound = lower_bound
+        self.frontier = frontier
+        self.kth_cost = kth_cost
+
+def run_to_end(generator):
+    """Exhaust a generator, returning its return value."""
+    while True:
+        try:
+            next(generator)
+        except StopIteration as stop:
+            return stop.value
+
+def node_mapping(smp, state):
+    """Get the assignment of a state as a dict from template nodes to world
+    nodes.
+
+    Parameters
+    ----------
+    smp : MatchingProblem
+        The problem the state belongs to.
+    state : State
+        A state of a search on `smp`.
+
+    Returns
+    -------
+    dict
+        The world node assigned to each assigned template node.
+    """
+    return {smp.tmplt.nodes[tmplt_idx]: smp.world.nodes[world_idx]
+            for tmplt_idx, world_idx in state.matching}
+
 def tuple_from_dict(dict):
     """Turns a dict into a representative sorted tuple of 2-tuples.
     Parameters
@@ -63,40 +127,253 @@ def set_fixed_costs(fixed_costs, matching):
     mask[tuple(np.array(matching).T)] = False
     fixed_costs[mask] = float("inf")
 
+def count_min_cost_cands(smp):
+    """Count the candidates of each template node with the least global cost.
+
+    Parameters
+    ----------
+    smp : MatchingProblem
+        A subgraph matching problem.
+
+    Returns
+    -------
+    1darray
+        For each template node, the number of world nodes whose global cost
+        equals the smallest global cost in the problem.
+    """
+    cost_min = smp.global_costs.min()
+    if smp.sparse_costs:
+        costs = smp.global_costs
+        return costs.count_rows(costs.data == cost_min)
+    return np.sum(smp.global_costs == cost_min, axis=1)
+
 import tqdm
 
+# Number of world nodes whose attributes are compared at once
+NODE_BLOCK_SIZE = 1 << 16
+
+def vectorized_node_attr_fn(fn):
+    """Mark a node attribute function as following the batch protocol.
+
+    A batch node attribute function compares one template node against many
+    world nodes at once. It is called as
+
+        fn(tmplt_attrs, world_attrs)
+
+    where `tmplt_attrs` is a dict of the template node attributes and
+    `world_attrs` is a dict from each world attribute name to an array of its
+    values. It returns an array with the cost of each world node. Both dicts
+    leave out the node column, as world nodes with equal attributes are only
+    compared once.
+
+    Examples
+    --------
+    >>> @vectorized_node_attr_fn
+    ... def weight_diff(tmplt_attrs, world_attrs):
+    ...     return np.abs(tmplt_attrs["weight"] - world_attrs["weight"])
+
+    Parameters
+    ----------
+    fn : function
+        Batch node attribute function.
+
+    Returns
+    -------
+    function
+        The same function, marked as vectorized.
+    """
+    fn.vectorized = True
+    return fn
+
+def ignores_node_col(fn):
+    """Mark a scalar node attribute function as not reading the node column.
+
+    Scalar node attribute functions are passed the node column, holding the
+    node IDs, so they are called once for each pair of nodes. Functions
+    marked with this decorator are passed the other attributes only, and are
+    called once for each distinct combination of world attributes.
+
+    Examples
+    --------
+    >>> @ignores_node_col
+    ... def weight_diff(tmplt_attrs, world_attrs):
+    ...     return abs(tmplt_attrs["weight"] - world_attrs["weight"])
+
+    Parameters
+    ----------
+    fn : function
+        Scalar node attribute function.
+
+    Returns
+    -------
+    function
+        The same function, marked as not reading the node column.
+    """
+    fn.reads_node_col = False
+    return fn
+
+def encode_node_attrs(nodelists, attr_keys):
+    """Dictionary-encode the attributes of the nodes of several graphs.
+
+    Each attribute column is replaced by integer codes shared across all of
+    the nodelists, so that equal values get equal codes. Missing values get
+    the code -1.
+
+    Parameters
+    ----------
+    nodelists : list(DataFrame)
+        Nodelists holding every attribute in `attr_keys`.
+    attr_keys : list(str)
+        Names of the attributes to encode.
+
+    Returns
+    -------
+    list(2darray)
+        For each nodelist, the code of each attribute of each node, with one
+        column per attribute.
+    """
+    n_nodes = [len(nodelist) for nodelist in nodelists]
+    all_codes = np.empty((sum(n_nodes), len(attr_keys)), dtype=np.int64)
+    for attr_idx, key in enumerate(attr_keys):
+        values = np.concatenate([np.asarray(nodelist[key], dtype=object)
+                                 for nodelist in nodelists])
+        all_codes[:, attr_idx], _ = pd.factorize(values)
+    return np.split(all_codes, np.cumsum(n_nodes)[:-1])
+
+def _finite_fixed_costs(smp, tmplt_idx):
+    """Get the world nodes whose fixed cost for a template node is finite,
+    along with those costs."""
+    if smp.sparse_costs:
+        world_idxs, costs = smp.fixed_costs.row(tmplt_idx)
+    else:
+        costs = smp.fixed_costs[tmplt_idx]
+        world_idxs = np.arange(len(costs))
+    is_finite = np.isfinite(costs)
+    return world_idxs[is_finite], costs[is_finite]
+
 def add_node_attr_costs(smp, node_attr_fn):
-    """Increase the fixed costs to account for difference in node attributes."""
-    tmplt_attr_keys = [attr for attr in smp.tmplt.nodelist.columns]
-    tmplt_attr_cols = [smp.tmplt.nodelist[key] for key in tmplt_attr_keys]
-    tmplt_attrs_zip = zip(*tmplt_attr_cols)
-    world_attr_keys = [attr for attr in smp.world.nodelist.columns]
-    world_attr_cols = [smp.world.nodelist[key] for key in world_attr_keys]
-    with tqdm.tqdm(total=smp.tmplt.n_nodes * smp.world.n_nodes, ascii=True) as pbar:
-        # for tmplt_idx, tmplt_row in smp.tmplt.nodelist.iterrows():
-        for tmplt_idx, tmplt_attrs in enumerate(tmplt_attrs_zip):
-            # for world_idx, world_row in smp.world.nodelist.iterrows():
-            world_attrs_zip = zip(*world_attr_cols)
-            for world_idx, world_attrs in enumerate(world_attrs_zip):
-                pbar.update(1)
-                if smp.fixed_costs[tmplt_idx, world_idx] != float("inf"):
-                    tmplt_row = dict(zip(tmplt_attr_keys, tmplt_attrs))
-                    world_row = dict(zip(world_attr_keys, world_attrs))
-                    smp.fixed_costs[tmplt_idx, world_idx] += node_attr_fn(tmplt_row, world_row)
+    """Increase the fixed costs to account for difference in node attributes.
+
+    Only world nodes whose fixed cost is finite are compared. Unless the
+    attribute function reads the node column, world nodes are grouped by
+    their attributes, so that the function is only evaluated once for each
+    distinct combination of attributes.
+
+    Parameters
+    ----------
+    smp : MatchingProblem
+        A subgraph matching problem.
+    node_attr_fn : function
+        Scalar function, called with a dict of the attributes of a template
+        node and one of a world node, including the node column unless it is
+        marked with `ignores_node_col`. Alternatively, batch function marked
+        with `vectorized_node_attr_fn`, which is passed no node column.
+    """
+    smp.own_costs("fixed_costs")
+    is_vectorized = getattr(node_attr_fn, "vectorized", False)
+    with_node_col = (not is_vectorized
+                     and getattr(node_attr_fn, "reads_node_col", True))
+    tmplt_attr_keys = [attr for attr in smp.tmplt.nodelist.columns
+                       if with_node_col or attr != smp.tmplt.node_col]
+    world_attr_keys = [attr for attr in smp.world.nodelist.columns
+                       if with_node_col or attr != smp.world.node_col]
+    tmplt_attr_cols = {key: smp.tmplt.nodelist[key].to_numpy()
+                       for key in tmplt_attr_keys}
+    world_attr_cols = {key: smp.world.nodelist[key].to_numpy()
+                       for key in world_attr_keys}
+
+    if with_node_col:
+        # Node IDs are distinct, so each world node is a group of its own
+        world_groups = np.arange(smp.world.n_nodes)
+        group_attrs = world_attr_cols
+        n_groups = smp.world.n_nodes
+    else:
+        # Group the world nodes by their attributes
+        world_codes, = encode_node_attrs([smp.world.nodelist],
+                                         world_attr_keys)
+        unique_codes, group_nodes, world_groups = np.unique(
+            world_codes, axis=0, return_index=True, return_inverse=True)
+        world_groups = world_groups.ravel()
+        group_attrs = {key: values[group_nodes]
+                       for key, values in world_attr_cols.items()}
+        n_groups = len(unique_codes)
+
+    with tqdm.tqdm(total=smp.tmplt.n_nodes, ascii=True) as pbar:
+        for tmplt_idx in range(smp.tmplt.n_nodes):
+            pbar.update(1)
+            world_idxs, costs = _finite_fixed_costs(smp, tmplt_idx)
+            if len(world_idxs) == 0:
+                continue
+            tmplt_attrs = {key: values[tmplt_idx]
+                           for key, values in tmplt_attr_cols.items()}
+            groups = world_groups[world_idxs]
+            is_needed = np.zeros(n_groups, dtype=np.bool_)
+            is_needed[groups] = True
+            needed_groups = np.flatnonzero(is_needed)
+            group_costs = np.zeros(n_groups)
+            if is_vectorized:
+                group_costs[needed_groups] = node_attr_fn(
+                    tmplt_attrs, {key: values[needed_groups]
+                                  for key, values in group_attrs.items()})
+            else:
+                for group in needed_groups:
+                    group_costs[group] = node_attr_fn(
+                        tmplt_attrs, {key: values[group]
+                                      for key, values in group_attrs.items()})
+            smp.set_cost_entries("fixed_costs", (tmplt_idx, world_idxs),
+                                 costs + group_costs[groups])
 
 def add_node_attr_costs_identity(smp):
-    """Assume node attr fn is the sum of the difference between attributes."""
-    world_nodelist_np = np.array(smp.world.nodelist)
-    for tmplt_idx, tmplt_row in smp.tmplt.nodelist.iterrows():
-        tmplt_row_np = np.array(tmplt_row)
-        # Remove first column: node ID which shouldn't be checked
-        # Index to remove empty attributes
-        nonempty_attrs = tmplt_row[1:] != ""
-        smp.fixed_costs[tmplt_idx] += (tmplt_row_np[None, 1:][:,nonempty_attrs] != world_nodelist_np[:,1:][:,nonempty_attrs]).sum(axis=1)
+    """Assume node attr fn is the sum of the difference between attributes.
+
+    Attribute values are dictionary-encoded, so that each template node is
+    compared against all of the world nodes at once by comparing codes.
+    Empty template attributes are not checked.
+    """
+    smp.own_costs("fixed_costs")
+    # Remove the node column: node ID which shouldn't be checked
+    attr_keys = [attr for attr in smp.tmplt.nodelist.columns
+                 if attr != smp.tmplt.node_col]
+    tmplt_codes, world_codes = encode_node_attrs(
+        [smp.tmplt.nodelist, smp.world.nodelist], attr_keys)
+    # Index to remove empty attributes
+    is_nonempty = smp.tmplt.nodelist[attr_keys].to_numpy() != ""
+    # Missing values never match
+    tmplt_codes[tmplt_codes < 0] = -2
+    for tmplt_idx in range(smp.tmplt.n_nodes):
+        world_idxs, costs = _finite_fixed_costs(smp, tmplt_idx)
+        if len(world_idxs) == 0:
+            continue
+        attr_idxs = np.flatnonzero(is_nonempty[tmplt_idx])
+        n_diffs = np.empty(len(world_idxs))
+        # Compare in blocks of world nodes to bound the temporary memory
+        for start in range(0, len(world_idxs), NODE_BLOCK_SIZE):
+            block = slice(start, start + NODE_BLOCK_SIZE)
+            n_diffs[block] = (
+                world_codes[world_idxs[block, None], attr_idxs] !=
+                tmplt_codes[tmplt_idx, attr_idxs]).sum(axis=1)
+        smp.set_cost_entries("fixed_costs", (tmplt_idx, world_idxs),
+                             costs + n_diffs)
+
+def _bound_and_propagate(smp, local_bound, **kwargs):
+    """Run a local cost bound, then propagate it to the global costs."""
+    local_bound(smp, **kwargs)
+    global_cost_bound.from_local_bounds(smp)
 
 def iterate_to_convergence(smp, reduce_world=True, nodewise=True,
-                           edgewise=True, changed_cands=None, verbose=False):
+                           edgewise=True, changed_cands=None, verbose=False,
+                           stats=None, patience=None, neighborhood=False):
     """Iterates the various cost bounds until the costs converge.
+
+    Bounds are only rerun when something they depend on has changed. The
+    nodewise bound depends only on the degrees of the nodes, so it is rerun
+    only after the world is reduced. The edgewise bound of each template
+    edge depends on the candidates of its endpoints, so the template nodes
+    whose candidates changed since its last run are kept in a worklist, and
+    only the edges touching them are recomputed. The neighborhood bound keeps
+    a worklist of its own in the same way. Without monotone costs each bound
+    overwrites the last, so every bound is rerun on every iteration.
+
     Parameters
     ----------
     smp : MatchingProblem
@@ -109,43 +386,99 @@ def iterate_to_convergence(smp, reduce_world=True, nodewise=True,
         candidates since the last time filters were run.
     verbose : bool
         Flag for verbose output.
+    stats : PropagationStats, optional
+        Records the effectiveness of each bound, and decides which bounds to
+        skip. Pass the same stats to several calls to accumulate them.
+    patience : int, optional
+        When no stats are given, skip bounds after this many runs in a row
+        without eliminating any candidates.
+    neighborhood : bool
+        Whether to also run the neighborhood cost bound, which is stronger
+        than the edgewise bound but more expensive.
+
+    Returns
+    -------
+    PropagationStats
+        The effectiveness of each bound.
     """
+    if stats is None:
+        stats = PropagationStats(patience=patience)
     if changed_cands is None:
         changed_cands = np.ones((smp.tmplt.n_nodes,), dtype=np.bool)
+    nbhd_changed_cands = changed_cands
+    incremental = smp.use_monotone
 
-    old_candidates = smp.candidates().copy()
+    # Candidates can only be eliminated, so counting them detects changes.
+    cand_counts = smp.candidate_counts()
     if smp._local_costs is not None:
-        global_cost_bound.from_local_bounds(smp)
+        cand_counts = stats.run("from_local_bounds", smp,
+                                global_cost_bound.from_local_bounds,
+                                cand_counts=cand_counts)
+    old_cand_counts = cand_counts
+    # Candidate counts as of the last run of the edgewise cost bound
+    edgewise_cand_counts = None
+    # Candidate counts as of the last run of the neighborhood cost bound
+    nbhd_cand_counts = None
+    # Whether the world has changed since the last run of the nodewise bound
+    world_changed = True
 
-    # TODO: Does this break if nodewise changes the candidates?
     while True:
-        if nodewise:
+        if nodewise and (world_changed or not incremental) and \
+                stats.should_run("nodewise"):
             if verbose:
                 print(smp)
                 print("Running nodewise cost bound")
-            local_cost_bound.nodewise(smp)
-            global_cost_bound.from_local_bounds(smp)
-        if edgewise:
+            cand_counts = stats.run("nodewise", smp, _bound_and_propagate,
+                                    local_cost_bound.nodewise,
+                                    cand_counts=cand_counts)
+        world_changed = False
+        if edgewise and edgewise_cand_counts is not None:
+            changed_cands = cand_counts != edgewise_cand_counts
+        if edgewise and (np.any(changed_cands) or not incremental) and \
+                stats.should_run("edgewise"):
+            if verbose:
+                print(smp)
+                print("Running edgewise cost bound on {} changed template "
+                      "nodes".format(np.sum(changed_cands)))
+            edgewise_cand_counts = cand_counts
+            cand_counts = stats.run("edgewise", smp, _bound_and_propagate,
+                                    local_cost_bound.edgewise,
+                                    cand_counts=cand_counts,
+                                    changed_cands=changed_cands)
+        if neighborhood and nbhd_cand_counts is not None:
+            nbhd_changed_cands = cand_counts != nbhd_cand_counts
+        if neighborhood and (np.any(nbhd_changed_cands) or not incremental) \
+                and stats.should_run("neighborhood"):
             if verbose:
                 print(smp)
-                print("Running edgewise cost bound")
-            # TODO: does changed_cands work for edgewise?
-            # local_cost_bound.edgewise(smp, changed_cands=changed_cands)
-            local_cost_bound.edgewise(smp)
-            global_cost_bound.from_local_bounds(smp)
-        candidates = smp.candidates()
-        if ~np.any(candidates):
+                print("Running neighborhood cost bound")
+            nbhd_cand_counts = cand_counts
+            cand_counts = stats.run("neighborhood", smp, _bound_and_propagate,
+                                    local_cost_bound.neighborhood,
+                                    cand_counts=cand_counts,
+                                    changed_cands=nbhd_changed_cands)
+        if ~np.any(cand_counts):
             break
-        changed_cands = np.any(candidates != old_candidates, axis=1)
-        if ~np.any(changed_cands):
+        if np.array_equal(cand_counts, old_cand_counts):
             break
         if reduce_world:
+            n_world_nodes = smp.world.n_nodes
             smp.reduce_world()
-        old_candidates = smp.candidates().copy()
-        if smp.match_fixed_costs:
+            world_changed = smp.world.n_nodes < n_world_nodes
+            cand_counts = smp.candidate_counts()
+        old_cand_counts = cand_counts
+        # Sparse costs discard non-candidates as soon as they are found.
+        if smp.match_fixed_costs and not smp.sparse_costs:
             # Remove non-candidates permanently by setting fixed costs to infinity
             non_cand_mask = np.ones(smp.shape, dtype=np.bool)
-            non_cand_mask[old_candidates] = False
-            smp.fixed_costs[non_cand_mask] = float("inf")
+            non_cand_mask[smp.candidates()] = False
+            smp.set_cost_entries("fixed_costs", non_cand_mask, float("inf"))
+            # The fixed costs feed into the global costs of the candidates
+            # which remain, so propagate them before the next bound runs
+            cand_counts = stats.run("from_local_bounds", smp,
+                                    global_cost_bound.from_local_bounds,
+                                    cand_counts=cand_counts)
     if verbose:
         print(smp)
+        print(stats)
+    return stats
@@ -0,0 +1,314 @@
+"""Provide a cost matrix which only stores entries for live candidates."""
+import numpy as np
+from scipy import sparse
+
+
+class SparseCostMatrix:
+    """A cost matrix which only stores the entries of live candidate pairs.
+
+    Entries are stored in compressed sparse row order with one row for each
+    template node and one column for each world node. Entries which are not
+    stored are treated as infinite: the corresponding world node is no longer
+    a candidate for the template node.
+
+    The cost matrices of a matching problem share their `indptr` and `indices`
+    arrays. These are never modified in place, so they are safe to share.
+    Discarding entries produces new index arrays instead.
+
+    Examples
+    --------
+    >>> costs = SparseCostMatrix.from_dense(np.array([[0, np.inf], [1, 2]]))
+    >>> costs.nnz
+    3
+    >>> costs[0, 1]
+    inf
+
+    Parameters
+    ----------
+    indptr : 1darray
+        Row pointers of the stored entries, as in a csr_matrix.
+    indices : 1darray
+        Column index of each stored entry, sorted within each row.
+    data : 1darray
+        Value of each stored entry.
+    shape : (int, int)
+        Number of template nodes and world nodes.
+    monotone : bool, optional
+        Whether to prevent stored entries from decreasing when they are set.
+
+    Attributes
+    ----------
+    shape : (int, int)
+        Number of template nodes and world nodes.
+    indptr : 1darray
+        Row pointers of the stored entries.
+    indices : 1darray
+        Column index of each stored entry.
+    data : 1darray
+        Value of each stored entry.
+    monotone : bool
+        Whether stored entries are prevented from decreasing.
+    """
+
+    def __init__(self, indptr, indices, data, shape, monotone=False):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = np.asarray(data, dtype=np.float64)
+        self.shape = tuple(shape)
+        self.monotone = monotone
+        self._rows = None
+
+    @classmethod
+    def from_dense(cls, costs, monotone=False):
+        """Store the finite entries of a dense cost matrix.
+
+        Parameters
+        ----------
+        costs : 2darray
+            Dense matrix of costs. Infinite entries are discarded.
+        monotone : bool, optional
+            Whether to prevent stored entries from decreasing.
+
+        Returns
+        -------
+        SparseCostMatrix
+            The finite entries of `costs`.
+        """
+        costs = np.asarray(costs, dtype=np.float64)
+        is_finite = sparse.csr_matrix(np.isfinite(costs))
+        is_finite.sort_indices()
+        rows = np.repeat(np.arange(costs.shape[0]), np.diff(is_finite.indptr))
+        data = costs[rows, is_finite.indices]
+        return cls(is_finite.indptr, is_finite.indices, data, costs.shape,
+                   monotone=monotone)
+
+    @classmethod
+    def from_entries(cls, rows, cols, data, shape, monotone=False):
+        """Build a matrix from the row, column and value of each entry.
+
+        Parameters
+        ----------
+        rows : 1darray
+            Template node index of each entry, in nondecreasing order.
+        cols : 1darray
+            World node index of each entry, increasing within each row.
+        data : 1darray
+            Value of each entry.
+        shape : (int, int)
+            Number of template nodes and world nodes.
+        monotone : bool, optional
+            Whether to prevent stored entries from decreasing.
+
+        Returns
+        -------
+        SparseCostMatrix
+            The matrix with the given entries.
+        """
+        indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+        return cls(indptr, np.asarray(cols, dtype=np.int64), data, shape,
+                   monotone=monotone)
+
+    @property
+    def nnz(self):
+        """int: Number of stored entries."""
+        return len(self.indices)
+
+    @property
+    def rows(self):
+        """1darray: Row index of each stored entry."""
+        if self._rows is None:
+            self._rows = np.repeat(np.arange(self.shape[0]),
+                                   np.diff(self.indptr))
+        return self._rows
+
+    def with_data(self, data, monotone=None):
+        """Get a matrix sharing this sparsity pattern with different data.
+
+        Parameters
+        ----------
+        data : 1darray
+            Value of each stored entry.
+        monotone : bool, optional
+            Whether the new matrix is monotone. Defaults to that of self.
+
+        Returns
+        -------
+        SparseCostMatrix
+            A matrix with the same stored entries as self.
+        """
+        if monotone is None:
+            monotone = self.monotone
+        new = SparseCostMatrix(self.indptr, self.indices, data, self.shape,
+                               monotone=monotone)
+        new._rows = self._rows
+        return new
+
+    def zeros_like(self, monotone=False):
+        """Get a matrix of zeros sharing this sparsity pattern."""
+        return self.with_data(np.zeros(self.nnz), monotone=monotone)
+
+    def copy(self):
+        """Get a copy of the matrix. The sparsity pattern is shared."""
+        return self.with_data(self.data.copy())
+
+    def has_same_pattern(self, other):
+        """Check whether another matrix stores exactly the same entries."""
+        if self.indices is other.indices and self.indptr is other.indptr:
+            return True
+        return (self.shape == other.shape
+                and np.array_equal(self.indptr, other.indptr)
+                and np.array_equal(self.indices, other.indices))
+
+    def row_slice(self, row):
+        """Get the slice of the stored entries belonging to a row."""
+        return slice(self.indptr[row], self.indptr[row + 1])
+
+    def row(self, row):
+        """Get the column indices and values stored in a row.
+
+        Returns
+        -------
+        (1darray, 1darray)
+            Column indices of the stored entries and their values.
+        """
+        row_slice = self.row_slice(row)
+        return self.indices[row_slice], self.data[row_slice]
+
+    def positions(self, row, cols):
+        """Find where the given entries of a row are stored.
+
+        Parameters
+        ----------
+        row : int
+            Index of the row.
+        cols : 1darray
+            Indices of columns within the row.
+
+        Returns
+        -------
+        1darray
+            Position of each entry in `data`, or -1 where it is not stored.
+        """
+        start, stop = self.indptr[row], self.indptr[row + 1]
+        row_indices = self.indices[start:stop]
+        cols = np.asarray(cols, dtype=np.int64)
+        pos = np.searchsorted(row_indices, cols)
+        is_stored = pos < len(row_indices)
+        is_stored[is_stored] = row_indices[pos[is_stored]] == cols[is_stored]
+        return np.where(is_stored, pos + start, -1)
+
+    def __getitem__(self, key):
+        """Look up entries. Entries which are not stored are infinite.
+
+        Supports a single row index, which returns a dense row, and a row
+        index paired with one or more column indices.
+        """
+        if not isinstance(key, tuple):
+            dense_row = np.full(self.shape[1], np.inf)
+            cols, vals = self.row(key)
+            dense_row[cols] = vals
+            return dense_row
+
+        row, cols = key
+        pos = self.positions(row, np.atleast_1d(cols))
+        values = np.full(len(pos), np.inf)
+        values[pos >= 0] = self.data[pos[pos >= 0]]
+        if np.ndim(cols) == 0:
+            return values[0]
+        return values
+
+    def __setitem__(self, key, value):
+        """Set entries of a row. Entries which are not stored are ignored."""
+        row, cols = key
+        pos = self.positions(row, np.atleast_1d(cols))
+        is_stored = pos >= 0
+        value = np.broadcast_to(value, pos.shape)[is_stored]
+        pos = pos[is_stored]
+        if self.monotone:
+            value = np.maximum(self.data[pos], value)
+        self.data[pos] = value
+
+    def set_data(self, value):
+        """Set the value of every stored entry.
+
+        Parameters
+        ----------
+        value : SparseCostMatrix or 1darray or float
+            New values. A matrix must have the same sparsity pattern.
+        """
+        if isinstance(value, SparseCostMatrix):
+            if not self.has_same_pattern(value):
+                raise ValueError("Sparse cost matrices store different entries.")
+            value = value.data
+        if self.monotone:
+            np.maximum(self.data, value, out=self.data)
+        else:
+            self.data[:] = value
+
+    def min(self):
+        """Get the smallest entry of the matrix."""
+        if self.nnz == 0:
+            return np.inf
+        return self.data.min()
+
+    def count_rows(self, mask=None):
+        """Count the stored entries of each row, optionally only under a mask.
+
+        Parameters
+        ----------
+        mask : 1darray(bool), optional
+            Indicators of which stored entries to count.
+
+        Returns
+        -------
+        1darray
+            The number of (masked) stored entries in each row.
+        """
+        rows = self.rows if mask is None else self.rows[mask]
+        return np.bincount(rows, minlength=self.shape[0])
+
+    def select(self, keep, col_is_kept=None):
+        """Get a matrix containing only some of the stored entries.
+
+        Parameters
+        ----------
+        keep : 1darray(bool)
+            Indicators of which stored entries to keep.
+        col_is_kept : 1darray(bool), optional
+            Indicators of which columns to keep. Entries in the other columns
+            are discarded and the remaining columns are renumbered.
+
+        Returns
+        -------
+        SparseCostMatrix
+            A matrix containing only the kept entries.
+        """
+        shape = self.shape
+        if col_is_kept is not None:
+            keep = keep & col_is_kept[self.indices]
+            shape = (self.shape[0], int(np.sum(col_is_kept)))
+        indptr = np.zeros_like(self.indptr)
+        np.cumsum(self.count_rows(keep), out=indptr[1:])
+        indices = self.indices[keep]
+        if col_is_kept is not None:
+            indices = (np.cumsum(col_is_kept) - 1)[indices]
+        new = SparseCostMatrix(indptr, indices, self.data[keep], shape,
+                               monotone=self.monotone)
+        new._rows = self.rows[keep]
+        return new
+
+    def toarray(self):
+        """Get a dense copy of the matrix with infinite unstored entries."""
+        dense = np.full(self.shape, np.inf)
+        dense[self.rows, self.indices] = self.data
+        return dense
+
+    def tocsr(self, mask=None):
+        """Get the (masked) sparsity pattern as a boolean csr_matrix."""
+        if mask is None:
+            mask = np.ones(self.nnz, dtype=np.bool_)
+        is_stored = sparse.csr_matrix((mask, self.indices, self.indptr),
+                                      shape=self.shape)
+        is_stored.eliminate_zeros()
+        return is_stored
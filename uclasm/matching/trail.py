@@ -0,0 +1,123 @@
+"""Provide an undo log for backtracking over changes to matching problems."""
+import numpy as np
+
+
+class Trail:
+    """An undo log of the changes made to a matching problem.
+
+    While a matching problem has a trail, it records the previous value of
+    every cost entry it changes, along with any attributes it replaces. A
+    search can then propagate constraints in place, and undo exactly the
+    changes made below a checkpoint when it backtracks, instead of copying the
+    whole problem for each branch. The memory used is proportional to the
+    number of changes rather than to the size of the problem.
+
+    Examples
+    --------
+    >>> mark = smp.checkpoint()
+    >>> smp.add_match(tmplt_idx, world_idx)
+    >>> iterate_to_convergence(smp, reduce_world=False)
+    >>> smp.backtrack(mark)
+
+    Attributes
+    ----------
+    n_entries : int
+        Number of cost entries currently recorded.
+    """
+
+    def __init__(self):
+        self._records = []
+        self.n_entries = 0
+
+    def __len__(self):
+        return len(self._records)
+
+    def mark(self):
+        """Get a position in the trail to later undo back to.
+
+        Returns
+        -------
+        int
+            The current length of the trail.
+        """
+        return len(self._records)
+
+    def record_attr(self, obj, name):
+        """Record the current value of an attribute before it is replaced.
+
+        Parameters
+        ----------
+        obj : object
+            Object owning the attribute.
+        name : str
+            Name of the attribute.
+        """
+        self._records.append(("attr", obj, name, getattr(obj, name)))
+
+    def record_entries(self, obj, name, idxs):
+        """Record the current values of some entries of a cost matrix before
+        they are changed.
+
+        Parameters
+        ----------
+        obj : MatchingProblem
+            Problem owning the cost matrix.
+        name : str
+            Name of the attribute holding the cost matrix.
+        idxs : 1darray
+            Flat indices of the entries of a dense matrix, or positions of
+            the stored entries of a SparseCostMatrix.
+        """
+        if len(idxs) == 0:
+            return
+        values = _flat_values(getattr(obj, name))[idxs]
+        self._records.append(("entries", obj, name, (idxs, values)))
+        self.n_entries += len(idxs)
+
+    def record_assignment(self, obj, name, new_values):
+        """Record the entries of a cost matrix which an assignment of every
+        entry will change.
+
+        Parameters
+        ----------
+        obj : MatchingProblem
+            Problem owning the cost matrix.
+        name : str
+            Name of the attribute holding the cost matrix.
+        new_values : ndarray
+            The values the entries will have after the assignment, with one
+            value for each (stored) entry.
+        """
+        old_values = _flat_values(getattr(obj, name))
+        new_values = np.ravel(new_values)
+        self.record_entries(obj, name, np.flatnonzero(new_values != old_values))
+
+    def undo(self, mark):
+        """Undo every change recorded since a mark, most recent first.
+
+        Parameters
+        ----------
+        mark : int
+            Position in the trail from `mark`.
+        """
+        while len(self._records) > mark:
+            kind, obj, name, value = self._records.pop()
+            if kind == "attr":
+                setattr(obj, name, value)
+            else:
+                idxs, values = value
+                flat_values = _flat_values(getattr(obj, name))
+                if not flat_values.flags.writeable:
+                    # The matrix has since been shared with a copy
+                    obj.own_costs(name.lstrip("_"))
+                    flat_values = _flat_values(getattr(obj, name))
+                # Write around monotonicity, as undoing lowers costs
+                flat_values[idxs] = values
+                self.n_entries -= len(idxs)
+
+
+def _flat_values(costs):
+    """Get a writable flat view of the values of a cost matrix."""
+    if hasattr(costs, "data") and not isinstance(costs, np.ndarray):
+        return costs.data
+    return np.asarray(costs).reshape(-1)
@@ -4,26 +4,42 @@ from dask.diagnostics import ProgressBar
 from scipy.sparse import csr_matrix, dok_matrix
 import pandas as pd
 import numpy as np
+import json
+import os
 
 from .graph import Graph
 from .convert import nodelist_from_edgelist
-from .utils import apply_index_map_to_cols
+from .shared_graph import graph_to_arrays, graph_from_arrays
+from .utils import apply_index_map_to_cols, index_map
+from pandas.api.types import union_categoricals
 
 
 # TODO: Make channel column optional
 # TODO: Store matching problem results to files?
-# TODO: Function for storing graph to file
+
+# Version of the directory layout written by save_graph. Bump this whenever
+# the layout changes in a way older versions of load_graph cannot read.
+GRAPH_FORMAT_VERSION = 1
+GRAPH_MANIFEST = "manifest.json"
 
 
 def load_edgelist(filepath, *,
                   nodelist=None,
                   file_source_col=Graph.source_col,
                   file_target_col=Graph.target_col,
-                  file_channel_col=Graph.channel_col):
+                  file_channel_col=Graph.channel_col,
+                  chunksize=None):
     """Load an edgelist file into a Graph object.
 
     TODO: optional argument for putting the edgelist in a pandas dataframe.
 
+    By default the file is read with dask and the graph keeps the lazy dask
+    edgelist. If `chunksize` is given, the file is instead streamed through
+    pandas a chunk at a time, so the memory used while parsing is bounded by
+    the chunk size. The graph then gets a compact pandas edgelist whose
+    source, target and channel columns are categoricals, and its nodes are
+    numbered in order of first appearance.
+
     Parameters
     ----------
     filepath : str
@@ -39,12 +55,22 @@ def load_edgelist(filepath, *,
         Name of the column in the csv corresponding to the target node.
     file_channel_col : str, optional
         Name of the column in the csv corresponding to the edge type.
+    chunksize : int, optional
+        Number of rows of the file to read at a time. Streams the file
+        instead of reading it with dask.
 
     Returns
     -------
     Graph
         The graph represented by the edgelist.
     """
+    if chunksize is not None:
+        return _load_edgelist_chunked(filepath, chunksize,
+                                      nodelist=nodelist,
+                                      file_source_col=file_source_col,
+                                      file_target_col=file_target_col,
+                                      file_channel_col=file_channel_col)
+
     # Using dask rather than pandas for the read allows us to handle large
     # datasets in parallel.
     edgelist = dd.read_csv(filepath, dtype={
@@ -94,6 +120,120 @@ def load_edgelist(filepath, *,
 
     return Graph(adjs, channels, nodelist, edgelist)
 
+def _codes_from_map(values, val_to_idx, grow=True):
+    """Map values to integer codes, giving new values the next free codes.
+
+    Parameters
+    ----------
+    values : Series
+        Values to be mapped.
+    val_to_idx : dict
+        Map from values to codes. Updated in place with any new values.
+    grow : bool, optional
+        Whether to add new values to the map. If False, new values raise a
+        ValueError.
+
+    Returns
+    -------
+    1darray
+        The code of each value.
+    """
+    # Look up each distinct value once, so that the cost depends on the
+    # values rather than on the size of the map
+    value_codes, uniques = pd.factorize(values)
+    uniques = list(uniques)
+    is_missing = value_codes < 0
+    if is_missing.any():
+        # Missing values are mapped like any other value. NaN only equals
+        # itself, so the same NaN object is always used as the key.
+        value_codes[is_missing] = len(uniques)
+        uniques.append(np.nan)
+    codes = np.array([val_to_idx.get(val, -1) for val in uniques],
+                     dtype=np.int64)
+    is_new = codes < 0
+    if is_new.any():
+        new_vals = [val for val, is_new_val in zip(uniques, is_new)
+                    if is_new_val]
+        if not grow:
+            raise ValueError("Edgelist contains nodes missing from the "
+                             "nodelist, e.g. {}".format(new_vals[0]))
+        codes[is_new] = np.arange(len(val_to_idx),
+                                  len(val_to_idx) + len(new_vals))
+        val_to_idx.update(zip(new_vals, codes[is_new].tolist()))
+    return codes[value_codes]
+
+
+def _load_edgelist_chunked(filepath, chunksize, *, nodelist, file_source_col,
+                           file_target_col, file_channel_col):
+    """Load an edgelist file a chunk at a time. See `load_edgelist`."""
+    node_idxs = {}
+    if nodelist is not None:
+        node_idxs = index_map(nodelist[Graph.node_col])
+    ch_idxs = {}
+
+    # Integer edge table and any other columns, accumulated chunk by chunk
+    edge_srcs, edge_dsts, edge_chs = [], [], []
+    attr_chunks = []
+    attr_cols = None
+
+    core_cols = [file_source_col, file_target_col, file_channel_col]
+    reader = pd.read_csv(filepath, chunksize=chunksize,
+                         dtype={col: str for col in core_cols})
+    for chunk in reader:
+        edge_srcs.append(_codes_from_map(chunk[file_source_col], node_idxs,
+                                         grow=nodelist is None))
+        edge_dsts.append(_codes_from_map(chunk[file_target_col], node_idxs,
+                                         grow=nodelist is None))
+        edge_chs.append(_codes_from_map(chunk[file_channel_col], ch_idxs))
+
+        if attr_cols is None:
+            attr_cols = [col for col in chunk.columns if col not in core_cols]
+        attrs = chunk[attr_cols]
+        # Store repetitive string attributes compactly
+        for col in attr_cols:
+            if attrs[col].dtype == object:
+                attrs = attrs.assign(**{col: attrs[col].astype("category")})
+        attr_chunks.append(attrs)
+
+    n_nodes = len(node_idxs)
+    if nodelist is None:
+        nodelist = pd.DataFrame(list(node_idxs), columns=[Graph.node_col])
+    edge_srcs = np.concatenate(edge_srcs)
+    edge_dsts = np.concatenate(edge_dsts)
+    edge_chs = np.concatenate(edge_chs)
+
+    # Number the channels in sorted order, as load_edgelist does
+    channels = sorted(ch_idxs)
+    ch_remap = np.empty(len(channels), dtype=np.int64)
+    for ch_idx, channel in enumerate(channels):
+        ch_remap[ch_idxs[channel]] = ch_idx
+    edge_chs = ch_remap[edge_chs]
+
+    # Duplicate edges are summed into counts
+    adjs = []
+    for ch_idx in range(len(channels)):
+        is_ch = edge_chs == ch_idx
+        adjs.append(csr_matrix((np.ones(np.sum(is_ch), dtype=np.int64),
+                                (edge_srcs[is_ch], edge_dsts[is_ch])),
+                               shape=(n_nodes, n_nodes)))
+
+    node_names = nodelist[Graph.node_col]
+    edgelist = pd.DataFrame({
+        Graph.source_col: pd.Categorical.from_codes(edge_srcs, node_names),
+        Graph.target_col: pd.Categorical.from_codes(edge_dsts, node_names),
+        Graph.channel_col: pd.Categorical.from_codes(edge_chs, channels),
+    })
+    for col in attr_cols:
+        col_chunks = [attrs[col] for attrs in attr_chunks]
+        if all(isinstance(chunk.dtype, pd.CategoricalDtype)
+               for chunk in col_chunks):
+            edgelist[col] = union_categoricals(col_chunks)
+        else:
+            edgelist[col] = pd.concat(col_chunks, ignore_index=True)
+
+    return Graph(adjs, channels, nodelist, edgelist)
+
+
 def load_igraph(filename):
     """
     This function will read all graphs in an igraph file.
@@ -164,3 +304,209 @@ def load_igraph(filename):
             graphs.append(graph)
 
     return graphs
+
+
+# Names of the arrays holding a column, for each kind of encoding
+COLUMN_ARRAYS = {
+    "values": ["values"],
+    "times": ["values"],
+    "masked": ["values", "mask"],
+    "categorical": ["codes", "categories"],
+    "codes": ["codes", "uniques"],
+}
+
+
+def _column_to_arrays(column):
+    """Convert a DataFrame column into arrays which numpy can memory-map.
+
+    Numeric and boolean columns are stored as they are, and nullable ones
+    along with a mask of their missing values. Datetime and timedelta
+    columns are stored as their int64 values. Categorical columns are stored
+    as their codes and categories. String columns are stored as integer
+    codes into an array of their distinct values. Missing values get a code
+    of -1. The dtype of the column is recorded so it can be restored.
+
+    Returns
+    -------
+    (dict, dict(str, ndarray))
+        The encoding of the column, holding the kind of encoding used, and the
+        arrays of the column by name.
+
+    Raises
+    ------
+    ValueError
+        If the column holds values which cannot be stored without changing
+        them, such as objects which are not all strings.
+    """
+    dtype = column.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        categories = dtype.categories
+        if categories.dtype.kind in "biuf":
+            category_values = np.asarray(categories)
+        elif pd.api.types.infer_dtype(categories) == "string":
+            category_values = np.asarray(categories.astype(str), dtype=str)
+        else:
+            raise ValueError("Cannot store the categories of column {} of "
+                             "dtype {}.".format(column.name, categories.dtype))
+        return ({"kind": "categorical", "ordered": bool(dtype.ordered),
+                 "categories_dtype": str(categories.dtype)},
+                {"codes": np.asarray(column.cat.codes, dtype=np.int64),
+                 "categories": category_values})
+    if dtype.kind in "biuf":
+        if isinstance(dtype, np.dtype):
+            return {"kind": "values"}, {"values": np.asarray(column)}
+        # Nullable extension dtypes, such as Int64 and boolean
+        mask = np.asarray(column.isna())
+        return ({"kind": "masked", "dtype": str(dtype)},
+                {"values": column.to_numpy(dtype=dtype.numpy_dtype,
+                                           na_value=0),
+                 "mask": mask})
+    if dtype.kind in "Mm":
+        return ({"kind": "times", "dtype": str(dtype)},
+                {"values": np.asarray(column.array.asi8)})
+    if pd.api.types.infer_dtype(column, skipna=True) in ("string", "empty"):
+        codes, uniques = pd.factorize(column)
+        return ({"kind": "codes", "dtype": str(dtype)},
+                {"codes": codes.astype(np.int64),
+                 "uniques": np.asarray(pd.Index(uniques).astype(str),
+                                       dtype=str)})
+    raise ValueError("Cannot store column {} of dtype {} holding {} values."
+                     .format(column.name, dtype,
+                             pd.api.types.infer_dtype(column, skipna=True)))
+
+
+def _column_from_arrays(encoding, arrays):
+    """Rebuild a DataFrame column from the output of `_column_to_arrays`."""
+    kind = encoding["kind"]
+    if kind == "values":
+        return arrays["values"]
+    if kind == "times":
+        return pd.Series(arrays["values"]).astype(encoding["dtype"]).array
+    if kind == "masked":
+        column = pd.array(np.asarray(arrays["values"]),
+                          dtype=encoding["dtype"])
+        column[np.asarray(arrays["mask"])] = pd.NA
+        return column
+    if kind == "categorical":
+        categories = pd.Index(np.asarray(arrays["categories"]))
+        categories = categories.astype(encoding["categories_dtype"])
+        return pd.Categorical.from_codes(np.asarray(arrays["codes"]),
+                                         categories=categories,
+                                         ordered=encoding["ordered"])
+    codes = arrays["codes"]
+    column = np.asarray(arrays["uniques"], dtype=object)[np.maximum(codes, 0)]
+    column[codes < 0] = np.nan
+    if encoding.get("dtype", "object") != "object":
+        return pd.array(column, dtype=encoding["dtype"])
+    return column
+
+
+def save_graph(graph, dirpath):
+    """Store a graph in a directory of npy files for fast loading.
+
+    The directory holds one npy file per array: the CSR indptr, indices and
+    data of each channel, the node identifiers, derived arrays such as the
+    degrees, and each column of the nodelist and edgelist. String and
+    categorical columns are stored as integer codes into their distinct
+    values, and datetime and timedelta columns as int64 values. Columns which
+    cannot be stored without changing them raise a ValueError, such as
+    object columns holding anything other than strings. A JSON manifest
+    records the format version, the channels and the column names and
+    encodings, and is written last, so a directory without one is
+    incomplete.
+
+    Parameters
+    ----------
+    graph : Graph
+        Graph to be stored. Must have adjacency matrices.
+    dirpath : str
+        Path to the directory. It is created if it does not exist.
+    """
+    os.makedirs(dirpath, exist_ok=True)
+    arrays, metadata = graph_to_arrays(graph)
+
+    def save_array(name, array):
+        np.save(os.path.join(dirpath, name + ".npy"),
+                np.ascontiguousarray(array), allow_pickle=False)
+
+    for name, array in arrays.items():
+        save_array(name, array)
+
+    frames = {"nodelist": graph.nodelist, "edgelist": graph.edgelist}
+    columns = {}
+    for frame_name, frame in frames.items():
+        if frame is None:
+            columns[frame_name] = None
+            continue
+        if hasattr(frame, "compute"):
+            # Edgelists loaded by load_edgelist are dask DataFrames
+            frame = frame.compute()
+        columns[frame_name] = []
+        for col_idx, col in enumerate(frame.columns):
+            encoding, col_arrays = _column_to_arrays(frame[col])
+            for array_name, array in col_arrays.items():
+                save_array("{}_{}_{}".format(frame_name, col_idx, array_name),
+                           array)
+            columns[frame_name].append(dict({"name": col}, **encoding))
+
+    manifest = {
+        "format_version": GRAPH_FORMAT_VERSION,
+        "graph": metadata,
+        "arrays": sorted(arrays),
+        "columns": columns,
+    }
+    with open(os.path.join(dirpath, GRAPH_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def load_graph(dirpath, *, mmap=True, edgelist=True):
+    """Load a graph stored by `save_graph`.
+
+    Parameters
+    ----------
+    dirpath : str
+        Path to the directory holding the graph.
+    mmap : bool, optional
+        Memory-map the arrays instead of reading them into memory. Loading is
+        then nearly instant, and processes which load the same graph share
+        its pages. The graph is read-only in either case.
+    edgelist : bool, optional
+        Whether to rebuild the edgelist DataFrame. The edge source and
+        destination indices are available either way.
+
+    Returns
+    -------
+    Graph
+        The stored graph.
+    """
+    with open(os.path.join(dirpath, GRAPH_MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest["format_version"] != GRAPH_FORMAT_VERSION:
+        raise ValueError("Cannot load graph format version {}, expected {}."
+                         .format(manifest["format_version"],
+                                 GRAPH_FORMAT_VERSION))
+
+    mmap_mode = "r" if mmap else None
+
+    def load_array(name):
+        return np.load(os.path.join(dirpath, name + ".npy"),
+                       mmap_mode=mmap_mode, allow_pickle=False)
+
+    arrays = {name: load_array(name) for name in manifest["arrays"]}
+    graph = graph_from_arrays(arrays, manifest["graph"])
+
+    def load_frame(frame_name):
+        frame = {}
+        for col_idx, col in enumerate(manifest["columns"][frame_name]):
+            prefix = "{}_{}_".format(frame_name, col_idx)
+            col_arrays = {array_name: load_array(prefix + array_name)
+                          for array_name in COLUMN_ARRAYS[col["kind"]]}
+            frame[col["name"]] = _column_from_arrays(col, col_arrays)
+        return pd.DataFrame(frame, columns=[col["name"] for col in
+                                            manifest["columns"][frame_name]])
+
+    graph.nodelist = load_frame("nodelist")
+    graph.nodes = graph.nodelist[graph.node_col]
+    if edgelist and manifest["columns"]["edgelist"] is not None:
+        graph.edgelist = load_frame("edgelist")
+    return graph
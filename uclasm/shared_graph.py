@@ -0,0 +1,275 @@
+"""Share the arrays of a graph between processes without copying them."""
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+from .graph import Graph
+
+# Graph attributes which are published along with the adjacency matrices, so
+# that attached processes do not have to compute their own copies.
+SHARED_PROPERTIES = ["in_degrees", "out_degrees", "self_edges"]
+
+# Arrays are aligned to this many bytes within the shared buffer.
+ALIGNMENT = 64
+
+
+def graph_to_arrays(graph):
+    """Get the arrays and metadata needed to reconstruct a graph.
+
+    The edgelist DataFrame is not included, but the indices of the source and
+    destination of each of its edges are. Numeric node names keep their
+    dtype, and any other node names are stored as strings.
+
+    Parameters
+    ----------
+    graph : Graph
+        Graph to be taken apart. Must have adjacency matrices.
+
+    Returns
+    -------
+    (dict(str, ndarray), dict)
+        The arrays of the graph by name, and the metadata of the graph.
+    """
+    nodes = np.asarray(graph.nodes)
+    if nodes.dtype.kind in "biuf":
+        node_kind = "values"
+    else:
+        # Other node names are stored as fixed width strings, as object arrays
+        # only hold pointers into the memory of the process which made them
+        node_kind = "strings"
+        nodes = np.asarray(graph.nodes.astype(str), dtype=str)
+    arrays = {"nodes": nodes}
+    for ch_idx, adj in enumerate(graph.adjs):
+        adj = sparse.csr_matrix(adj)
+        arrays["adj_{}_indptr".format(ch_idx)] = adj.indptr
+        arrays["adj_{}_indices".format(ch_idx)] = adj.indices
+        arrays["adj_{}_data".format(ch_idx)] = adj.data
+
+    composite_adj = sparse.csr_matrix(graph.composite_adj)
+    arrays["composite_adj_indptr"] = composite_adj.indptr
+    arrays["composite_adj_indices"] = composite_adj.indices
+    arrays["composite_adj_data"] = composite_adj.data
+
+    indptr, indices, counts = graph.sym_edge_counts
+    arrays["sym_edge_counts_indptr"] = indptr
+    arrays["sym_edge_counts_indices"] = indices
+    arrays["sym_edge_counts_counts"] = counts
+
+    for name in SHARED_PROPERTIES:
+        arrays[name] = getattr(graph, name)
+
+    if graph.edgelist is not None:
+        arrays["edge_src_idxs"] = graph.edge_src_idxs
+        arrays["edge_dst_idxs"] = graph.edge_dst_idxs
+
+    metadata = {
+        "n_nodes": graph.n_nodes,
+        "node_kind": node_kind,
+        "channels": list(graph.channels),
+        "node_col": graph.node_col,
+        "source_col": graph.source_col,
+        "target_col": graph.target_col,
+        "channel_col": graph.channel_col,
+    }
+    return arrays, metadata
+
+
+def graph_from_arrays(arrays, metadata):
+    """Build a graph around arrays from `graph_to_arrays` without copying.
+
+    The arrays are made read-only, and so is the graph: methods which return
+    new graphs, such as `node_subgraph`, still work, but the adjacency matrices
+    of the graph itself cannot be modified.
+
+    Parameters
+    ----------
+    arrays : dict(str, ndarray)
+        The arrays of the graph by name.
+    metadata : dict
+        The metadata of the graph.
+
+    Returns
+    -------
+    Graph
+        A graph whose adjacency matrices and cached attributes are views of
+        the given arrays. It has no edgelist.
+    """
+    for array in arrays.values():
+        array.flags.writeable = False
+
+    n_nodes = metadata["n_nodes"]
+    shape = (n_nodes, n_nodes)
+
+    def csr_from_arrays(prefix):
+        return sparse.csr_matrix((arrays[prefix + "_data"],
+                                  arrays[prefix + "_indices"],
+                                  arrays[prefix + "_indptr"]),
+                                 shape=shape, copy=False)
+
+    adjs = [csr_from_arrays("adj_{}".format(ch_idx))
+            for ch_idx in range(len(metadata["channels"]))]
+    nodelist = pd.DataFrame(arrays["nodes"], columns=[metadata["node_col"]])
+    graph = Graph(adjs, metadata["channels"], nodelist,
+                  node_col=metadata["node_col"],
+                  source_col=metadata["source_col"],
+                  target_col=metadata["target_col"],
+                  channel_col=metadata["channel_col"])
+
+    # Fill in the cached properties of the graph with the shared arrays
+    graph.composite_adj = csr_from_arrays("composite_adj")
+    sym_indptr = arrays["sym_edge_counts_indptr"]
+    sym_indices = arrays["sym_edge_counts_indices"]
+    graph.sym_edge_counts = (sym_indptr, sym_indices,
+                             arrays["sym_edge_counts_counts"])
+    graph.is_nbr = sparse.csr_matrix(
+        (np.ones(len(sym_indices), dtype=np.bool_), sym_indices, sym_indptr),
+        shape=shape, copy=False)
+    for name in SHARED_PROPERTIES:
+        setattr(graph, name, arrays[name])
+    if "edge_src_idxs" in arrays:
+        graph.edge_src_idxs = arrays["edge_src_idxs"]
+        graph.edge_dst_idxs = arrays["edge_dst_idxs"]
+    return graph
+
+
+def _aligned(offset):
+    """Round an offset up to the next multiple of the alignment."""
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _default_shared_dir():
+    """Get a directory whose files are held in memory, if there is one."""
+    # /dev/shm is backed by POSIX shared memory on linux
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+class SharedGraph:
+    """A graph published into a memory-mapped file for other processes.
+
+    The file starts with an 8 byte length and a JSON manifest of the arrays
+    in the file, followed by the arrays themselves. Processes which attach to
+    the file with `attach_graph` map it read-only, so the operating system
+    keeps a single copy of the graph in memory no matter how many processes
+    use it. By default the file is put in /dev/shm when it exists, so it is
+    never written to disk.
+
+    The publishing process owns the file. It should call `unlink` once no
+    more processes need to attach, or use the SharedGraph as a context
+    manager. Processes which have already attached keep working after the
+    file is unlinked.
+
+    Examples
+    --------
+    >>> with publish_graph(world) as shared_world:
+    ...     pool.map(run_query, [(shared_world.path, tmplt)
+    ...                          for tmplt in tmplts])
+
+    Parameters
+    ----------
+    path : str
+        Path to the file holding the graph.
+
+    Attributes
+    ----------
+    path : str
+        Path to the file holding the graph, for use with `attach_graph`.
+    graph : Graph
+        A read-only view of the published graph.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.graph = attach_graph(path)
+
+    def unlink(self):
+        """Remove the file holding the graph."""
+        self.graph = None
+        os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.unlink()
+
+
+def publish_graph(graph, path=None):
+    """Publish the arrays of a graph into a memory-mapped file.
+
+    Parameters
+    ----------
+    graph : Graph
+        Graph to be published. Must have adjacency matrices.
+    path : str, optional
+        Path of the file to create. By default, a new file is created in
+        /dev/shm when it exists and in the temporary directory otherwise.
+
+    Returns
+    -------
+    SharedGraph
+        Handle of the published graph.
+    """
+    arrays, metadata = graph_to_arrays(graph)
+    manifest = dict(metadata, arrays={})
+    offset = 0
+    for array_name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[array_name] = array
+        manifest["arrays"][array_name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps(manifest).encode()
+    data_start = _aligned(8 + len(header))
+
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix="uclasm_graph_", suffix=".bin",
+                                    dir=_default_shared_dir())
+        os.close(fd)
+    # Write to a temporary name so that no process attaches to a partial file
+    tmp_path = path + ".partial"
+    with open(tmp_path, "wb") as f:
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        for array_name, array in arrays.items():
+            f.seek(data_start + manifest["arrays"][array_name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(max(data_start + offset, 1))
+    os.replace(tmp_path, path)
+    return SharedGraph(path)
+
+
+def attach_graph(path):
+    """Attach to a graph published by another process.
+
+    Parameters
+    ----------
+    path : str
+        Path to the file holding the graph.
+
+    Returns
+    -------
+    Graph
+        A read-only graph whose arrays are views of the memory-mapped file.
+    """
+    with open(path, "rb") as f:
+        header_len = int.from_bytes(f.read(8), "little")
+        manifest = json.loads(f.read(header_len).decode())
+    data_start = _aligned(8 + header_len)
+    buffer = np.memmap(path, mode="r")
+    arrays = {}
+    for array_name, info in manifest.pop("arrays").items():
+        dtype = np.dtype(info["dtype"])
+        start = data_start + info["offset"]
+        count = int(np.prod(info["shape"]))
+        array = buffer[start:start + count * dtype.itemsize].view(dtype)
+        arrays[array_name] = array.reshape(info["shape"])
+    return graph_from_arrays(arrays, manifest)
@@ -1,5 +1,8 @@
 """Miscellaneous functions and helpers for the uclasm package."""
+from collections.abc import Mapping
+
 import numpy as np
+import pandas as pd
 
 
 def one_hot(idx, length):
@@ -20,6 +23,86 @@ def index_map(args):
     return {elm: idx for idx, elm in enumerate(args)}
 
 
+class IndexMap(Mapping):
+    """A read-only map from the values of an index to their positions.
+
+    Behaves like the dict returned by `index_map`, but looks values up in
+    the hash table of a pd.Index rather than holding a dict of its own.
+
+    Parameters
+    ----------
+    index : pd.Index
+        Distinct values to take positions in.
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, value):
+        try:
+            idx = self.index.get_loc(value)
+        except (KeyError, TypeError):
+            raise KeyError(value)
+        if not isinstance(idx, (int, np.integer)):
+            # Repeated values have no single position
+            raise KeyError(value)
+        return int(idx)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+def index_dtype(n_values):
+    """Get the smallest of int32 and int64 which can index n_values."""
+    return np.int32 if n_values <= np.iinfo(np.int32).max else np.int64
+
+
+def idxs_of_values(values, index, missing=None):
+    """Get the position of each value within an index.
+
+    Rather than building a dict of the index, this hashes the index once with
+    pandas. Categorical values only require looking up their categories.
+
+    Parameters
+    ----------
+    values : Iterable[str]
+        Values expected to be present in the index.
+    index : pd.Index
+        Distinct values to take positions in.
+    missing : int, optional
+        Position given to values which are not in the index. By default,
+        they raise a KeyError.
+
+    Returns
+    -------
+    1darray(int32 or int64)
+        The position of each value in the index, as int32 unless the index
+        is too long for it.
+
+    Raises
+    ------
+    KeyError
+        If some value is not in the index and `missing` is None.
+    """
+    if isinstance(getattr(values, "dtype", None), pd.CategoricalDtype):
+        values = pd.Categorical(values)
+        category_idxs = index.get_indexer(values.categories)
+        codes = values.codes
+        # Missing values have code -1, and so do categories not in the index
+        idxs = np.where(codes < 0, -1, category_idxs[codes])
+    else:
+        idxs = index.get_indexer(values)
+    is_missing = idxs < 0
+    if np.any(is_missing):
+        if missing is None:
+            raise KeyError(np.asarray(values)[np.flatnonzero(is_missing)[0]])
+        idxs = np.where(is_missing, missing, idxs)
+    return idxs.astype(index_dtype(len(index)))
+
+
 # TODO: change the name of this function
 def invert(dict_of_sets):
     """TODO: Docstring."""
@@ -53,7 +136,13 @@ def apply_index_map_to_cols(df, cols, values):
         Columns of df to operate on.
     values : Iterable[str]
         Values expected to be present in df[cols] to be replaced with their
-        corresponding indexes.
+        corresponding indexes. Entries of df[cols] which are not among them
+        are replaced with NaN, which makes their column float.
     """
-    val_to_idx = index_map(values)
-    df[cols] = df[cols].applymap(val_to_idx.get)
+    index = pd.Index(values)
+    for col in cols:
+        idxs = idxs_of_values(df[col], index, missing=-1)
+        if np.any(idxs < 0):
+            df[col] = np.where(idxs < 0, np.nan, idxs)
+        else:
+            df[col] = idxs